@@ -0,0 +1,267 @@
+import collections
+import threading
+
+from typing import Dict, List, Optional, Set, Tuple
+
+import UniCoin.Blockchain as Blockchain
+
+import logging
+log = logging.getLogger('werkzeug')
+
+BLOCK_WORK = 16 ** 2  # Expected hashes per block at the (fixed) mining difficulty
+MAX_ORPHANS = 256  # Blocks kept while waiting for their parent
+MAX_SIDE_BLOCKS = 1024  # Blocks of side branches kept, those ending the chains with the least work go first
+PRUNE_DEPTH = 100  # Side blocks this far below our tip are forgotten
+
+
+class TreeEntry:
+	"""
+	A block known to the tree, with the cumulative work of the chain it ends.
+	"""
+
+	def __init__(self, block: Blockchain.Block, block_hash: str, work: int):
+		self.block: Blockchain.Block = block
+		self.hash: str = block_hash
+		self.work: int = work
+
+	@property
+	def index(self) -> int:
+		return self.block.index
+
+	@property
+	def parent_hash(self) -> str:
+		return self.block.previous_block_hash
+
+
+class BlockTree:
+	"""
+	Index of every known block by hash, forming a tree rooted at genesis.
+	Blocks of our chain are looked up through the chain itself, only blocks of side branches are kept here.
+	Each side block records the cumulative work of the chain it ends, so the best tip is known without
+	walking any chain. Blocks whose parent is unknown wait in a bounded orphan pool and are connected as soon
+	as their parent arrives. Side blocks are bounded too.
+	"""
+
+	def __init__(self, blockchain: Blockchain.BlockChain, max_orphans: int = MAX_ORPHANS,
+				 max_side_blocks: int = MAX_SIDE_BLOCKS):
+		"""
+		:param blockchain: Our (active) chain.
+		:param max_orphans: Orphans kept before the oldest ones are dropped.
+		:param max_side_blocks: Side blocks kept before the ones with the least work are dropped.
+		"""
+		self.blockchain: Blockchain.BlockChain = blockchain
+		self.max_orphans: int = max_orphans
+		self.max_side_blocks: int = max_side_blocks
+		self._side: Dict[str, TreeEntry] = dict()  # Hash -> blocks outside of our chain
+		self._children: Dict[str, Set[str]] = dict()  # Parent hash -> hashes of side blocks
+		self._orphans: collections.OrderedDict = collections.OrderedDict()  # Hash -> block, oldest first
+		self._orphans_by_parent: Dict[str, List[str]] = dict()  # Parent hash -> hashes of orphans
+		self._lock = threading.RLock()
+
+	def chain_work(self) -> int:
+		"""
+		:return: Cumulative work of our chain.
+		"""
+		return self.blockchain.size * BLOCK_WORK
+
+	def _entry(self, block_hash: str) -> Optional[TreeEntry]:
+		entry = self._side.get(block_hash)
+		if entry is not None:
+			return entry
+		block = self.blockchain.find_block(block_hash)
+		if block is not None:
+			return TreeEntry(block, block_hash, (block.index + 1) * BLOCK_WORK)
+		return None
+
+	def __contains__(self, block_hash: str):
+		with self._lock:
+			return block_hash in self._orphans or self._entry(block_hash) is not None
+
+	def is_orphan(self, block_hash: str) -> bool:
+		return block_hash in self._orphans
+
+	def add(self, block: Blockchain.Block) -> List[Blockchain.Block]:
+		"""
+		Index a block. Its header is checked against its parent, blocks with an unknown parent become orphans.
+		:return: The blocks that joined the tree, the block itself followed by the orphans it connected,
+		empty if the block is known, an orphan, invalid or dropped right away to bound the side blocks.
+		"""
+		block_hash = block.calculate_hash()
+		with self._lock:
+			if block_hash in self._orphans or self._entry(block_hash) is not None:
+				return []
+
+			parent = self._entry(block.previous_block_hash)
+			if parent is None:
+				self.__add_orphan(block_hash, block)
+				return []
+
+			if not self.__attach(block, block_hash, parent):
+				return []
+			connected = [block]
+
+			pending = [block_hash]  # Connect the orphans waiting for the new blocks
+			while pending:
+				parent = self._side[pending.pop()]
+				for orphan_hash in self._orphans_by_parent.pop(parent.hash, ()):
+					orphan = self._orphans.pop(orphan_hash)
+					if self.__attach(orphan, orphan_hash, parent):
+						connected.append(orphan)
+						pending.append(orphan_hash)
+			if len(connected) > 1:
+				log.debug(f'[TREE] Connected {len(connected) - 1} orphans')
+			if len(self._side) > self.max_side_blocks:
+				self.__prune()
+				connected = [block for block in connected if block.calculate_hash() in self._side]
+			return connected
+
+	def block_connected(self, block: Blockchain.Block) -> List[Blockchain.Block]:
+		"""
+		A block was appended to our chain, connect the orphans that were waiting for it.
+		:return: The orphans that joined the tree (as side blocks, they extend our tip).
+		"""
+		with self._lock:
+			block_hash = block.calculate_hash()
+			self.__remove(block_hash)
+			connected = []
+			for orphan_hash in self._orphans_by_parent.pop(block_hash, ()):
+				orphan = self._orphans.pop(orphan_hash)
+				connected.extend(self.add(orphan))  # Its parent is now found through our chain
+			return connected
+
+	def __attach(self, block: Blockchain.Block, block_hash: str, parent: TreeEntry) -> bool:
+		if not Blockchain.verify_header(block.header(), parent.block.header()):
+			log.debug(f'[TREE] Invalid header of block \'{block.index}\' ({block_hash})')
+			return False
+		self.__index(TreeEntry(block, block_hash, parent.work + BLOCK_WORK))
+		return True
+
+	def __index(self, entry: TreeEntry):
+		self._side[entry.hash] = entry
+		self._children.setdefault(entry.parent_hash, set()).add(entry.hash)
+
+	def __remove(self, block_hash: str) -> Optional[TreeEntry]:
+		"""
+		Forget a side block alone, its side children (if any) are kept.
+		"""
+		entry = self._side.pop(block_hash, None)
+		if entry is not None:
+			siblings = self._children[entry.parent_hash]
+			siblings.discard(block_hash)
+			if not siblings:
+				del self._children[entry.parent_hash]
+		return entry
+
+	def _is_tip(self, block_hash: str) -> bool:
+		"""
+		:return: Whether no side block builds on the block.
+		"""
+		return not self._children.get(block_hash)
+
+	def __add_orphan(self, block_hash: str, block: Blockchain.Block):
+		self._orphans[block_hash] = block
+		self._orphans_by_parent.setdefault(block.previous_block_hash, []).append(block_hash)
+		while len(self._orphans) > self.max_orphans:
+			old_hash, old = self._orphans.popitem(last=False)
+			siblings = self._orphans_by_parent[old.previous_block_hash]
+			siblings.remove(old_hash)
+			if not siblings:
+				del self._orphans_by_parent[old.previous_block_hash]
+		log.debug(f'[TREE] Block \'{block.index}\' ({block_hash}) is an orphan, {len(self._orphans)} in the pool')
+
+	def missing_parent(self, block_hash: str) -> Optional[str]:
+		"""
+		:return: Hash of the unknown block at the root of the orphans leading to `block_hash`,
+		None if the block is not an orphan.
+		"""
+		with self._lock:
+			orphan = self._orphans.get(block_hash)
+			while orphan is not None:
+				block_hash = orphan.previous_block_hash
+				orphan = self._orphans.get(block_hash)
+			return block_hash if self._entry(block_hash) is None else None
+
+	def best_tip(self) -> Optional[TreeEntry]:
+		"""
+		:return: The side block ending the chain with the most work, if it has more work than our chain.
+		"""
+		with self._lock:
+			best = max(self._side.values(), key=lambda entry: entry.work, default=None)
+			return best if best is not None and best.work > self.chain_work() else None
+
+	def branch(self, tip: TreeEntry) -> Tuple[int, List[Blockchain.Block]]:
+		"""
+		:return: Tuple (fork point, blocks from the fork point to `tip`) leading our chain to `tip`.
+		"""
+		with self._lock:
+			blocks = []
+			entry = tip
+			while entry.hash in self._side:
+				blocks.append(entry.block)
+				entry = self._entry(entry.parent_hash)
+			blocks.reverse()
+			return entry.index + 1, blocks
+
+	def discard(self, block_hash: str):
+		"""
+		Forget a side block that turned out to be invalid, along with its descendants.
+		"""
+		with self._lock:
+			pending = [block_hash]
+			while pending:
+				parent_hash = pending.pop()
+				pending.extend(self._children.get(parent_hash, ()))
+				self.__remove(parent_hash)
+
+	def chain_changed(self):
+		"""
+		Our chain was reorganized: move the blocks that joined it out of the side blocks, index the ones that
+		left it and forget side branches buried too deep to matter.
+		"""
+		with self._lock:
+			for block_hash in [h for h in self._side if self.blockchain.find_block(h) is not None]:
+				self.__remove(block_hash)
+			self.__prune()
+
+	def __prune(self):
+		"""
+		Forget side branches whose tip is buried `PRUNE_DEPTH` below our tip without beating our chain, then,
+		while there are more than `max_side_blocks`, the tips with the least work (never the best tip).
+		Only tips are dropped, so every kept block still has its branch down to our chain.
+		"""
+		floor = self.blockchain.size - PRUNE_DEPTH
+		chain_work = self.chain_work()
+		pending = [h for h, entry in self._side.items() if entry.index < floor and self._is_tip(h)]
+		while pending:
+			entry = self._side[pending.pop()]
+			if entry.work > chain_work:
+				continue  # Still worth switching to
+			self.__remove(entry.hash)
+			if entry.parent_hash in self._side and self._is_tip(entry.parent_hash):
+				pending.append(entry.parent_hash)  # Buried deeper, with less work
+
+		best = self.best_tip()
+		while len(self._side) > self.max_side_blocks:
+			lowest = min(
+				(entry for h, entry in self._side.items() if self._is_tip(h) and entry is not best),
+				key=lambda entry: entry.work, default=None
+			)
+			if lowest is None:
+				break  # Only the branch of the best tip is left
+			log.debug(f'[TREE] Side blocks full, dropping block \'{lowest.index}\' ({lowest.hash})')
+			self.__remove(lowest.hash)
+
+	def block_disconnected(self, block: Blockchain.Block):
+		"""
+		A block left our chain during a reorganization, keep it as a side block.
+		"""
+		block_hash = block.calculate_hash()
+		with self._lock:
+			self.__index(TreeEntry(block, block_hash, (block.index + 1) * BLOCK_WORK))
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				'side_blocks': len(self._side),
+				'orphans': len(self._orphans),
+			}
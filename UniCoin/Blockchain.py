@@ -1,22 +1,49 @@
 import hashlib
 import json
 import collections
+import re
+import struct
 import time
 
 import UniCoin.Transactions as Transactions
 
-from typing import List, Tuple, Set
+import UniCoin.helpers.encoding as encoding
+import UniCoin.helpers.hashing as hashing
+from UniCoin.helpers.hashing import HashCache
+from typing import List, Tuple, Set, Dict, Iterable, Optional
 from Crypto.Hash import SHA256
 
 import logging
 
 log = logging.getLogger('werkzeug')
 
+# Guesses checked per `ProofVerifier.search` call by `proof_of_work`.
+PROOF_BATCH = 10000
 
-def verify_proof(prev_proof, proof, difficulty=2) -> bool:
+# Proofs are appended to the header prefix as 8 bytes little-endian (see `BlockHeader`).
+PROOF_STRUCT = struct.Struct('<Q')
+
+# Hashes are stored raw in packed headers, only lowercase hex SHA256 digests fit.
+SHA256_HEX = re.compile('[0-9a-f]{64}')
+
+# Previous hash of the genesis block.
+GENESIS_PREVIOUS_HASH = SHA256.new(b'Samira-mira-mira-e-e-Waka-Waka-e-e').hexdigest()
+
+
+def block_reward(index: int) -> int:
+    """
+	Reduce block reward by 5 per 4 mining operations.
+	Total coins in circulation should be 1050
+	:param index: Index of the block.
+	"""
+    return max([0, 50 - 5 * ((index + 1) // 4)])
+
+
+def verify_proof(prefix: bytes, proof: int, difficulty=2) -> bool:
     """
 	Verifying if the Proof-of-Work is correct, based on a specific difficulty.
-	:param prev_proof: Proof-of-Work of previous block.
+	The hash of the whole header (the block hash) must start with `difficulty` '1' hex digits.
+	:param prefix: Header of the block without its proof, see `BlockHeader.prefix`.
 	:param proof: Proof-of-Work that is to be checked.
 	:param difficulty: Difficulty level that is to be checked.
 	:return: Whether the Proof-of-Work found is valid or not.
@@ -24,33 +51,226 @@ def verify_proof(prev_proof, proof, difficulty=2) -> bool:
     if difficulty <= 0:
         raise ValueError("Difficulty must be a positive number!")
 
-    guess = f'{prev_proof}{proof}'.encode()
+    guess = prefix + PROOF_STRUCT.pack(proof)
     guess_hash = SHA256.new(guess).hexdigest()
     return guess_hash[:difficulty] == "1" * difficulty
 
 
-def proof_of_work(prev_proof: int, difficulty=2) -> int:
+def proof_of_work(prefix: bytes, difficulty=2) -> int:
     """
 	Proof-of-Work algorithm. Increment a random number and trying to verify it
 	each time until Proof-of-work returns True.
-	:param prev_proof: Proof-of-Work of previous block.
+	:param prefix: Header of the block without its proof, see `BlockHeader.prefix`.
 	:param difficulty: Difficulty level of mining.
 	:return:
 	"""
-    proof = 0
-    while verify_proof(prev_proof, proof, difficulty) is False:
-        proof += 1
+    verifier = ProofVerifier(prefix, difficulty)
+    proof = None
+    start = 0
+    while proof is None:
+        proof = verifier.search(start, start + PROOF_BATCH)
+        start += PROOF_BATCH
 
     return proof
 
 
-class Block:
+class ProofVerifier:
+    """
+	Batched Proof-of-Work verification for a single block header.
+	The hasher state of the header prefix is computed once and copied for every guess, and the
+	raw digest is compared against a precomputed target instead of the hex digest.
+	Gives the same answers as `verify_proof`.
+	"""
+
+    def __init__(self, prefix: bytes, difficulty=2):
+        """
+		:param prefix: Header of the block without its proof, see `BlockHeader.prefix`.
+		:param difficulty: Difficulty level that is to be checked.
+		"""
+        if difficulty <= 0:
+            raise ValueError("Difficulty must be a positive number!")
+
+        self._prefix = hashlib.sha256(prefix)
+        # Every pair of '1' hex digits is a 0x11 byte, an odd difficulty also needs a '1' high nibble.
+        self._target: bytes = b'\x11' * (difficulty // 2)
+        self._half: bool = difficulty % 2 == 1
+        self._unreachable: bool = difficulty > self._prefix.digest_size * 2
+
+    def _matches(self, digest: bytes) -> bool:
+        if not digest.startswith(self._target):
+            return False
+        return not self._half or digest[len(self._target)] >> 4 == 1
+
+    def verify(self, proof) -> bool:
+        """
+		:param proof: Proof-of-Work that is to be checked.
+		:return: Whether the Proof-of-Work found is valid or not.
+		"""
+        if self._unreachable:
+            return False
+
+        h = self._prefix.copy()
+        h.update(PROOF_STRUCT.pack(proof))
+        return self._matches(h.digest())
+
+    def search(self, start: int, stop: int, step: int = 1):
+        """
+		Check the integer proofs of `range(start, stop, step)` in order.
+		:return: The first valid proof, or None if there is none in the range.
+		"""
+        if self._unreachable:
+            return None
+
+        prefix = self._prefix
+        target = self._target
+        pack = PROOF_STRUCT.pack
+        if self._half:
+            nibble = len(target)
+            for proof in range(start, stop, step):
+                h = prefix.copy()
+                h.update(pack(proof))
+                digest = h.digest()
+                if digest.startswith(target) and digest[nibble] >> 4 == 1:
+                    return proof
+        else:
+            for proof in range(start, stop, step):
+                h = prefix.copy()
+                h.update(pack(proof))
+                if h.digest().startswith(target):
+                    return proof
+        return None
+
+    def verify_many(self, proofs) -> List[bool]:
+        """
+		:param proofs: Proofs-of-Work that are to be checked.
+		:return: Whether each Proof-of-Work is valid or not.
+		"""
+        return [self.verify(proof) for proof in proofs]
+
+
+class BlockHeader(HashCache, encoding.BinarySerializable):
+    """
+	Block Header
+	------------------
+	Fixed size summary of a block: its index, the hash of the previous block, the Merkle root of its transactions,
+	its timestamp and its Proof-of-Work. The block hash is the SHA256 of the packed header, so linking and
+	Proof-of-Work are checked on headers alone while the Merkle root still commits to every transaction.
+	The proof comes last, miners hash the same prefix with every guess.
+	"""
+    _hashed_fields = ('index', 'previous_block_hash', 'merkle_root', 'timestamp', 'proof')
+    _kind = encoding.KIND_BLOCK_HEADER
+    _struct = struct.Struct('<I32s32sdQ')
+    SIZE = _struct.size
+
+    def __init__(self, index: int, previous_block_hash: str, merkle_root: str, timestamp: float, proof: int = 0):
+        self.index: int = index
+        self.previous_block_hash: str = previous_block_hash
+        self.merkle_root: str = merkle_root
+        self.timestamp: float = timestamp
+        self.proof: int = proof
+
+    @classmethod
+    def check_fields(cls, index: int, proof: int, *hashes: str):
+        """
+		Reject received header fields that could not be packed, before anything is hashed.
+		:param hashes: Previous hash, Merkle root...
+		:raises ValueError: If a field is out of range or a hash is not a hex SHA256 digest.
+		"""
+        if not 0 <= index < 2 ** 32:
+            raise ValueError(f'Block index \'{index}\' is out of range.')
+        if not 0 <= proof < 2 ** 64:
+            raise ValueError(f'Proof \'{proof}\' is out of range.')
+        for value in hashes:
+            if not isinstance(value, str) or not SHA256_HEX.fullmatch(value):
+                raise ValueError(f'Expected a SHA256 hash, got \'{value}\'.')
+
+    def packed(self) -> bytes:
+        """
+		:return: The header as `SIZE` bytes, hashes stored raw.
+		"""
+        return self._cached('packed', lambda: self._struct.pack(
+            self.index,
+            self.__digest(self.previous_block_hash),
+            self.__digest(self.merkle_root),
+            self.timestamp,
+            self.proof
+        ))
+
+    @staticmethod
+    def __digest(value: str) -> bytes:
+        digest = bytes.fromhex(value)
+        if len(digest) != 32:
+            raise ValueError(f'Expected a SHA256 hash, got \'{value}\'.')
+        return digest
+
+    def prefix(self) -> bytes:
+        """
+		:return: The packed header without its proof, what the Proof-of-Work is searched on.
+		"""
+        return self.packed()[:-PROOF_STRUCT.size]
+
+    def calculate_hash(self) -> str:
+        """
+		:return: Hash of the block, the SHA256 of the packed header.
+		"""
+        return self._cached('sha256', lambda: SHA256.new(self.packed()).hexdigest())
+
+    def check_proof(self, difficulty=2) -> bool:
+        """
+		:return: Whether the header carries a valid Proof-of-Work, see `verify_proof`.
+		"""
+        return self.calculate_hash()[:difficulty] == "1" * difficulty
+
+    def to_dict(self):
+        return collections.OrderedDict({
+            'index': self.index,
+            'hash': self.calculate_hash(),
+            'merkle_root': self.merkle_root,
+            'proof': self.proof,
+            'previous_hash': self.previous_block_hash,
+            'timestamp': self.timestamp})
+
+    @classmethod
+    def from_json(cls, data):
+        header = cls(
+            index=int(data['index']),
+            previous_block_hash=str(data['previous_hash']),
+            merkle_root=str(data['merkle_root']),
+            timestamp=float(data['timestamp']),
+            proof=int(data['proof'])
+        )
+        cls.check_fields(header.index, header.proof, header.previous_block_hash, header.merkle_root)
+        if 'hash' in data and data['hash'] != header.calculate_hash():
+            raise ValueError(f'Header \'{header.index}\' does not match its hash.')
+        return header
+
+    def write(self, writer: encoding.Writer):
+        writer.raw(self.packed())
+
+    @classmethod
+    def read(cls, reader: encoding.Reader):
+        index, previous_block_hash, merkle_root, timestamp, proof = reader.unpack(cls._struct)
+        return cls(
+            index=index,
+            previous_block_hash=previous_block_hash.hex(),
+            merkle_root=merkle_root.hex(),
+            timestamp=timestamp,
+            proof=proof
+        )
+
+    def __repr__(self):
+        return json.dumps(self.to_dict())
+
+
+class Block(HashCache, encoding.BinarySerializable):
     """
 	Block Instance
 	------------------
-	A single block of the blockchain, containing the proof-of-work of the previous block alongside with the
-	verified transactions.
+	A single block of the blockchain, made of its header (see `BlockHeader`) and its verified transactions.
+	The canonical JSON, the header and the hashes are cached until one of the hashed fields is reassigned.
 	"""
+    _hashed_fields = ('index', 'proof', 'verified_transactions', 'previous_block_hash', 'timestamp')
+    _kind = encoding.KIND_BLOCK
 
     def __init__(self, index, proof=0, verified_transactions=None, previous_block_hash: str = None,
                  timestamp: float = None):
@@ -60,11 +280,12 @@ class Block:
         self.previous_block_hash: str = previous_block_hash
         self.timestamp: float = timestamp or time.time()
 
-    def check_validity(self, prev_block, lite=True, blockchain=None) -> bool:
+    def check_validity(self, prev_block, lite=True, blockchain=None, signatures: List[bool] = None) -> bool:
         """
 		:param prev_block:
 		:param lite: Whether the client is Lite or not (Client or Miner).
 		:argument blockchain: Blockchain must be provided if checking for non-lite validity.
+		:param signatures: Already verified signatures of the transactions (see `Transactions.SignatureVerifier`).
 		:return: Whether the block is valid or not
 		"""
         if not isinstance(prev_block, Block):
@@ -81,7 +302,7 @@ class Block:
         elif self.timestamp <= prev_block.timestamp:
             log.debug(f'[BLOCK - {self.hash}] Verification Failure (TIMESTAMP)')
             return False
-        elif not verify_proof(prev_block.proof, self.proof):
+        elif not self.header().check_proof():
             log.debug(f'[BLOCK - {self.hash}] Verification Failure (PROOF)')
             return False
         elif not self._verify_coinbase(lite=True):  # Lite verification of coinbase (No need to check each transaction)
@@ -89,47 +310,74 @@ class Block:
             return False
         else:
             if not lite:
-                # Verify each transaction that is valid
+                # Verify all signatures as a batch, then each transaction that is valid
+                if signatures is None:
+                    signatures = Transactions.signature_verifier.verify_block(self)
+
                 for indx in range(0, len(self.verified_transactions)):
                     trans = self.verified_transactions[indx]
                     is_coinbase = True if indx == 0 else False
-                    if not trans.check_validity(blockchain=blockchain, is_coinbase=is_coinbase):
+                    if not signatures[indx]:
+                        log.debug(f'[BLOCK - {self.hash}] Verification Failure (TRANSACTION SIGNATURE)')
+                        return False
+                    if not trans.check_validity(blockchain=blockchain, is_coinbase=is_coinbase, check_signature=False):
                         log.debug(f'[BLOCK - {self.hash}] Verification Failure (TRANSACTION INVALID)')
                         return False
 
-                if not self._verify_coinbase(lite=True):
+                if not self._verify_coinbase(lite=False):
                     log.debug(f'[BLOCK - {self.hash}] Verification Failure (COINBASE)')
                     return False
 
             return True
 
     def _verify_coinbase(self, lite=False) -> bool:
+        """
+		:param lite: Only check that the coinbase pays at least the block reward. Otherwise it may not pay more than
+		the reward plus the fees of the block's transactions, which must already be validated (their inputs are then
+		valued from the outputs they spend).
+		:return: Whether the coinbase pays a valid amount.
+		"""
         coinbase = self.verified_transactions[0]
+        if coinbase.balance_output < self.reward:
+            return False
         if lite:
-            return coinbase.balance_output >= self.reward
-        else:
-            trans_fees = [trans.transaction_fee for trans in self.verified_transactions]
-            return trans_fees == coinbase.balance_output
+            return True
+        fees = sum(trans.transaction_fee for trans in self.verified_transactions[1:])
+        return coinbase.balance_output <= self.reward + fees
 
     def calculate_hash(self) -> str:
         """
-		Returns the hash of the block by converting its instance into a JSON String.
+		Returns the hash of the block's header, which commits to the transactions through the Merkle root.
 		:return: Hash of the block
 		"""
-        return SHA256.new(self.to_json()).hexdigest()
+        return self.header().calculate_hash()
 
     @property
     def reward(self) -> int:
         """
-		Reduce block reward by 5 per 4 mining operations.
-		Total coins in circulation should be 1050
-		:return:
+		:return: Reward of the block's miner, see `block_reward`.
 		"""
-        return max([0, 50 - 5 * ((self.index + 1) // 4)])
+        return block_reward(self.index)
 
     @property
     def hash(self) -> str:
-        return hashlib.md5(self.to_json()).hexdigest()
+        return self._cached('md5', lambda: hashlib.md5(self.to_json()).hexdigest())
+
+    @property
+    def merkle_root(self) -> str:
+        """
+		:return: Root of the Merkle tree of the block's transactions.
+		"""
+        return self._cached('merkle', lambda: hashing.merkle_root(
+            [merkle_leaf(trans) for trans in self.verified_transactions]
+        ))
+
+    def merkle_proof(self, transaction_index: int) -> List[Tuple[str, str]]:
+        """
+		:param transaction_index: Position of the transaction in the block.
+		:return: Inclusion proof of the transaction against `merkle_root`, see `verify_merkle_proof`.
+		"""
+        return hashing.merkle_branch([merkle_leaf(trans) for trans in self.verified_transactions], transaction_index)
 
     def extract_UTXOs(self) -> set():
         resp = set()
@@ -139,7 +387,8 @@ class Block:
                 utxo: Transactions.TransactionInput = Transactions.TransactionInput(
                     block_index=self.index,
                     transaction_index=t_indx,
-                    output_index=o_indx
+                    output_index=o_indx,
+                    balance=output.value
                 )
                 resp.add(utxo)
         return resp
@@ -161,11 +410,24 @@ class Block:
                     utxo: Transactions.TransactionInput = Transactions.TransactionInput(
                         block_index=self.index,
                         transaction_index=t_indx,
-                        output_index=o_indx
+                        output_index=o_indx,
+                        balance=output.value
                     )
                     resp.add(utxo)
         return resp
 
+    def header(self) -> BlockHeader:
+        """
+		:return: The block without its transactions, enough to check linking and Proof-of-Work.
+		"""
+        return self._cached('header', lambda: BlockHeader(
+            index=self.index,
+            previous_block_hash=self.previous_block_hash,
+            merkle_root=self.merkle_root,
+            timestamp=self.timestamp,
+            proof=self.proof
+        ))
+
     def to_dict(self):
         return collections.OrderedDict({
             'index': self.index,
@@ -175,6 +437,8 @@ class Block:
             'timestamp': self.timestamp})
 
     def to_json(self, indent=None):
+        if indent is None:
+            return self._cached('json', lambda: json.dumps(self.to_dict(), sort_keys=True).encode('utf-8'))
         return json.dumps(self.to_dict(), sort_keys=True, indent=indent).encode('utf-8')
 
     @classmethod
@@ -184,7 +448,36 @@ class Block:
         verified_transactions = list(map(Transactions.Transaction.from_json, data['transactions']))
         previous_block_hash = str(data['previous_hash'])
         timestamp = float(data['timestamp'])
+        BlockHeader.check_fields(index, proof, previous_block_hash)
+
+        return cls(
+            index=index,
+            proof=proof,
+            verified_transactions=verified_transactions,
+            previous_block_hash=previous_block_hash,
+            timestamp=timestamp
+        )
+
+    def to_bytes(self) -> bytes:
+        return self._cached('binary', super().to_bytes)
 
+    def write(self, writer: encoding.Writer):
+        writer.u32(self.index)
+        writer.u64(self.proof)
+        writer.string(self.previous_block_hash)
+        writer.f64(self.timestamp)
+        writer.u32(len(self.verified_transactions))
+        for trans in self.verified_transactions:
+            writer.raw(trans.to_bytes()[encoding.HEADER_SIZE:])  # Cached encoding without its message header
+
+    @classmethod
+    def read(cls, reader: encoding.Reader):
+        index = reader.u32()
+        proof = reader.u64()
+        previous_block_hash = reader.string()
+        BlockHeader.check_fields(index, proof, previous_block_hash)
+        timestamp = reader.f64()
+        verified_transactions = [Transactions.Transaction.read(reader) for _ in range(reader.u32())]
         return cls(
             index=index,
             proof=proof,
@@ -200,16 +493,299 @@ class Block:
         return str(self.to_json(indent=4).decode('utf-8'))
 
 
-class BlockChain:
+def merkle_leaf(transaction: Transactions.Transaction) -> bytes:
+    """
+	:return: Leaf of a transaction in the Merkle tree of its block.
+	"""
+    return hashlib.sha256(transaction.to_json()).digest()
+
+
+def verify_merkle_proof(transaction: Transactions.Transaction, proof, merkle_root: str) -> bool:
+    """
+	Check that a transaction is part of a block, knowing only the block's header.
+	:param transaction: The transaction.
+	:param proof: Inclusion proof of the transaction, as returned by `Block.merkle_proof`.
+	:param merkle_root: Merkle root of the block's header.
+	:return: Whether the transaction is included in the block or not.
+	"""
+    return hashing.verify_merkle_branch(merkle_leaf(transaction), proof, merkle_root)
+
+
+def verify_header(header: BlockHeader, prev_header: BlockHeader) -> bool:
+    """
+	Check that a block header links to the previous one and carries a valid Proof-of-Work.
+	:param header: Block header, as returned by `Block.header`.
+	:param prev_header: Header of the previous block.
+	:return: Whether the header is valid or not.
+	"""
+    return header.index == prev_header.index + 1 \
+        and header.previous_block_hash == prev_header.calculate_hash() \
+        and header.timestamp > prev_header.timestamp \
+        and header.check_proof()
+
+
+def encode_headers(headers: List[BlockHeader]) -> bytes:
+    """
+	:return: Binary encoding of a list of headers, `BlockHeader.SIZE` bytes each.
+	"""
+    writer = encoding.Writer(encoding.KIND_HEADERS)
+    writer.u32(len(headers))
+    for header in headers:
+        header.write(writer)
+    return writer.getvalue()
+
+
+def decode_headers(data: bytes) -> List[BlockHeader]:
+    reader = encoding.Reader(data, encoding.KIND_HEADERS)
+    headers = [BlockHeader.read(reader) for _ in range(reader.u32())]
+    reader.finish()
+    return headers
+
+
+def iter_encode_blocks(blocks, count: int):
+    """
+	Binary encoding of a list of blocks, chunk by chunk, for streamed responses.
+	:param blocks: Iterable of blocks.
+	:param count: Number of blocks in the iterable.
+	"""
+    writer = encoding.Writer(encoding.KIND_BLOCKS)
+    writer.u32(count)
+    yield writer.getvalue()
+    for block in blocks:
+        yield block.to_bytes()[encoding.HEADER_SIZE:]  # Cached encoding without its message header
+
+
+def encode_blocks(blocks) -> bytes:
+    """
+	:return: Binary encoding of a list of blocks.
+	"""
+    return b''.join(iter_encode_blocks(blocks, len(blocks)))
+
+
+def decode_blocks(data: bytes) -> List[Block]:
+    reader = encoding.Reader(data, encoding.KIND_BLOCKS)
+    blocks = [Block.read(reader) for _ in range(reader.u32())]
+    reader.finish()
+    return blocks
+
+
+class BlockBranch:
+    """
+	Read-only list of blocks made of the first `fork` blocks of a chain followed by the blocks of a branch.
+	Lets a branch be validated or adopted without copying the common part of the chain.
+	"""
+
+    def __init__(self, blocks, fork: int, branch: List[Block]):
+        self.blocks = blocks
+        self.fork: int = fork
+        self.branch: List[Block] = branch
+
+    def __len__(self):
+        return self.fork + len(self.branch)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[indx] for indx in range(*item.indices(len(self)))]
+
+        indx = item + len(self) if item < 0 else item
+        if not 0 <= indx < len(self):
+            raise IndexError('BlockBranch index out of range')
+        return self.blocks[indx] if indx < self.fork else self.branch[indx - self.fork]
+
+    def __iter__(self):
+        for indx in range(len(self)):
+            yield self[indx]
+
+
+class BlockUndo(encoding.BinarySerializable):
+    """
+	Undo record of a block: the outputs it spent, with their values, in the order they were spent.
+	Disconnecting a block restores them without looking up the blocks that created them.
+	"""
+    _kind = encoding.KIND_BLOCK_UNDO
+
+    def __init__(self, spent: List[Tuple[Transactions.TransactionInput, Transactions.TransactionOutput]] = None):
+        self.spent: List[Tuple[Transactions.TransactionInput, Transactions.TransactionOutput]] = spent or []
+
+    @classmethod
+    def from_block(cls, block: Block, blocks: List[Block]):
+        """
+		Rebuild the undo record of a block from the chain, for blocks connected without one.
+		:param blocks: Chain the block is connected to, used to resolve the spent outputs.
+		"""
+        spent = []
+        for transaction in block.verified_transactions:
+            for inp in transaction.inputs:
+                output = blocks[inp.block_index].verified_transactions[inp.transaction_index].outputs[inp.output_index]
+                spent.append((
+                    Transactions.TransactionInput(inp.block_index, inp.transaction_index, inp.output_index, output.value),
+                    output
+                ))
+        return cls(spent)
+
+    def write(self, writer: encoding.Writer):
+        writer.u32(len(self.spent))
+        for outpoint, output in self.spent:
+            outpoint.write(writer)
+            output.write(writer)
+
+    @classmethod
+    def read(cls, reader: encoding.Reader):
+        spent = []
+        for _ in range(reader.u32()):
+            outpoint = Transactions.TransactionInput.read(reader)
+            output = Transactions.TransactionOutput.read(reader)
+            spent.append((
+                Transactions.TransactionInput(
+                    outpoint.block_index, outpoint.transaction_index, outpoint.output_index, balance=output.value
+                ),
+                output
+            ))
+        return cls(spent)
+
+
+class UTXOSet:
+    """
+	UTXO Set
+	------------------
+	Unspent transaction outputs indexed by outpoint, with a secondary index from recipient address
+	to outpoints. Updated incrementally as blocks are connected and disconnected.
+	"""
+
+    def __init__(self):
+        self._outputs: Dict[Transactions.TransactionInput, Transactions.TransactionOutput] = dict()
+        self._by_address: Dict[str, Set[Transactions.TransactionInput]] = dict()
+
+    def add(self, outpoint: Transactions.TransactionInput, output: Transactions.TransactionOutput):
+        if outpoint.balance != output.value:
+            outpoint = Transactions.TransactionInput(
+                outpoint.block_index, outpoint.transaction_index, outpoint.output_index, balance=output.value
+            )
+        self._outputs[outpoint] = output
+        self._by_address.setdefault(output.recipient_address, set()).add(outpoint)
+
+    def remove(self, outpoint: Transactions.TransactionInput) -> Optional[Transactions.TransactionOutput]:
+        """
+		:return: The output that was unspent, None if the outpoint is not in the set.
+		"""
+        output = self._outputs.pop(outpoint, None)
+        if output is not None:
+            outpoints = self._by_address[output.recipient_address]
+            outpoints.discard(outpoint)
+            if not outpoints:
+                del self._by_address[output.recipient_address]
+        return output
+
+    def get(self, outpoint: Transactions.TransactionInput) -> Optional[Transactions.TransactionOutput]:
+        return self._outputs.get(outpoint)
+
+    def find(self, address: str) -> Set[Transactions.TransactionInput]:
+        """
+		:return: Unspent outpoints of an address, each with its balance set.
+		"""
+        return set(self._by_address.get(address, ()))
+
+    def balance(self, address: str) -> int:
+        return sum(outpoint.balance for outpoint in self._by_address.get(address, ()))
+
+    def connect_block(self, block: Block) -> BlockUndo:
+        """
+		Spend the inputs and add the outputs of a block.
+		:return: Undo record of the block, the outputs it spent.
+		"""
+        spent = []
+        for transaction in block.verified_transactions:
+            for inp in transaction.inputs:
+                output = self.remove(inp)
+                if output is not None:
+                    if inp.balance != output.value:  # Undo records carry the spent values
+                        inp = Transactions.TransactionInput(
+                            inp.block_index, inp.transaction_index, inp.output_index, balance=output.value
+                        )
+                    spent.append((inp, output))
+
+        for t_indx, transaction in enumerate(block.verified_transactions):
+            for o_indx, output in enumerate(transaction.outputs):
+                self.add(Transactions.TransactionInput(block.index, t_indx, o_indx, balance=output.value), output)
+        return BlockUndo(spent)
+
+    def disconnect_block(self, block: Block, undo: BlockUndo):
+        """
+		Undo `connect_block`. Removes the outputs and restores the spent outputs of a block.
+		:param undo: Undo record of the block.
+		"""
+        for t_indx, transaction in enumerate(block.verified_transactions):
+            for o_indx in range(len(transaction.outputs)):
+                self.remove(Transactions.TransactionInput(block.index, t_indx, o_indx))
+
+        for outpoint, output in undo.spent:
+            self.add(outpoint, output)
+
+    def write(self, writer: encoding.Writer):
+        writer.u32(len(self._outputs))
+        for outpoint, output in self._outputs.items():
+            outpoint.write(writer)
+            output.write(writer)
+
+    @classmethod
+    def read(cls, reader: encoding.Reader):
+        utxos = cls()
+        for _ in range(reader.u32()):
+            outpoint = Transactions.TransactionInput.read(reader)
+            utxos.add(outpoint, Transactions.TransactionOutput.read(reader))
+        return utxos
+
+    def copy(self):
+        utxos = UTXOSet()
+        utxos._outputs = dict(self._outputs)
+        utxos._by_address = {address: set(outpoints) for address, outpoints in self._by_address.items()}
+        return utxos
+
+    @classmethod
+    def from_outpoints(cls, outpoints: Iterable[Transactions.TransactionInput], blocks: List[Block]):
+        """
+		Build the index from bare outpoints, resolving each output once from the chain.
+		"""
+        utxos = cls()
+        for outpoint in outpoints:
+            try:
+                block = blocks[outpoint.block_index]
+                output = block.verified_transactions[outpoint.transaction_index].outputs[outpoint.output_index]
+            except IndexError:
+                raise ValueError(f'UTXO {outpoint.to_dict()} does not exist in the chain.')
+            utxos.add(outpoint, output)
+        return utxos
+
+    def __contains__(self, outpoint):
+        return outpoint in self._outputs
+
+    def __iter__(self):
+        return iter(self._outputs)
+
+    def __len__(self):
+        return len(self._outputs)
+
+
+class BlockChain(encoding.BinarySerializable):
     """
 	BlockChain
 	------------------
 	The BlockChain. ¯\_(ツ)_/¯
 	"""
+    _kind = encoding.KIND_BLOCKCHAIN
 
-    def __init__(self, blocks=None, utxos=None):
-        self.blocks: List[Block] = blocks or []
-        self.UTXOs: Set[Transactions.TransactionInput] = utxos or set()
+    def __init__(self, blocks=None, utxos=None, store=None, undo: Dict[int, BlockUndo] = None):
+        """
+		:param blocks: Blocks of the chain, a list or a `Storage.BlockStore`.
+		:param utxos: UTXOSet, or bare outpoints that are resolved against the blocks.
+		:param store: `Storage.ChainStore` persisting the chain, if any.
+		:param undo: Undo records by block index, for chains without a store. Missing ones are rebuilt on demand.
+		"""
+        self.blocks: List[Block] = blocks if blocks is not None else []
+        self.UTXOs: UTXOSet = utxos if isinstance(utxos, UTXOSet) else UTXOSet.from_outpoints(utxos or (), self.blocks)
+        self.store = store
+        self.undo = store.undo if store is not None else (undo if undo is not None else {})
+        self._hash_index: Optional[Dict[str, int]] = None  # Built on the first lookup by hash
 
     @property
     def last_block(self) -> Block:
@@ -219,14 +795,133 @@ class BlockChain:
     def size(self) -> int:
         return len(self.blocks)
 
+    def hash_at(self, indx: int) -> str:
+        """
+		:return: Hash of the block at `indx`.
+		"""
+        return self.blocks[indx].calculate_hash()
+
+    def append_block(self, block: Block):
+        """
+		Append an (already validated) block and connect it to the UTXO set.
+		"""
+        self.blocks.append(block)
+        undo = self.UTXOs.connect_block(block)
+        if self._hash_index is not None:
+            self._hash_index[block.calculate_hash()] = block.index
+        if self.store is not None:
+            self.store.block_connected(self, undo)
+        else:
+            self.undo[block.index] = undo
+        return undo
+
+    def pop_block(self) -> Block:
+        """
+		Remove the last block and disconnect it from the UTXO set, using its undo record.
+		"""
+        block, _ = self.disconnect_tip()
+        return block
+
+    def disconnect_tip(self) -> Tuple[Block, BlockUndo]:
+        """
+		Remove the last block and disconnect it from the UTXO set, using its undo record.
+		:return: The block and its undo record.
+		"""
+        undo = self.block_undo(self.size - 1)
+        block = self.blocks.pop()
+        self.UTXOs.disconnect_block(block, undo)
+        if self._hash_index is not None:
+            self._hash_index.pop(block.calculate_hash(), None)
+        if self.store is not None:
+            self.store.block_disconnected(self)
+        else:
+            self.undo.pop(block.index, None)
+        return block, undo
+
+    def block_undo(self, indx: int) -> BlockUndo:
+        """
+		:return: Undo record of a block of the chain, rebuilt from the chain if it was not kept.
+		"""
+        try:
+            return self.undo[indx]
+        except (KeyError, IndexError):
+            return BlockUndo.from_block(self.blocks[indx], self.blocks)
+
+    def reorganize(self, fork: int, blocks: List[Block]):
+        """
+		Switch the chain to another branch in place. Blocks after the fork point are disconnected using their
+		undo records, then the (validated) blocks of the branch are connected. Costs the depth of the
+		reorganization, not the length of the chain.
+		:param fork: Number of blocks in common.
+		:param blocks: Blocks following the fork point.
+		:return: Tuple of the disconnected and the connected (block, undo record) pairs, in the order it happened.
+		"""
+        if fork > self.size or (blocks and fork > 0
+                                and blocks[0].previous_block_hash != self.blocks[fork - 1].calculate_hash()):
+            raise ValueError(f'Branch does not attach to the chain at \'{fork}\'.')
+
+        disconnected = []
+        while self.size > fork:
+            disconnected.append(self.disconnect_tip())
+        connected = [(block, self.append_block(block)) for block in blocks]
+        return disconnected, connected
+
+    def find_block(self, block_hash: str) -> Optional[Block]:
+        """
+		:param block_hash: SHA256 hash of the block (`Block.calculate_hash`).
+		:return: The block of our chain with that hash, None if there is none.
+		"""
+        if self._hash_index is None:
+            self._hash_index = {block.calculate_hash(): block.index for block in self.blocks}
+
+        indx = self._hash_index.get(block_hash)
+        if indx is None or indx >= self.size:
+            return None
+        block = self.blocks[indx]
+        return block if block.calculate_hash() == block_hash else None
+
+    def check_branch(self, fork: int, blocks: List[Block]) -> Optional[int]:
+        """
+		Fully validate a branch forking from our chain, without touching our chain or UTXO set.
+		:param fork: Number of blocks in common.
+		:param blocks: Blocks following the fork point.
+		:return: Position in `blocks` of the first invalid block, None if the whole branch is valid.
+		"""
+        branch: List[Block] = []
+        candidate = BlockChain(
+            blocks=BlockBranch(self.blocks, fork, branch),
+            utxos=UTXOSet()  # Inputs are resolved through the branch itself
+        )
+        signatures = Transactions.signature_verifier.verify_blocks(blocks)  # One parallel batch
+        for pos, (block, block_signatures) in enumerate(zip(blocks, signatures)):
+            if block.index != fork + pos:
+                return pos
+            if block.index > 0 and not block.check_validity(
+                    candidate.blocks[block.index - 1],
+                    lite=False,
+                    blockchain=candidate,
+                    signatures=block_signatures
+            ):
+                return pos
+            branch.append(block)
+        return None
+
     def check_validity(self, lite=False) -> bool:
         """
 		:return: Whether the Blockchain is valid or not.
 		"""
+        # Signatures of the whole chain are verified as a single (parallel) batch
+        signatures = Transactions.signature_verifier.verify_blocks(self.blocks) if not lite else None
+
         block = self.last_block
         while block.index >= 1:
             prev_block = self.blocks[block.index - 1]
-            if not block.check_validity(prev_block=prev_block, blockchain=self, lite=lite):
+            if not block.check_validity(
+                    prev_block=prev_block,
+                    blockchain=self,
+                    lite=lite,
+                    signatures=signatures[block.index] if signatures else None
+            ):
                 log.debug(f'[BLOCKCHAIN] Block indx \'{block.index}\' is invalid.')
                 return False
             block = prev_block
@@ -253,25 +948,129 @@ class BlockChain:
             utxos=utxos
         )
 
-    @classmethod
-    def find_block_diff(cls, old_blocks: List[Block], new_blocks: List[Block]) -> List[int]:
-        if len(new_blocks) <= len(old_blocks):
-            raise Exception("New chain is smaller or equal to old chain")
+    def to_bytes(self) -> bytes:
+        return b''.join(self.iter_bytes())
 
-        diff = []
-        for indx in range(0, len(old_blocks)):
-            old_block = old_blocks[indx]
-            new_block = new_blocks[indx]
+    def iter_bytes(self):
+        """
+		Binary encoding of the chain, chunk by chunk, for streamed responses.
+		The chain is captured when iteration starts.
+		"""
+        size = self.size
+        utxos = list(self.UTXOs)
+        writer = encoding.Writer(self._kind)
+        writer.u32(size)
+        yield writer.getvalue()
+        for indx in range(size):
+            yield self.blocks[indx].to_bytes()[encoding.HEADER_SIZE:]  # Cached encoding without its message header
 
-            if old_block.hash != new_block.hash:
-                diff.append(old_block.index)
+        writer = encoding.Writer()
+        writer.u32(len(utxos))
+        for utxo in utxos:
+            utxo.write(writer)
+        yield writer.getvalue()
 
-        if len(diff) == 0:
-            raise Exception("Difference is 0?? How?")
-        return diff
+    @classmethod
+    def read(cls, reader: encoding.Reader):
+        blocks = [Block.read(reader) for _ in range(reader.u32())]
+        utxos = set(Transactions.TransactionInput.read(reader) for _ in range(reader.u32()))
+        return cls(
+            blocks=blocks,
+            utxos=utxos
+        )
 
     def __repr__(self):
         return self.to_json()
 
     def __str__(self):
         return str(self.to_json(indent=4).decode('utf-8'))
+
+
+class HeaderChain:
+    """
+	HeaderChain
+	------------------
+	The headers of the blocks of a chain, without their transactions (see `Block.header`).
+	Enough for lite clients to follow the chain and to check Merkle proofs of transactions against it.
+	Only chains starting at our genesis are followed. Without a known genesis, the first one adopted is kept.
+	"""
+
+    def __init__(self, headers: List[BlockHeader] = None, genesis_hash: str = None):
+        """
+		:param headers: Headers of the chain, from its genesis.
+		:param genesis_hash: Hash of the genesis block of the network, if known.
+		"""
+        self.headers: List[BlockHeader] = headers if headers is not None else []
+        self.genesis_hash: Optional[str] = genesis_hash or (self.headers[0].calculate_hash() if self.headers else None)
+
+    @property
+    def last_header(self) -> BlockHeader:
+        return self.headers[-1]
+
+    @property
+    def size(self) -> int:
+        return len(self.headers)
+
+    def hash_at(self, indx: int) -> str:
+        """
+		:return: Hash of the block at `indx`.
+		"""
+        return self.headers[indx].calculate_hash()
+
+    def verify_branch(self, fork: int, headers: List[BlockHeader]) -> bool:
+        """
+		:param fork: Number of headers in common.
+		:param headers: Headers following the fork point.
+		:return: Whether the headers link to our header at `fork - 1` and to each other, with valid Proof-of-Work.
+		"""
+        prev_header = self.headers[fork - 1] if fork > 0 else None
+        for indx, header in enumerate(headers):
+            if prev_header is None:
+                if header.index != 0:
+                    return False
+                if self.genesis_hash is not None and header.calculate_hash() != self.genesis_hash:
+                    log.debug(f'[HEADERS] Verification Failure of header \'0\' (UNKNOWN GENESIS)')
+                    return False
+            elif not verify_header(header, prev_header):
+                log.debug(f'[HEADERS] Verification Failure of header \'{fork + indx}\'')
+                return False
+            prev_header = header
+        return True
+
+    def append(self, header: BlockHeader) -> bool:
+        """
+		Append the header of a new block if it extends our last header.
+		:return: Whether the header was appended.
+		"""
+        if not self.verify_branch(self.size, [header]):
+            return False
+        self.headers.append(header)
+        self.__pin_genesis()
+        return True
+
+    def reorganize(self, fork: int, headers: List[BlockHeader]) -> bool:
+        """
+		Switch to a longer (verified) branch of headers.
+		:param fork: Number of headers in common.
+		:param headers: Headers following the fork point.
+		:return: Whether the branch was adopted.
+		"""
+        if fork + len(headers) <= self.size or not self.verify_branch(fork, headers):
+            return False
+        del self.headers[fork:]
+        self.headers.extend(headers)
+        self.__pin_genesis()
+        return True
+
+    def __pin_genesis(self):
+        if self.genesis_hash is None and self.headers:
+            self.genesis_hash = self.hash_at(0)
+            log.debug(f'[HEADERS] Following the chain of genesis {self.genesis_hash}')
+
+    def verify_transaction(self, transaction: Transactions.Transaction, block_index: int, proof) -> bool:
+        """
+		:return: Whether `transaction` is included in the block at `block_index`, see `verify_merkle_proof`.
+		"""
+        if not 0 <= block_index < self.size:
+            return False
+        return verify_merkle_proof(transaction, proof, self.headers[block_index].merkle_root)
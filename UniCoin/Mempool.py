@@ -0,0 +1,211 @@
+import heapq
+import itertools
+import threading
+
+from typing import Dict, List, Optional, Set
+
+import UniCoin.Transactions as Transactions
+
+import logging
+log = logging.getLogger('werkzeug')
+
+MAX_BLOCK_TRANSACTIONS = 1000  # Transactions per block, besides the coinbase
+MAX_BLOCK_BYTES = 1000000  # Encoded size of the transactions of a block
+MAX_POOL_TRANSACTIONS = 50000  # Transactions kept before the lowest fee ones are evicted
+MAX_POOL_BYTES = 64000000  # Encoded size of the transactions kept before the lowest fee ones are evicted
+
+
+class Mempool:
+	"""
+	Verified transactions waiting to be mined.
+	Transactions are indexed by hash and by the outpoints they spend, so conflicts are found in O(1).
+	Two heaps order them by transaction fee: the highest fees are selected for blocks first and the lowest fees
+	are evicted first when the pool is full. Removed transactions are only dropped from the heaps when they
+	reach the top (lazy deletion).
+	"""
+
+	def __init__(self, max_transactions: int = MAX_POOL_TRANSACTIONS, max_bytes: int = MAX_POOL_BYTES):
+		"""
+		:param max_transactions: Transactions kept before evicting.
+		:param max_bytes: Encoded size of the transactions kept before evicting.
+		"""
+		self.max_transactions: int = max_transactions
+		self.max_bytes: int = max_bytes
+		self._transactions: Dict[str, Transactions.Transaction] = dict()
+		self._spends: Dict[Transactions.TransactionInput, str] = dict()  # Outpoint -> hash of spending transaction
+		self._entries: Dict[str, tuple] = dict()  # Hash -> (fee, sequence, size)
+		self._best = []  # Max-heap of (-fee, sequence, hash)
+		self._worst = []  # Min-heap of (fee, -sequence, hash)
+		self._sequence = itertools.count()  # Older transactions win ties
+		self._lock = threading.RLock()
+		self.total_bytes: int = 0
+		self.evicted: int = 0
+		self.replaced: int = 0
+
+	def add(self, transaction: Transactions.Transaction, replace=True) -> bool:
+		"""
+		Add a verified transaction. Its `transaction_fee` must already be calculated (see `check_validity`).
+		A transaction spending outpoints already spent in the pool replaces the conflicting transactions
+		if its fee is higher than all of theirs together (replace-by-fee).
+		If the pool is full, transactions with a lower fee are evicted to make room.
+		:param replace: False to reject any conflicting transaction.
+		:return: False if the transaction is already in the pool, loses against a conflicting one, or has too low
+		a fee to fit in a full pool.
+		"""
+		t_hash = transaction.hash
+		fee = transaction.transaction_fee
+		size = len(transaction.to_bytes())
+		with self._lock:
+			if t_hash in self._transactions:
+				return False
+
+			conflicts = self.conflicts(transaction)
+			if conflicts and (not replace or fee <= sum(self._entries[c_hash][0] for c_hash in conflicts)):
+				log.debug(f'[MEMPOOL] Rejected {t_hash} (DOUBLE SPEND)')
+				return False
+			replaced = [self.remove(c_hash) for c_hash in conflicts]
+
+			if not self.__make_room(fee, size):
+				for old in replaced:  # Their room was just freed, they fit again
+					self.add(old, replace=False)
+				log.debug(f'[MEMPOOL] Rejected {t_hash} (POOL FULL)')
+				return False
+			if replaced:
+				self.replaced += len(replaced)
+				log.debug(f'[MEMPOOL] {t_hash} replaced {len(replaced)} conflicting transactions')
+
+			sequence = next(self._sequence)
+			self._transactions[t_hash] = transaction
+			self._entries[t_hash] = (fee, sequence, size)
+			for inp in transaction.inputs:
+				self._spends[inp] = t_hash
+			heapq.heappush(self._best, (-fee, sequence, t_hash))
+			heapq.heappush(self._worst, (fee, -sequence, t_hash))
+			self.total_bytes += size
+			return True
+
+	def __make_room(self, fee: int, size: int) -> bool:
+		"""
+		Evict the lowest fee transactions until a transaction of `size` bytes fits.
+		:return: Whether it fits, transactions with a fee at least as high as `fee` are never evicted.
+		"""
+		while len(self._transactions) + 1 > self.max_transactions or self.total_bytes + size > self.max_bytes:
+			lowest = self.__peek(self._worst)
+			if lowest is None or lowest[0] >= fee:
+				return False
+			self.remove(lowest[2])
+			self.evicted += 1
+		return True
+
+	def __peek(self, heap: list) -> Optional[tuple]:
+		"""
+		:return: The top entry of a heap, after dropping the ones of removed transactions.
+		"""
+		while heap and heap[0][2] not in self._entries:
+			heapq.heappop(heap)
+		return heap[0] if heap else None
+
+	def remove(self, t_hash: str) -> Optional[Transactions.Transaction]:
+		"""
+		:return: The removed transaction, None if it was not in the pool.
+		"""
+		with self._lock:
+			transaction = self._transactions.pop(t_hash, None)
+			if transaction is None:
+				return None
+
+			_, _, size = self._entries.pop(t_hash)
+			self.total_bytes -= size
+			for inp in transaction.inputs:
+				if self._spends.get(inp) == t_hash:
+					del self._spends[inp]
+			if len(self._best) > 2 * len(self._entries) + 64:  # Mostly stale, rebuild
+				self.__rebuild()
+			return transaction
+
+	def remove_block(self, block) -> List[Transactions.Transaction]:
+		"""
+		Remove the transactions of a newly connected block, along with every pending transaction spending
+		an outpoint the block spent (they can no longer be mined). O(inputs of the block).
+		:return: The removed transactions.
+		"""
+		removed = []
+		with self._lock:
+			for transaction in block.verified_transactions:
+				for t_hash in {transaction.hash} | self.conflicts(transaction):
+					old = self.remove(t_hash)
+					if old is not None:
+						removed.append(old)
+		return removed
+
+	def __rebuild(self):
+		self._best = [(-fee, sequence, t_hash) for t_hash, (fee, sequence, _) in self._entries.items()]
+		self._worst = [(fee, -sequence, t_hash) for t_hash, (fee, sequence, _) in self._entries.items()]
+		heapq.heapify(self._best)
+		heapq.heapify(self._worst)
+
+	def conflicts(self, transaction: Transactions.Transaction) -> Set[str]:
+		"""
+		:return: Hashes of the transactions in the pool spending any of the outpoints `transaction` spends.
+		"""
+		with self._lock:
+			return {self._spends[inp] for inp in transaction.inputs if inp in self._spends}
+
+	def spender(self, outpoint: Transactions.TransactionInput) -> Optional[str]:
+		"""
+		:return: Hash of the transaction in the pool spending `outpoint`, None if it is unspent.
+		"""
+		return self._spends.get(outpoint)
+
+	def select(self, max_transactions: int = MAX_BLOCK_TRANSACTIONS,
+			   max_bytes: int = MAX_BLOCK_BYTES) -> List[Transactions.Transaction]:
+		"""
+		Pick the highest fee transactions fitting in a block, in O(k log n) for k popped entries.
+		Transactions stay in the pool until `remove`d, e.g. once their block is accepted.
+		:param max_transactions: Transactions per block.
+		:param max_bytes: Encoded size of the transactions of a block.
+		:return: The selected transactions, highest fee first.
+		"""
+		with self._lock:
+			selected = []
+			popped = []
+			total_bytes = 0
+			while self._best and len(selected) < max_transactions and total_bytes < max_bytes:
+				entry = heapq.heappop(self._best)
+				t_hash = entry[2]
+				if t_hash not in self._entries:
+					continue  # Removed, drop it for good
+				popped.append(entry)
+				size = self._entries[t_hash][2]
+				if total_bytes + size <= max_bytes:  # Smaller transactions may still fit
+					selected.append(self._transactions[t_hash])
+					total_bytes += size
+
+			for entry in popped:
+				heapq.heappush(self._best, entry)
+			return selected
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				'transactions': len(self._transactions),
+				'bytes': self.total_bytes,
+				'evicted': self.evicted,
+				'replaced': self.replaced,
+			}
+
+	def __contains__(self, t_hash: str):
+		return t_hash in self._transactions
+
+	def __getitem__(self, t_hash: str) -> Transactions.Transaction:
+		return self._transactions[t_hash]
+
+	def __iter__(self):
+		with self._lock:
+			return iter(list(self._transactions.values()))
+
+	def __len__(self):
+		return len(self._transactions)
+
+	def __bool__(self):
+		return bool(self._transactions)
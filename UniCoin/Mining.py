@@ -0,0 +1,294 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from typing import Iterable, List, Optional
+
+import UniCoin.Blockchain as Blockchain
+import UniCoin.Mempool as Mempool
+import UniCoin.Transactions as Transactions
+
+import UniCoin.helpers.hashing as hashing
+
+import logging
+log = logging.getLogger('werkzeug')
+
+# Guesses a worker makes between two checks of the job generation.
+# Bounds how long a stale worker keeps hashing after a proof was found or the job was cancelled.
+WORKER_BATCH = 5000
+
+
+def _search_worker(jobs, results, generation):
+	"""
+	Worker process loop.
+	Receives jobs as (job_id, header prefix, difficulty, start, step) and walks its slice of the nonce
+	space (start, start + step, start + 2*step...) until a valid proof is found or the job is superseded.
+	Every job is answered with exactly one (job_id, proof or None, hashes) result.
+	"""
+	while True:
+		job = jobs.get()
+		if job is None:
+			return
+
+		job_id, prefix, difficulty, start, step = job
+		verifier = Blockchain.ProofVerifier(prefix, difficulty)
+		proof = start
+		found = None
+		while found is None and generation.value == job_id:
+			stop = proof + WORKER_BATCH * step
+			found = verifier.search(proof, stop, step)
+			proof = stop
+
+		hashes = (proof - start) // step if found is None else (found - start) // step + 1
+		results.put((job_id, found, hashes))
+
+
+class BlockTemplate:
+	"""
+	Block being mined on top of our tip.
+	The index and previous hash are prepared once per tip. Transactions are picked within a transaction count
+	and a byte budget, with their fees computed from the UTXO index, and can be picked again (e.g. when new
+	transactions arrive). Once the coinbase is set, the header is fixed and only its proof is searched.
+	"""
+
+	def __init__(self, blockchain: Blockchain.BlockChain, max_transactions: int = Mempool.MAX_BLOCK_TRANSACTIONS,
+				 max_bytes: int = Mempool.MAX_BLOCK_BYTES):
+		"""
+		:param blockchain: Our chain, the block extends its last block.
+		:param max_transactions: Transactions per block, besides the coinbase.
+		:param max_bytes: Encoded size of the transactions of a block, besides the coinbase.
+		"""
+		last_block = blockchain.last_block
+		self.blockchain: Blockchain.BlockChain = blockchain
+		self.max_transactions: int = max_transactions
+		self.max_bytes: int = max_bytes
+		self.index: int = last_block.index + 1
+		self.previous_block_hash: str = last_block.calculate_hash()
+		self.reward: int = Blockchain.block_reward(self.index)
+		self.transactions: List[Transactions.Transaction] = []
+		self.fees: int = 0
+		self.size: int = 0
+		self.coinbase: Optional[Transactions.Transaction] = None
+		self.header: Optional[Blockchain.BlockHeader] = None
+
+	@property
+	def coinbase_value(self) -> int:
+		return self.reward + self.fees
+
+	def is_stale(self) -> bool:
+		"""
+		:return: Whether our chain moved on, the template no longer extends its tip.
+		"""
+		return self.blockchain.size != self.index or self.blockchain.last_block.calculate_hash() != self.previous_block_hash
+
+	def transaction_fee(self, transaction: Transactions.Transaction) -> Optional[int]:
+		"""
+		:return: Fee of a transaction, from the values of the outputs it spends in the UTXO index. None if any of
+		them is spent (or unknown) or not owned by the sender, or if the transaction spends less than it pays.
+		"""
+		spent = 0
+		for inp in transaction.inputs:
+			output = self.blockchain.UTXOs.get(inp)
+			if output is None or output.recipient_address != transaction.sender:
+				return None
+			spent += output.value
+		fee = spent - transaction.balance_output
+		return fee if fee >= 0 else None
+
+	def fill(self, candidates: Iterable[Transactions.Transaction]) -> int:
+		"""
+		(Re)pick the transactions of the block from `candidates`, in order, while they fit the budgets.
+		Transactions spending an output already spent by the block, or no longer unspent, are skipped.
+		:param candidates: Verified transactions, highest fee first (see `Mempool.select`).
+		:return: Number of transactions picked.
+		"""
+		transactions = []
+		fees = 0
+		size = 0
+		spent = set()
+		for transaction in candidates:
+			if len(transactions) >= self.max_transactions:
+				break
+			t_size = len(transaction.to_bytes())
+			if size + t_size > self.max_bytes:
+				continue  # Smaller transactions may still fit
+			fee = self.transaction_fee(transaction)
+			if fee is None or not spent.isdisjoint(transaction.inputs):
+				continue
+			spent.update(transaction.inputs)
+			transactions.append(transaction)
+			fees += fee
+			size += t_size
+
+		self.transactions = transactions
+		self.fees = fees
+		self.size = size
+		self.coinbase = None
+		self.header = None  # The coinbase pays the new fees
+		return len(transactions)
+
+	def seal(self, coinbase: Transactions.Transaction) -> Blockchain.BlockHeader:
+		"""
+		Fix the transactions of the block and build its header.
+		:param coinbase: Signed coinbase, paying `coinbase_value`.
+		:return: Header of the block, its prefix is what the Proof-of-Work is searched on.
+		"""
+		self.coinbase = coinbase
+		self.header = Blockchain.BlockHeader(
+			index=self.index,
+			previous_block_hash=self.previous_block_hash,
+			merkle_root=hashing.merkle_root(
+				[Blockchain.merkle_leaf(trans) for trans in [coinbase] + self.transactions]
+			),
+			timestamp=time.time()
+		)
+		return self.header
+
+	def assemble(self, proof: int) -> Blockchain.Block:
+		"""
+		:param proof: Proof-of-Work found for the sealed header.
+		:return: The block.
+		"""
+		if self.header is None:
+			raise ValueError('Block template must be sealed first!')
+		return Blockchain.Block(
+			index=self.index,
+			proof=proof,
+			verified_transactions=[self.coinbase] + self.transactions,
+			previous_block_hash=self.previous_block_hash,
+			timestamp=self.header.timestamp
+		)
+
+
+class ProofOfWorkEngine:
+	"""
+	Parallel Proof-of-Work search.
+	The nonce space is split across a pool of worker processes (worker `i` checks i, i+n, i+2n...).
+	The first valid proof stops every worker and a running search can be cancelled from any thread,
+	e.g. when a competing block arrives.
+	"""
+
+	def __init__(self, workers: int = None):
+		"""
+		:param workers: Number of worker processes. Defaults to the number of CPUs.
+		"""
+		self.workers: int = workers or os.cpu_count() or 1
+		self._context = multiprocessing.get_context()
+		self._generation = self._context.Value('Q', 0)
+		self._jobs = None
+		self._results = None
+		self._processes = []
+		self._search_lock = threading.Lock()
+
+		# Statistics
+		self.last_hashes: int = 0
+		self.last_elapsed: float = 0.0
+		self.total_hashes: int = 0
+		self.total_elapsed: float = 0.0
+
+	def _start(self):
+		"""
+		Lazily start the worker processes, nodes that never mine never pay for them.
+		"""
+		if self._processes:
+			return
+
+		self._jobs = self._context.Queue()
+		self._results = self._context.Queue()
+		for _ in range(self.workers):
+			process = self._context.Process(
+				target=_search_worker,
+				args=(self._jobs, self._results, self._generation),
+				daemon=True
+			)
+			process.start()
+			self._processes.append(process)
+
+	def _next_generation(self, expected: int = None) -> int:
+		"""
+		Invalidate the running job (if any).
+		:param expected: Only advance if the current generation is still this one.
+		:return: The current generation.
+		"""
+		with self._generation.get_lock():
+			if expected is None or self._generation.value == expected:
+				self._generation.value += 1
+			return self._generation.value
+
+	def search(self, prefix: bytes, difficulty=2) -> Optional[int]:
+		"""
+		Search for a valid Proof-of-Work across all workers.
+		:param prefix: Header of the block without its proof, see `BlockHeader.prefix`.
+		:param difficulty: Difficulty level of mining.
+		:return: A valid proof, or None if the search was cancelled.
+		"""
+		if difficulty <= 0:
+			raise ValueError("Difficulty must be a positive number!")
+
+		with self._search_lock:
+			self._start()
+			job_id = self._next_generation()
+			started = time.perf_counter()
+			for start in range(self.workers):
+				self._jobs.put((job_id, prefix, difficulty, start, self.workers))
+
+			proof = None
+			hashes = 0
+			pending = self.workers
+			while pending:
+				try:
+					r_job, r_proof, r_hashes = self._results.get(timeout=1)
+				except queue.Empty:
+					if not all(process.is_alive() for process in self._processes):
+						raise RuntimeError('Proof-of-Work worker died unexpectedly.')
+					continue
+
+				if r_job != job_id:
+					continue
+				pending -= 1
+				hashes += r_hashes
+				if r_proof is not None and proof is None:
+					proof = r_proof
+					self._next_generation(expected=job_id)  # Stop the remaining workers
+
+			self.last_hashes = hashes
+			self.last_elapsed = time.perf_counter() - started
+			self.total_hashes += hashes
+			self.total_elapsed += self.last_elapsed
+
+			log.debug(f'[MINER] Proof-of-Work {"found" if proof is not None else "cancelled"} after '
+					  f'{hashes} hashes ({self.hash_rate:.0f} H/s)')
+			return proof
+
+	def cancel(self):
+		"""
+		Cancel the running search (if any). The search returns None.
+		"""
+		self._next_generation()
+
+	def shutdown(self):
+		"""
+		Stop the worker processes.
+		"""
+		self.cancel()
+		for _ in self._processes:
+			self._jobs.put(None)
+		for process in self._processes:
+			process.join(timeout=1)
+		self._processes = []
+
+	@property
+	def hash_rate(self) -> float:
+		"""
+		:return: Hashes per second of the last search.
+		"""
+		return self.last_hashes / self.last_elapsed if self.last_elapsed > 0 else 0.0
+
+	@property
+	def average_hash_rate(self) -> float:
+		"""
+		:return: Hashes per second over every search of this engine.
+		"""
+		return self.total_hashes / self.total_elapsed if self.total_elapsed > 0 else 0.0
@@ -0,0 +1,148 @@
+import asyncio
+import concurrent.futures
+import json
+import threading
+
+from typing import List, Optional
+
+import aiohttp
+
+import logging
+log = logging.getLogger('werkzeug')
+
+MAX_CONCURRENT_REQUESTS = 64  # Requests in flight at once, across every peer
+MAX_CONNECTIONS_PER_PEER = 8  # Keep-alive connections kept open to each peer
+CONNECT_TIMEOUT = 3.05  # Seconds to connect to a peer
+READ_TIMEOUT = 30  # Seconds to wait for each read from a peer
+REQUEST_TIMEOUT = 120  # Seconds a whole request may take, a peer trickling bytes cannot hold a slot forever
+
+
+class PeerResponse:
+	"""
+	Fully read response of a peer.
+	"""
+
+	def __init__(self, url: str, status_code: int, headers, content: bytes):
+		"""
+		:param headers: Case-insensitive mapping of the response headers.
+		"""
+		self.url: str = url
+		self.status_code: int = status_code
+		self.headers = headers
+		self.content: bytes = content
+
+	@property
+	def text(self) -> str:
+		return self.content.decode('utf-8')
+
+	def json(self):
+		return json.loads(self.content)
+
+	def raise_for_status(self):
+		if self.status_code >= 400:
+			raise IOError(f'{self.url} answered with status {self.status_code}')
+
+
+class AsyncTransport:
+	"""
+	HTTP client of a node, running every peer request on a single asyncio event loop.
+	The loop lives in its own (daemon) thread, so synchronous code can fan out requests to many peers
+	without a thread per request. Connections are kept alive and the number of requests in flight is bounded.
+	"""
+
+	def __init__(self, max_concurrent: int = MAX_CONCURRENT_REQUESTS,
+				 connections_per_peer: int = MAX_CONNECTIONS_PER_PEER, request_timeout: float = REQUEST_TIMEOUT):
+		"""
+		:param max_concurrent: Requests in flight at once, across every peer.
+		:param connections_per_peer: Keep-alive connections kept open to each peer.
+		:param request_timeout: Seconds a whole request to a peer may take, including reading its response.
+		"""
+		self.max_concurrent: int = max_concurrent
+		self.connections_per_peer: int = connections_per_peer
+		self.request_timeout: float = request_timeout
+		self._loop = asyncio.new_event_loop()
+		self._thread = threading.Thread(target=self._loop.run_forever, name='peer-network', daemon=True)
+		self._thread.start()
+		self._session: Optional[aiohttp.ClientSession] = None
+		self._semaphore: Optional[asyncio.Semaphore] = None
+
+	def _get_session(self) -> aiohttp.ClientSession:
+		"""
+		Lazily create the session, it has to be created inside the loop.
+		"""
+		if self._session is None:
+			self._semaphore = asyncio.Semaphore(self.max_concurrent)
+			self._session = aiohttp.ClientSession(
+				connector=aiohttp.TCPConnector(limit=0, limit_per_host=self.connections_per_peer),
+				timeout=aiohttp.ClientTimeout(
+					total=self.request_timeout, sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT
+				)
+			)
+		return self._session
+
+	async def request_async(self, method: str, peer, path: str, **kwargs) -> PeerResponse:
+		"""
+		:param method: HTTP method.
+		:param peer: Peer to call.
+		:param path: sub_url of peer to call.
+		:param kwargs: `params`, `data` and `headers` of the request.
+		:return: The peer's response.
+		"""
+		session = self._get_session()
+		url = f'http://{peer}/{path}'
+		async with self._semaphore:
+			async with session.request(method, url, **kwargs) as response:
+				content = await response.read()
+				return PeerResponse(url, response.status, response.headers.copy(), content)
+
+	async def _try_request(self, method: str, peer, path: str, **kwargs) -> Optional[PeerResponse]:
+		try:
+			return await self.request_async(method, peer, path, **kwargs)
+		except Exception as e:
+			log.debug(f'[PEER] {method} {path} to peer {peer} failed ({type(e).__name__}: {e})')
+			return None
+
+	def submit(self, coroutine) -> concurrent.futures.Future:
+		"""
+		Schedule a coroutine on the network loop.
+		:return: Future of its result, usable from any other thread.
+		"""
+		return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+	def gather(self, coroutines) -> list:
+		"""
+		Run coroutines concurrently on the network loop and wait for all of them.
+		:return: Their results, in order.
+		"""
+		async def gather_all(pending):
+			return list(await asyncio.gather(*pending))
+
+		return self.submit(gather_all(list(coroutines))).result()
+
+	def request(self, method: str, peer, path: str, **kwargs) -> PeerResponse:
+		"""
+		Blocking request to a single peer. Connection errors and timeouts are raised.
+		"""
+		return self.submit(self.request_async(method, peer, path, **kwargs)).result()
+
+	def request_all(self, method: str, peers: list, path: str, **kwargs) -> List[Optional[PeerResponse]]:
+		"""
+		Send the same request to every peer concurrently and wait for all of them.
+		:return: The response of each peer, in order, None for peers that failed.
+		"""
+		if not peers:
+			return []
+		return self.gather(self._try_request(method, peer, path, **kwargs) for peer in peers)
+
+	def close(self):
+		"""
+		Close every connection and stop the loop.
+		"""
+		async def close_session():
+			if self._session is not None:
+				await self._session.close()
+
+		if self._loop.is_running():
+			self.submit(close_session()).result()
+			self._loop.call_soon_threadsafe(self._loop.stop)
+			self._thread.join()
@@ -5,24 +5,41 @@ import threading
 import uuid
 import operator
 import Crypto
-import requests
-import concurrent.futures
 import queue
 import time
 
-from typing import List, Set, Dict
+from typing import List, Set, Dict, Optional, Tuple
 from Crypto.PublicKey import RSA
 from Crypto.PublicKey.RSA import RsaKey
 from Crypto.Signature import pkcs1_15
 from Crypto.Signature.pkcs1_15 import PKCS115_SigScheme
 
+import UniCoin.helpers.encoding as encoding
 import UniCoin.helpers.paths as paths
+from UniCoin.helpers.caches import SeenCache
 import UniCoin.Blockchain as Blockchain
+import UniCoin.BlockTree as BlockTree
+import UniCoin.Mempool as Mempool
+import UniCoin.Mining as Mining
+import UniCoin.Network as Network
+import UniCoin.Storage as Storage
 import UniCoin.Transactions as Transactions
+import UniCoin.Wallet as Wallet
 
 import logging
 log = logging.getLogger('werkzeug')
 
+HEADERS_PAGE = 500  # Headers per /api/blockchain/headers request
+BLOCKS_PAGE = 50  # Blocks per /api/blockchain/blocks request
+
+TRANSACTION_BROADCASTERS = 4  # Transaction batches broadcast concurrently
+INVENTORY_BATCH = 100  # Transaction hashes per inventory announcement
+
+SEEN_CACHE_SIZE = 100000  # Hashes of processed blocks and transactions remembered
+MAX_PAYMENT_OUTPUTS = 100  # Payments packed into each transaction of a batch payment
+MAX_PARENT_FETCHES = 16  # Missing parents of an orphan block fetched by hash before falling back to a full sync
+BLOCK_BROADCASTERS = 1  # Blocks are broadcast one at a time, in the order they were mined
+
 
 class Peer:
 	def __init__(self, address: str, port: int):
@@ -48,26 +65,163 @@ class Peer:
 		return self.address == other.address and self.port == other.port
 
 
+class BroadcastQueue:
+	"""
+	Queue of entities waiting to be broadcast, drained by a pool of worker threads.
+	Workers block on the queue, so an entity is sent as soon as it is put and a worker is free.
+	Entities that queued up while the workers were busy are taken and sent together, up to `batch_size`.
+	Entities put together with `put_many` are always sent as a single batch.
+	"""
+	_STOP = object()  # Sentinel, one per worker on shutdown
+
+	def __init__(self, name: str, send, workers: int = 1, batch_size: int = 1):
+		"""
+		:param name: Name of the queue, used in logs and thread names.
+		:param send: Called with a list of entities, broadcasts them.
+		:param workers: Number of batches broadcast concurrently.
+		:param batch_size: Maximum number of entities per batch.
+		"""
+		if workers <= 0 or batch_size <= 0:
+			raise ValueError("Number of workers and batch size must be positive numbers!")
+		self.name: str = name
+		self.batch_size: int = batch_size
+		self._send = send
+		self._queue = queue.Queue()
+		self._stats_lock = threading.Lock()
+
+		# Statistics, latency is measured from `put` until the broadcast ended.
+		self.sent: int = 0
+		self.failed: int = 0
+		self.batches: int = 0
+		self.last_latency: float = 0.0
+		self.max_latency: float = 0.0
+		self.total_latency: float = 0.0
+
+		self._threads = [
+			threading.Thread(target=self.__work, name=f'{name}-broadcast-{i}', daemon=True) for i in range(workers)
+		]
+		for thread in self._threads:
+			thread.start()
+
+	def __work(self):
+		q = self._queue
+		stop = False
+		while not stop:
+			batch = []
+			taken = 0  # Queue entries, each holding one or more entities
+			item = q.get()
+			while True:
+				taken += 1
+				if item is self._STOP:
+					stop = True
+					break
+				batch.extend(item)
+				if len(batch) >= self.batch_size:
+					break
+				try:
+					item = q.get_nowait()
+				except queue.Empty:
+					break
+
+			try:
+				if batch:
+					self.__send(batch)
+			finally:
+				for _ in range(taken):
+					q.task_done()
+
+	def __send(self, batch: list):
+		try:
+			self._send([entity for entity, _ in batch])
+			failed = False
+		except Exception as e:
+			log.error(f'[{self.name.upper()}] Broadcast failed ({e})')
+			failed = True
+
+		now = time.perf_counter()
+		with self._stats_lock:
+			self.batches += 1
+			for _, queued in batch:
+				latency = now - queued
+				self.sent += 1
+				self.failed += failed
+				self.last_latency = latency
+				self.max_latency = max(self.max_latency, latency)
+				self.total_latency += latency
+
+	def put(self, entity):
+		self._queue.put([(entity, time.perf_counter())])
+
+	def put_many(self, entities: list):
+		"""
+		Queue entities to be broadcast together, in a single batch.
+		"""
+		if entities:
+			queued = time.perf_counter()
+			self._queue.put([(entity, queued) for entity in entities])
+
+	def join(self):
+		"""
+		Block until every queued entity was broadcast.
+		"""
+		self._queue.join()
+
+	def shutdown(self, wait=True):
+		"""
+		Stop the workers once the entities already queued are broadcast.
+		"""
+		for _ in self._threads:
+			self._queue.put(self._STOP)
+		if wait:
+			for thread in self._threads:
+				thread.join()
+
+	@property
+	def depth(self) -> int:
+		"""
+		:return: Number of entities waiting for a worker.
+		"""
+		return self._queue.qsize()
+
+	@property
+	def average_latency(self) -> float:
+		return self.total_latency / self.sent if self.sent else 0.0
+
+	def stats(self) -> dict:
+		with self._stats_lock:
+			return {
+				'workers': len(self._threads),
+				'depth': self.depth,
+				'sent': self.sent,
+				'failed': self.failed,
+				'batches': self.batches,
+				'last_latency': self.last_latency,
+				'average_latency': self.average_latency,
+				'max_latency': self.max_latency,
+			}
+
+
 class PeerNetwork:
 	"""
 	Network of peers stored in each node.
 	Handles registration/incoming messages etc.
 	"""
-	def __init__(self, my_peer: Peer = None):
+	def __init__(self, my_peer: Peer = None,
+				 transaction_broadcasters: int = TRANSACTION_BROADCASTERS,
+				 block_broadcasters: int = BLOCK_BROADCASTERS):
+		"""
+		:param my_peer: Our own address, None if we do not listen.
+		:param transaction_broadcasters: Number of transaction batches broadcast concurrently.
+		:param block_broadcasters: Number of blocks broadcast concurrently.
+		"""
 		self._my_peer: Peer = my_peer
 		self._peers = self.__load_peers()
-		self.__transactions_queue = queue.Queue()
-		self.__blocks_queue = queue.Queue()
-
-		# Threads for "Async Handling" of transactions and blocks.
-		# Threads are just a quick addition. They are not correctly made
-		# and using infinite loops to work instead of an event system...
-
-		self.__transactions_thread = threading.Thread(target=self.__handle_transactions, args=(), daemon=True)
-		self.__transactions_thread.start()
-
-		self.__blocks_thread = threading.Thread(target=self.__handle_blocks, args=(), daemon=True)
-		self.__blocks_thread.start()
+		self._lite_peers: Set[Peer] = set()  # Peers following headers only, announced headers instead of blocks
+		self.transport: Network.AsyncTransport = Network.AsyncTransport()  # Every peer request runs on its loop
+		self.transactions_queue = BroadcastQueue(
+			'transactions', self.__send_transactions, transaction_broadcasters, batch_size=INVENTORY_BATCH
+		)
+		self.blocks_queue = BroadcastQueue('blocks', self.__send_blocks, block_broadcasters)
 
 	def __load_peers(self) -> set:
 		"""
@@ -123,130 +277,384 @@ class PeerNetwork:
 		self.__store_peers()
 		return True
 
-	@staticmethod
-	def __post_json(url, data):
+	def register_lite_peer(self, peer: Peer):
 		"""
-		:param url: sub_url of peer to call.
-		:param data: json data to pass.
-		:return: None if failure, otherwise the response text.
+		Announce only the headers of new blocks to a (registered) lite peer.
+		:param peer:
 		"""
-		try:
-			response = requests.post(url, json=data)
-			if response.status_code == 200:
-				return response.text
-			return None
-		except Exception as e:
-			return None
+		self._lite_peers.add(peer)
+
+	def _request(self, method: str, peer: Peer, path: str, **kwargs) -> Network.PeerResponse:
+		"""
+		:param method: HTTP method.
+		:param peer: Peer to call.
+		:param path: sub_url of peer to call.
+		:return: The peer's response.
+		"""
+		return self.transport.request(method, peer, path, **kwargs)
 
-	def __broadcast_json(self, url, data):
+	def __broadcast_data(self, url, data: bytes, peers: List[Peer]):
 		"""
-		Broadcast a JSON Post to all peers.
+		Broadcast a binary Post to peers, concurrently.
 		:param url: sub_url of peer to call.
-		:param data: json data to pass.
+		:param data: binary encoded entity to pass.
+		:param peers: Peers to post to.
 		:return: Tuple containing successfully sent and total peers.
 		"""
-		total_peers = len(self.peers)
-		with concurrent.futures.ThreadPoolExecutor() as executor:
-			futures = [
-				executor.submit(self.__post_json, f'http://{peer}/{url}', data) for peer in self.peers
-			]
-			total_sent = len(list(filter(lambda o: o is not None, [f.result() for f in futures])))
+		responses = self.transport.request_all(
+			'POST', peers, url, data=data, headers={'Content-Type': encoding.MIME_TYPE}
+		)
+		total_sent = len([response for response in responses if response is not None and response.status_code == 200])
 
-			return total_sent, total_peers
+		return total_sent, len(peers)
 
-	def __handle_transactions(self):
+	def __send_transactions(self, transactions: List[Transactions.Transaction]):
 		"""
-		Thread handling all incoming transactions.
+		Announce the hashes of a batch of transactions to every peer, then send each peer the bodies it asked for.
 		"""
-		q = self.__transactions_queue
-		while True:
-			if not q.empty():
-				transaction: Transactions.Transaction = q.get(timeout=1)
-				t_hash = transaction.hash
-				log.debug(f'[TRANSACTION - {t_hash}] Broadcasting Transaction')
-				data = transaction.to_json().decode('utf-8')
-				if data is None:
-					log.debug(f'[TRANSACTION - {t_hash}] Broadcasting Transaction failed. Bad JSON')
-				total_sent, total_peers = self.__broadcast_json(f'api/broadcasts/new_transaction', data)
+		log.debug(f'[TRANSACTIONS] Announcing {len(transactions)} transactions')
+		peers = list(self.peers)
+		requested = self.transport.gather(self.__gossip_transactions(peer, transactions) for peer in peers)
+		requested = [count for count in requested if count is not None]
+		total_sent, total_peers = len(requested), len(peers)
 
-				log.debug(f'[TRANSACTION - {t_hash}] Broadcast ended. {total_sent}/{total_peers} peers received the message')
-			time.sleep(1)
+		log.debug(f'[TRANSACTIONS] Announcement ended. {total_sent}/{total_peers} peers received the inventory, '
+				  f'{sum(requested)} transactions were requested')
 
-	def __handle_blocks(self):
+	async def __gossip_transactions(self, peer: Peer, transactions: List[Transactions.Transaction]) -> Optional[int]:
 		"""
-		Thread handling all incoming transactions.
+		:return: Number of transactions the peer was missing, None on failure.
 		"""
-		q = self.__blocks_queue
-		while True:
-			if not q.empty():
-				block: Blockchain.Block = q.get(timeout=1)
-				b_hash = block.hash
-				log.debug(f'[BLOCK - {b_hash}] Broadcasting Block')
-				data = block.to_json().decode('utf-8')
-				if data is None:
-					log.debug(f'[BLOCK - {b_hash}] Broadcasting Block failed. Bad JSON')
-				total_sent, total_peers = self.__broadcast_json(f'api/broadcasts/new_block', data)
+		inventory = {trans.hash: trans for trans in transactions}
+		try:
+			response = await self.transport.request_async(
+				'POST', peer, 'api/inventory/transactions', json={'hashes': list(inventory)}
+			)
+			response.raise_for_status()
+			missing = [inventory[t_hash] for t_hash in response.json()['missing'] if t_hash in inventory]
+			if missing:
+				response = await self.transport.request_async(
+					'POST', peer, 'api/broadcasts/transactions',
+					data=Transactions.encode_transactions(missing),
+					headers={'Content-Type': encoding.MIME_TYPE}
+				)
+				response.raise_for_status()
+			return len(missing)
+		except Exception as e:
+			log.debug(f'[PEER] Failed sending transactions to peer {peer} ({e})')
+			return None
+
+	def __send_blocks(self, blocks: List[Blockchain.Block]):
+		for block in blocks:
+			b_hash = block.hash
+			log.debug(f'[BLOCK - {b_hash}] Broadcasting Block')
+			lite_peers = self.peers & self._lite_peers
+			total_sent, total_peers = self.__broadcast_data(
+				'api/broadcasts/new_block', block.to_bytes(), list(self.peers - lite_peers)
+			)
+			if lite_peers:  # They would only keep the header of the block
+				sent, total = self.__broadcast_data(
+					'api/broadcasts/new_header', block.header().to_bytes(), list(lite_peers)
+				)
+				total_sent, total_peers = total_sent + sent, total_peers + total
 
-				log.debug(f'[BLOCK - {b_hash}] Broadcast ended. {total_sent}/{total_peers} peers received the message')
-			time.sleep(1)
+			log.debug(f'[BLOCK - {b_hash}] Broadcast ended. {total_sent}/{total_peers} peers received the message')
 
 	def broadcast_transaction(self, transaction: Transactions.Transaction):
 		"""
 		Add transaction in queue to be broadcasted.
 		:param transaction:
 		"""
-		self.__transactions_queue.put(transaction)
+		self.transactions_queue.put(transaction)
+
+	def broadcast_transactions(self, transactions: List[Transactions.Transaction]):
+		"""
+		Queue transactions to be announced to our peers as a single batch.
+		"""
+		self.transactions_queue.put_many(transactions)
 
 	def broadcast_block(self, block: Blockchain.Block):
-		self.__blocks_queue.put(block)
+		self.blocks_queue.put(block)
 
-	def check_peer_chains(self, my_length: int):
-		tmp_length = my_length
-		tmp_chain = None
-		for peer in self.peers:
-			length = self.check_chain_length(peer)
-			if length > tmp_length:
-				blockchain = self.steal_blockchain(peer)
-				if blockchain and blockchain.check_validity(lite=False):
-					tmp_chain = blockchain
-					tmp_length = tmp_chain.size
-					log.debug(f'[PEER] Found bigger valid chain from \'{peer}\'.')
+	def broadcast_stats(self) -> dict:
+		"""
+		:return: Queue depth, throughput and latency of the broadcast queues.
+		"""
+		return {
+			'transactions': self.transactions_queue.stats(),
+			'blocks': self.blocks_queue.stats(),
+		}
 
-		return tmp_chain
+	def shutdown(self):
+		"""
+		Broadcast what is still queued, then stop the broadcast workers and close every connection.
+		"""
+		self.transactions_queue.shutdown()
+		self.blocks_queue.shutdown()
+		self.transport.close()
 
-	@staticmethod
-	def check_chain_length(peer: Peer) -> int:
+	def check_peer_chains(self, blockchain: Blockchain.BlockChain) -> Optional[Tuple[int, List[Blockchain.Block]]]:
+		"""
+		Synchronize with the peers, see `find_best_branch`. Apply the result with `Node.reorganize`.
+		:param blockchain: Our blockchain.
+		:return: Tuple (fork point, validated blocks after it) of the longest valid branch found,
+		None if no peer is ahead of us.
+		"""
+		return self.find_best_branch(blockchain)
+
+	def find_best_branch(self, blockchain: Blockchain.BlockChain) -> Optional[Tuple[int, List[Blockchain.Block]]]:
+		"""
+		Synchronize with the peers ahead of us.
+		The chain length of every peer is probed concurrently, then peers are synchronized from the longest
+		chain down until one of them provides a valid branch.
+		:param blockchain: Our blockchain.
+		:return: Tuple (fork point, validated blocks after it) of the longest valid branch found,
+		None if no peer is ahead of us.
+		"""
+		lengths = self.check_chain_lengths(list(self.peers))
+		for peer, length in sorted(lengths.items(), key=operator.itemgetter(1), reverse=True):
+			if length <= blockchain.size:
+				break
+			branch = self.sync_branch(peer, blockchain, length=length)
+			if branch is not None:
+				log.debug(f'[PEER] Found bigger valid chain from \'{peer}\'.')
+				return branch
+		return None
+
+	def sync_branch(self, peer: Peer, blockchain: Blockchain.BlockChain,
+					length: int = None) -> Optional[Tuple[int, List[Blockchain.Block]]]:
 		"""
+		Headers-first synchronization.
+		Find the fork point against our chain, check the headers of the peer's branch, then download
+		(in pages) and validate only the blocks after the fork point.
 		:param peer:
-		:return: Length of peer's blockchain.
+		:param blockchain: Our blockchain.
+		:param length: Length of the peer's chain, if already known.
+		:return: Tuple (fork point, validated blocks after it), None if the peer is not ahead of us or its
+		branch is invalid.
 		"""
+		if length is None:
+			length = self.check_chain_length(peer)
+		if length <= blockchain.size:
+			return None
+
 		try:
-			response = requests.get(f'http://{peer}/api/blockchain/length')
+			fork = self.find_fork(peer, blockchain, length)
+			headers = self.fetch_headers(peer, fork, length)
+			prev_header = blockchain.blocks[fork - 1].header() if fork > 0 else None
+			for header in headers:
+				if prev_header is not None and not Blockchain.verify_header(header, prev_header):
+					log.debug(f'[PEER] Invalid header \'{header.index}\' from peer {peer}')
+					return None
+				prev_header = header
+
+			branch: List[Blockchain.Block] = []
+			candidate = Blockchain.BlockChain(
+				blocks=Blockchain.BlockBranch(blockchain.blocks, fork, branch),
+				utxos=Blockchain.UTXOSet()  # Inputs are resolved through the branch itself
+			)
+			pages = iter(range(fork, length, BLOCKS_PAGE))
+			start = next(pages, None)
+			pending = self.__fetch_blocks_page(peer, start, length)
+			while pending is not None:
+				blocks = self.decode_blocks(pending.result())
+				start = next(pages, None)
+				pending = self.__fetch_blocks_page(peer, start, length)  # Download the next page while validating
+				signatures = Transactions.signature_verifier.verify_blocks(blocks)  # One parallel batch per page
+				for block, block_signatures in zip(blocks, signatures):
+					indx = fork + len(branch)
+					if block.index != indx or block.calculate_hash() != headers[indx - fork].calculate_hash():
+						log.debug(f'[PEER] Block \'{indx}\' from peer {peer} does not match its header')
+						return None
+					if indx > 0 and not block.check_validity(
+							candidate.blocks[indx - 1],
+							lite=False,
+							blockchain=candidate,
+							signatures=block_signatures
+					):
+						log.debug(f'[PEER] Invalid block \'{indx}\' from peer {peer}')
+						return None
+					branch.append(block)
+
+			if len(branch) != length - fork:
+				return None
+			log.debug(f'[PEER] Synchronized {len(branch)} blocks after fork point \'{fork}\' from peer {peer}')
+			return fork, branch
+		except Exception as e:
+			log.debug(f'[PEER] Failed synchronizing with peer {peer} ({e})')
+			return None
 
-			if response.status_code == 200:
-				json_data = json.loads(response.text)
-				return json_data["length"]
-		except Exception:
-			log.debug(f'[PEER] Failed fetching blockchain length from peer {peer}')
-			return 0
+	def sync_headers(self, peer: Peer, headers: Blockchain.HeaderChain, length: int = None) -> bool:
+		"""
+		Headers-only synchronization (lite clients). Find the fork point against our headers, then download
+		and verify the peer's headers after it.
+		:param headers: Our headers.
+		:param length: Length of the peer's chain, if already known.
+		:return: Whether our headers changed.
+		"""
+		if length is None:
+			length = self.check_chain_length(peer)
+		if length <= headers.size:
+			return False
+
+		try:
+			fork = self.find_fork(peer, headers, length)
+			if not headers.reorganize(fork, self.fetch_headers(peer, fork, length)):
+				log.debug(f'[PEER] Invalid headers from peer {peer}')
+				return False
+			log.debug(f'[PEER] Synchronized {length - fork} headers after fork point \'{fork}\' from peer {peer}')
+			return True
+		except Exception as e:
+			log.debug(f'[PEER] Failed synchronizing headers with peer {peer} ({e})')
+			return False
+
+	def find_fork(self, peer: Peer, blockchain, length: int) -> int:
+		"""
+		Walk back from our tip, a page of headers at a time, until a header of the peer matches our chain.
+		:param blockchain: Our BlockChain or HeaderChain.
+		:return: Number of blocks in common.
+		"""
+		end = min(blockchain.size, length)
+		while end > 0:
+			start = max(0, end - HEADERS_PAGE)
+			for header in reversed(self.fetch_headers(peer, start, end)):
+				if header.calculate_hash() == blockchain.hash_at(header.index):
+					return header.index + 1
+			end = start
 		return 0
 
+	def fetch_headers(self, peer: Peer, start: int, end: int) -> List[Blockchain.BlockHeader]:
+		"""
+		:return: Headers of the peer's blocks [start, end), binary (`BlockHeader.SIZE` bytes each) or JSON.
+		"""
+		headers = []
+		while start < end:
+			response = self._request(
+				'GET', peer, 'api/blockchain/headers',
+				params={'start': start, 'end': end},
+				headers={'Accept': encoding.MIME_TYPE}
+			)
+			response.raise_for_status()
+			if response.headers.get('Content-Type', '').startswith(encoding.MIME_TYPE):
+				page = Blockchain.decode_headers(response.content)
+			else:
+				page = list(map(Blockchain.BlockHeader.from_json, json.loads(response.text)['headers']))
+			if not page:
+				raise ValueError(f'Peer returned no headers from \'{start}\'.')
+			headers.extend(page)
+			start += len(page)
+		return headers
+
+	def __fetch_blocks_page(self, peer: Peer, start: Optional[int], length: int):
+		"""
+		:return: Future of the page of blocks starting at `start`, None if there are no more pages.
+		"""
+		if start is None:
+			return None
+		return self.transport.submit(self.__blocks_request(peer, start, min(start + BLOCKS_PAGE, length)))
+
+	def __blocks_request(self, peer: Peer, start: int, end: int):
+		return self.transport.request_async(
+			'GET', peer, 'api/blockchain/blocks',
+			params={'start': start, 'end': end},
+			headers={'Accept': encoding.MIME_TYPE}
+		)
+
 	@staticmethod
-	def steal_blockchain(peer: Peer) -> Blockchain.BlockChain:
+	def decode_blocks(response: Network.PeerResponse) -> List[Blockchain.Block]:
+		"""
+		:return: Blocks of a /api/blockchain/blocks response, binary or JSON.
+		"""
+		response.raise_for_status()
+		if response.headers.get('Content-Type', '').startswith(encoding.MIME_TYPE):
+			return Blockchain.decode_blocks(response.content)
+		return list(map(Blockchain.Block.from_json, json.loads(response.text)['blocks']))
+
+	def check_chain_length(self, peer: Peer) -> int:
 		"""
-		Grab the chain, validate it and if everything is good, swap it with ours.
 		:param peer:
-		:return:
+		:return: Length of peer's blockchain.
 		"""
-		response = requests.get(f'http://{peer}/api/blockchain/chain')
+		return self.check_chain_lengths([peer])[peer]
 
-		if response.status_code == 200:
+	def check_chain_lengths(self, peers: List[Peer]) -> Dict[Peer, int]:
+		"""
+		Probe the chain length of every peer concurrently.
+		:param peers:
+		:return: Length of each peer's blockchain, 0 for peers that failed.
+		"""
+		lengths = dict()
+		for peer, response in zip(peers, self.transport.request_all('GET', peers, 'api/blockchain/length')):
 			try:
-				return Blockchain.BlockChain.from_json(json.loads(response.text))
+				response.raise_for_status()
+				lengths[peer] = int(response.json()['length'])
 			except Exception:
-				log.debug(f'[PEER] Failed fetching blockchain from peer {peer}')
+				log.debug(f'[PEER] Failed fetching blockchain length from peer {peer}')
+				lengths[peer] = 0
+		return lengths
+
+	def fetch_node_type(self, peer: Peer) -> Optional[str]:
+		"""
+		:return: Type of the peer's node, as reported by /api/nodes/info, None on failure.
+		"""
+		try:
+			response = self._request('GET', peer, 'api/nodes/info')
+			response.raise_for_status()
+			return str(response.json()['node_type'])
+		except Exception:
+			log.debug(f'[PEER] Failed fetching node type from peer {peer}')
+			return None
+
+	def fetch_block(self, peer: Peer, index: int = None, block_hash: str = None) -> Optional[Blockchain.Block]:
+		"""
+		:param index: Index of the block.
+		:param block_hash: Or SHA256 hash of the block.
+		:return: The peer's block, None if the peer does not have it.
+		"""
+		path = f'blocks/{index}' if block_hash is None else f'blocks/hash/{block_hash}'
+		try:
+			response = self._request('GET', peer, f'api/blockchain/{path}', headers={'Accept': encoding.MIME_TYPE})
+			if response.status_code != 200:
 				return None
-		return None
+			if response.headers.get('Content-Type', '').startswith(encoding.MIME_TYPE):
+				return Blockchain.Block.from_bytes(response.content)
+			return Blockchain.Block.from_json(json.loads(response.text))
+		except Exception:
+			log.debug(f'[PEER] Failed fetching block from peer {peer}')
+			return None
+
+	def fetch_merkle_proof(self, peer: Peer, block_index: int,
+						   transaction_index: int) -> Optional[Tuple[Transactions.Transaction, list]]:
+		"""
+		:return: Tuple (transaction, Merkle proof of its inclusion in the block), None on failure.
+		"""
+		try:
+			response = self._request('GET', peer, f'api/blockchain/blocks/{block_index}/proof/{transaction_index}')
+			response.raise_for_status()
+			data = response.json()
+			return Transactions.Transaction.from_json(data['transaction']), [tuple(step) for step in data['proof']]
+		except Exception:
+			log.debug(f'[PEER] Failed fetching Merkle proof from peer {peer}')
+			return None
+
+	def fetch_utxos(self, peer: Peer, address: str) -> Optional[Set[Transactions.TransactionInput]]:
+		"""
+		:return: Unspent outputs of `address` known to the peer, each with its balance set.
+		"""
+		try:
+			response = self._request('GET', peer, f'api/blockchain/utxos/{address}')
+			response.raise_for_status()
+			return {
+				Transactions.TransactionInput(
+					block_index=int(utxo['block_index']),
+					transaction_index=int(utxo['transaction_index']),
+					output_index=int(utxo['output_index']),
+					balance=int(utxo['value'])
+				) for utxo in json.loads(response.text)['utxos']
+			}
+		except Exception:
+			log.debug(f'[PEER] Failed fetching UTXOs from peer {peer}')
+			return None
 
 	@property
 	def peers(self):
@@ -256,16 +664,26 @@ class PeerNetwork:
 class Node:
 	TYPE_CLIENT = 0
 	TYPE_MINER = 1
+	TYPE_LITE_CLIENT = 2
+
+	stores_blocks: bool = True  # Whether the node keeps (and persists) full blocks, no chain is built otherwise
 
 	def __init__(self, private_key: RsaKey, my_peer=None):
 		self.network: PeerNetwork = PeerNetwork(
 			my_peer=my_peer
 		)
-		self.blockchain = Blockchain.BlockChain()
+		self.blockchain: Optional[Blockchain.BlockChain] = None
+		self.block_tree: Optional[BlockTree.BlockTree] = None  # Side branches and orphans
+		if self.stores_blocks:
+			# Nodes with a peer address persist their chain, one store per port.
+			self.blockchain = Storage.open_chain(f'{paths.PATH_CHAINS}/{my_peer.port}' if my_peer else None)
+			self.block_tree = BlockTree.BlockTree(self.blockchain)
 		self.private_key: RsaKey = private_key
 		self.public_key: RsaKey = self.private_key.publickey()
-		self.processed_hashes: List[str] = list()  # Keep track of already processed
-												   # blocks and transactions
+		self._identity: str = binascii.hexlify(self.public_key.exportKey(format='DER')).decode('ascii')
+		Transactions.register_key(self._identity, self.public_key)  # Our own signatures never need a key import
+		self.processed_hashes: SeenCache = SeenCache(SEEN_CACHE_SIZE)  # Keep track of already processed
+																	  # blocks and transactions
 
 	@property
 	def identity(self) -> str:
@@ -273,7 +691,62 @@ class Node:
 		ASCII Representation of node's public_key
 		:return:
 		"""
-		return binascii.hexlify(self.public_key.exportKey(format='DER')).decode('ascii')
+		return self._identity
+
+	def reorganize(self, fork: int, branch: List[Blockchain.Block]):
+		"""
+		Switch our chain to a longer (validated) branch in place, see `BlockChain.reorganize`.
+		:param fork: Number of blocks in common.
+		:param branch: Blocks following the fork point.
+		:return: Tuple of the disconnected and the connected (block, undo record) pairs.
+		"""
+		if fork + len(branch) <= self.blockchain.size:
+			raise ValueError('Branch is not longer than our chain.')
+		disconnected, connected = self.blockchain.reorganize(fork, branch)
+		for block, _ in disconnected:  # They may still win later on
+			self.block_tree.block_disconnected(block)
+		self.block_tree.chain_changed()
+		log.debug(f'[BLOCKCHAIN] Reorganized. Disconnected {len(disconnected)} and connected {len(connected)} blocks.')
+		return disconnected, connected
+
+	def fetch_missing_parents(self, block_hash: str, max_fetches: int = MAX_PARENT_FETCHES) -> bool:
+		"""
+		Fetch by hash, from our peers, the blocks an orphan block is missing to join the block tree.
+		:param block_hash: Hash of the orphan block.
+		:param max_fetches: Blocks fetched before giving up.
+		:return: Whether the orphan joined the tree.
+		"""
+		for _ in range(max_fetches):
+			missing = self.block_tree.missing_parent(block_hash)
+			if missing is None:
+				return True
+			for peer in list(self.network.peers):
+				parent = self.network.fetch_block(peer, block_hash=missing)
+				if parent is not None and parent.calculate_hash() == missing:
+					break
+			else:
+				log.debug(f'[BLOCK - {block_hash}] No peer has parent {missing}')
+				return False
+			self.block_tree.add(parent)
+		return self.block_tree.missing_parent(block_hash) is None
+
+	def connect_best_branch(self) -> bool:
+		"""
+		Switch our chain to the side branch of the block tree with the most work, if it has more work than
+		our chain. Branches failing validation are discarded from the tree and the next best one is tried.
+		:return: Whether our chain changed.
+		"""
+		tip = self.block_tree.best_tip()
+		while tip is not None:
+			fork, branch = self.block_tree.branch(tip)
+			invalid = self.blockchain.check_branch(fork, branch)
+			if invalid is None:
+				self.reorganize(fork, branch)
+				return True
+			log.debug(f'[BLOCK - {branch[invalid].hash}] Rejected (INVALID BRANCH)')
+			self.block_tree.discard(branch[invalid].calculate_hash())
+			tip = self.block_tree.best_tip()
+		return False
 
 	def __str__(self):
 		return self.identity
@@ -283,18 +756,43 @@ class Client(Node):
 	def __init__(self, private_key: RsaKey, my_peer=None):
 		super().__init__(private_key, my_peer=my_peer)
 		self.signer: PKCS115_SigScheme = pkcs1_15.new(self.private_key)
-		self.my_UTXOs: Set[Transactions.TransactionInput] = set()  # List of unspent transactions
+		self.wallet: Wallet.UTXOTracker = Wallet.UTXOTracker(
+			self.identity, self.blockchain.UTXOs.find(self.identity) if self.stores_blocks else ()
+		)
+
+	@property
+	def my_UTXOs(self) -> Wallet.UTXOTracker:
+		"""
+		Our unspent outputs.
+		"""
+		return self.wallet
 
 	@property
 	def balance(self):
-		return sum(
-			filter(lambda o: o > 0, [utxo.balance for utxo in self.my_UTXOs])
-		)
+		return self.wallet.balance
 
-	def send_coins(self, transactions: list) -> bool:
+	def reorganize(self, fork: int, branch: List[Blockchain.Block]):
+		"""
+		Also updates our UTXOs from the undo records of the disconnected and connected blocks.
+		"""
+		disconnected, connected = super().reorganize(fork, branch)
+		for block, undo in disconnected:  # Tip first
+			self.wallet.disconnect_block(block, undo)
+		for block, _ in connected:
+			self.wallet.connect_block(block)
+		return disconnected, connected
+
+	def send_coins(self, transactions: list, fee: int = 0, strategy: str = Wallet.DEFAULT_STRATEGY,
+				   cost_of_change: int = 0) -> bool:
+		"""
+		:param transactions: List of (recipient address, amount) tuples.
+		:param fee: Fee left to the miner.
+		:param strategy: Coin selection strategy, see `Wallet.STRATEGIES`.
+		:param cost_of_change: Excess given up as fee rather than creating a change output.
+		:return: Whether the transaction was created, accepted by our mempool (miners) and broadcast.
+		"""
 		transaction_outputs: List[Transactions.TransactionOutput] = []
 		total_balance = 0
-		allocated_balance = 0
 		# Create Transaction Outputs
 		for t in transactions:
 			try:
@@ -310,50 +808,221 @@ class Client(Node):
 				log.error('Failed parsing transactions. Wrong tuple provided.')
 				return False
 
-		# Allocate enough funds
-		sorted_utxo: List[Transactions.TransactionInput] = sorted(self.my_UTXOs, key=operator.attrgetter('balance'))
-		selected_utxo: List[Transactions.TransactionInput] = []
-		for utxo in sorted_utxo:
-			if allocated_balance >= total_balance:
-				break
+		if total_balance == 0 or fee < 0:
+			return False
+
+		transaction = self.__fund_transaction(transaction_outputs, fee, strategy, cost_of_change)
+		if transaction is None:  # Not enough funds
+			return False
+		transaction.sign_transaction(self)
+
+		if isinstance(self, Miner) and not self.add_transaction(transaction):
+			for utxo in transaction.inputs:  # Not spent after all
+				self.wallet.add(utxo)
+			log.debug(f'[WALLET] Transaction {transaction.hash} rejected by our mempool')
+			return False
+
+		self.processed_hashes.add(transaction.hash)  # Never requested back from the peers we announce it to
+		self.network.broadcast_transaction(transaction)
+		return True
+
+	def send_batch(self, payments: list, fee: int = 0, strategy: str = Wallet.DEFAULT_STRATEGY,
+				   cost_of_change: int = 0, max_outputs: int = MAX_PAYMENT_OUTPUTS) -> List[dict]:
+		"""
+		Send many payments at once: they are packed into as few transactions as `max_outputs` allows
+		and announced to our peers as a single gossip batch.
+		:param payments: List of (recipient address, amount) tuples.
+		:param fee: Fee left to the miner, per transaction.
+		:param strategy: Coin selection strategy, see `Wallet.STRATEGIES`.
+		:param cost_of_change: Excess given up as fee rather than creating a change output.
+		:param max_outputs: Payments per transaction.
+		:return: Status of each payment, in order: dicts with its `recipient`, `amount`, `status`
+		('sent', 'invalid', 'insufficient_funds' or 'rejected') and the hash of its `transaction`.
+		"""
+		if fee < 0 or max_outputs <= 0:
+			raise ValueError('Fee must not be negative and transactions must have outputs!')
 
-			if utxo.balance == -1:
+		statuses = []
+		valid = []
+		for payment in payments:
+			try:
+				recipient, amount = payment
+			except (TypeError, ValueError):
+				recipient, amount = None, None
+			status = {'recipient': recipient, 'amount': amount, 'status': 'invalid', 'transaction': None}
+			statuses.append(status)
+			if isinstance(recipient, str) and type(amount) is int and amount > 0:
+				valid.append(status)
+
+		transactions = []
+		funded = []
+		for start in range(0, len(valid), max_outputs):
+			chunk = valid[start:start + max_outputs]
+			transaction = self.__fund_payments(chunk, fee, strategy, cost_of_change)
+			if transaction is None:
+				# Drop the payments we cannot afford (in order) and fund the rest
+				budget = self.wallet.balance - fee
+				affordable = []
+				for status in chunk:
+					if status['amount'] <= budget:
+						budget -= status['amount']
+						affordable.append(status)
+					else:
+						status['status'] = 'insufficient_funds'
+				chunk = affordable
+				if chunk:
+					transaction = self.__fund_payments(chunk, fee, strategy, cost_of_change)
+			if transaction is None:
+				for status in chunk:
+					status['status'] = 'insufficient_funds'
 				continue
+			transactions.append(transaction)
+			funded.append(chunk)
+
+		for transaction in transactions:  # In-process, our private key is never handed to other processes
+			transaction.sign_transaction(self)
+
+		accepted = []
+		for transaction, chunk in zip(transactions, funded):
+			if isinstance(self, Miner) and not self.add_transaction(transaction):
+				for utxo in transaction.inputs:  # Not spent after all
+					self.wallet.add(utxo)
+				result = 'rejected'
+			else:
+				accepted.append(transaction)
+				self.processed_hashes.add(transaction.hash)
+				result = 'sent'
+			for status in chunk:
+				status['status'] = result
+				status['transaction'] = transaction.hash
+
+		self.network.broadcast_transactions(accepted)
+		log.debug(f'[WALLET] Batch of {len(payments)} payments, {len(accepted)} transactions sent')
+		return statuses
+
+	def __fund_payments(self, payments: List[dict], fee: int, strategy: str,
+						cost_of_change: int) -> Optional[Transactions.Transaction]:
+		"""
+		:param payments: Payment statuses of `send_batch`, paid by the transaction.
+		"""
+		outputs = [Transactions.TransactionOutput(status['recipient'], status['amount']) for status in payments]
+		return self.__fund_transaction(outputs, fee, strategy, cost_of_change)
 
-			selected_utxo.append(utxo)
-			allocated_balance += utxo.balance
+	def __fund_transaction(self, outputs: List[Transactions.TransactionOutput], fee: int, strategy: str,
+						   cost_of_change: int) -> Optional[Transactions.Transaction]:
+		"""
+		Build an (unsigned) transaction paying `outputs` and `fee` from our wallet, with a change output back to us.
+		The coins it spends are taken out of the wallet (temporarily 'spent').
+		:return: The transaction, None if we cannot afford it.
+		"""
+		amount = sum(output.value for output in outputs)
+		selected_utxo = self.wallet.take(amount + fee, strategy=strategy, cost_of_change=cost_of_change)
+		if selected_utxo is None:
+			return None
 
-		# Verify we have enough funds
-		if total_balance > allocated_balance:
-			return False
+		change = sum(utxo.balance for utxo in selected_utxo) - amount - fee
+		if change > cost_of_change:
+			outputs = list(outputs) + [Transactions.TransactionOutput(recipient_address=self.identity, value=change)]
 
-		transaction = Transactions.Transaction(
+		return Transactions.Transaction(
 			sender=self.identity,
 			inputs=tuple(selected_utxo),
-			outputs=tuple(transaction_outputs),
+			outputs=tuple(outputs),
 		)
-		transaction.sign_transaction(self)
 
-		if isinstance(self, Miner):
-			self.add_transaction(transaction)
 
-		# Set UTXO as temporary 'Spent'
-		for utxo in selected_utxo:
-			self.my_UTXOs.remove(utxo)
+class LiteClient(Client):
+	"""
+	Lite (SPV) client: keeps the headers of the chain only and verifies its own payments with Merkle proofs
+	served by full nodes, so memory and bandwidth grow with the number of headers, not with the blocks.
+	Which of our outputs are still unspent is taken from the peers.
+	"""
+	stores_blocks = False
 
-		self.network.broadcast_transaction(transaction)
+	def __init__(self, private_key: RsaKey, my_peer=None, genesis_hash: str = None):
+		"""
+		:param genesis_hash: Hash of the genesis block of the network. Defaults to the genesis of the first chain
+		synchronized with.
+		"""
+		super().__init__(private_key, my_peer=my_peer)
+		self.headers: Blockchain.HeaderChain = Blockchain.HeaderChain(genesis_hash=genesis_hash)
+
+	def receive_header(self, header: Blockchain.BlockHeader) -> bool:
+		"""
+		:param header: Header of a block broadcast by a peer.
+		:return: Whether it extends our headers.
+		"""
+		return self.headers.append(header)
+
+	def verify_payment(self, utxo: Transactions.TransactionInput, transaction: Transactions.Transaction,
+					   proof) -> bool:
+		"""
+		:param utxo: One of our outputs, as reported by a peer.
+		:param transaction: The transaction that created it.
+		:param proof: Merkle proof of the transaction.
+		:return: Whether the output pays us `utxo.balance` and its transaction is in our headers' chain.
+		"""
+		if not 0 <= utxo.output_index < len(transaction.outputs):
+			return False
+		output = transaction.outputs[utxo.output_index]
+		return output.recipient_address == self.identity \
+			and output.value == utxo.balance \
+			and self.headers.verify_transaction(transaction, utxo.block_index, proof)
+
+	def sync(self) -> bool:
+		"""
+		Follow the longest chain of headers among our peers, then verify our payments against it.
+		:return: Whether a peer was synchronized with.
+		"""
+		peers = list(self.network.peers)
+		lengths = self.network.check_chain_lengths(peers)
+		for peer in sorted(peers, key=lengths.get, reverse=True):
+			if lengths[peer] == 0:
+				break
+			self.network.sync_headers(peer, self.headers, length=lengths[peer])
+			if self.sync_payments(peer):
+				return True
+		return False
+
+	def sync_payments(self, peer: Peer) -> bool:
+		"""
+		Replace our UTXOs with the ones of the peer, each proven with a Merkle proof
+		(outputs we already verified are not fetched again).
+		:return: False if the peer's UTXOs could not be fetched.
+		"""
+		utxos = self.network.fetch_utxos(peer, self.identity)
+		if utxos is None:
+			return False
+
+		verified = set()
+		for utxo in utxos:
+			if utxo in self.my_UTXOs:
+				verified.add(utxo)
+				continue
+			if utxo.block_index >= self.headers.size:
+				continue  # Not in our headers (yet)
+			proven = self.network.fetch_merkle_proof(peer, utxo.block_index, utxo.transaction_index)
+			if proven is not None and self.verify_payment(utxo, *proven):
+				verified.add(utxo)
+			else:
+				log.debug(f'[WALLET] Unproven output {utxo.to_dict()} from peer {peer}')
+		self.wallet.reset(verified)
 		return True
 
 
 class Miner(Client):
 	def __init__(self, private_key: RsaKey, my_peer=None):
 		super().__init__(private_key, my_peer=my_peer)
-		self.verified_transactions: Dict[str, Transactions.Transaction] = dict()  # Store Verified transactions to input in block
+		self.mempool: Mempool.Mempool = Mempool.Mempool()  # Store Verified transactions to input in block
+		self.max_block_transactions: int = Mempool.MAX_BLOCK_TRANSACTIONS
+		self.max_block_bytes: int = Mempool.MAX_BLOCK_BYTES
 		# self.UTXOs: Set[Transactions.TransactionInput] = set()  # List of Unspent Transactions Available
+		self.mining_engine: Mining.ProofOfWorkEngine = Mining.ProofOfWorkEngine()
 
 		# Unconventional, but i guess it's fine just for the demonstration
 		# Miner shouldn't create Genesis block?
-		self.__construct_genesis()
+		if self.blockchain.size == 0:  # Unless we reopened a stored chain
+			self.__construct_genesis()
 
 		# Settings
 		self.__is_mining: bool = False
@@ -362,61 +1031,55 @@ class Miner(Client):
 	def __construct_genesis(self):
 		self.construct_block(
 			proof=42,
-			previous_hash="Samira-mira-mira-e-e-Waka-Waka-e-e"
+			previous_hash=Blockchain.GENESIS_PREVIOUS_HASH
 		)
 
-	def construct_block(self, verified_transactions: List[Transactions.Transaction] = [],
+	def block_template(self, verified_transactions: List[Transactions.Transaction] = None) -> Mining.BlockTemplate:
+		"""
+		:param verified_transactions: Candidate transactions, the highest fee ones of the mempool by default.
+		:return: Template of the next block, within our block limits.
+		"""
+		template = Mining.BlockTemplate(self.blockchain, self.max_block_transactions, self.max_block_bytes)
+		if verified_transactions is None:
+			verified_transactions = self.mempool.select(self.max_block_transactions, self.max_block_bytes)
+		template.fill(verified_transactions)
+		return template
+
+	def construct_block(self, verified_transactions: List[Transactions.Transaction] = (),
 						proof=None, previous_hash=None) -> Blockchain.Block:
+		"""
+		Mine a block on top of our chain, append it and broadcast it.
+		:param verified_transactions: Candidate transactions of the block, None to pick them from the mempool.
+		:param proof: Proof-of-Work and `previous_hash` of the genesis block.
+		:return: The block, None if mining was cancelled.
+		"""
 		if proof is None or previous_hash is None:
-			last_block = self.blockchain.last_block
-			proof = Blockchain.proof_of_work(last_block.proof)
-			previous_hash = last_block.calculate_hash()
-
-		block = Blockchain.Block(
-			index=len(self.blockchain.blocks),
-			proof=proof,
-			verified_transactions=verified_transactions,
-			previous_block_hash=previous_hash)
+			template = self.block_template(verified_transactions)
+			header = template.seal(self.__coinbase(template.coinbase_value))
+			proof = self.mining_engine.search(header.prefix())
+			if proof is None or template.is_stale():
+				log.debug('[MINER] Mining cancelled. A competing block arrived.')
+				return None
+			block = template.assemble(proof)
+		else:  # Genesis
+			block = Blockchain.Block(
+				index=self.blockchain.size,
+				proof=proof,
+				verified_transactions=[self.__coinbase(Blockchain.block_reward(self.blockchain.size))],
+				previous_block_hash=previous_hash
+			)
 
-		coinbase_total = block.reward + sum([trans.transaction_fee for trans in verified_transactions])
+		self.blockchain.append_block(block)  # Also adds all outputs as new UTXOs
+		self.wallet.connect_block(block)  # Our coinbase (and any payment to us)
+		self.network.broadcast_block(block)  # Only once it is part of our chain
+		return block
 
-		# Coinbase Transaction
+	def __coinbase(self, value: int) -> Transactions.Transaction:
 		coinbase = Transactions.Transaction(
-			outputs=tuple([
-				Transactions.TransactionOutput(
-					self.identity,
-					coinbase_total
-				)]
-			)
+			outputs=(Transactions.TransactionOutput(self.identity, value),)
 		)
 		coinbase.sign_transaction(self)
-		block.verified_transactions.insert(0, coinbase)
-		self.network.broadcast_block(block)	 # Broadcast block to available nodes
-
-		self.blockchain.blocks.append(block)
-
-		# -- Add Coinbase as new UTXO for Miner --
-		# utxo = Transactions.TransactionInput(
-		# 		block.index, 0, 0, coinbase_total
-		# 	)
-
-		# utxo.check_validity(self.identity, self.blockchain.blocks)
-		# self.my_UTXOs.add(utxo)  # Add UTXO
-
-		# ----------------------------------
-		# -- Add all Outputs as new UTXOS --
-		# ----------------------------------
-		self.blockchain.UTXOs.difference_update(block.extract_STXOs())
-		self.blockchain.UTXOs = set(self.blockchain.UTXOs.union(block.extract_UTXOs()))
-
-		# -- UPDATE MY UTXO SET --
-		my_utxos = set(block.find_UTXOs(self.identity))
-		for my_utxo in my_utxos:  # This will fail, but will cache the value
-			my_utxo.check_validity(sender=None, blockchain=self.blockchain)
-		self.my_UTXOs = self.my_UTXOs.union(my_utxos)
-		# ---------------------
-
-		return block
+		return coinbase
 
 	@property
 	def is_mining(self):
@@ -428,6 +1091,7 @@ class Miner(Client):
 		if self.__is_mining:
 			self.__mining_thread.start()
 		else:
+			self.mining_engine.cancel()
 			self.__mining_thread = threading.Thread(target=self.__mine, daemon=True)
 
 	def __mine(self):
@@ -436,32 +1100,52 @@ class Miner(Client):
 
 	def manual_mine(self):
 		"""
-		Mine --WITHOUT TRANSACTION LIMIT--
+		Mine a block of the highest fee transactions of the mempool, within the block limits.
 		:return:
 		"""
-		if not self.verified_transactions:
+		if not self.mempool:
 			return False
 
-		transactions: Dict[str, Transactions.Transaction] = self.verified_transactions
-		self.verified_transactions = dict()
-		new_block = self.construct_block(
-			verified_transactions=list(transactions.values()),
-		)
+		new_block = self.construct_block(verified_transactions=None)  # From a template of the mempool
+		if new_block is not None:
+			self.mempool.remove_block(new_block)
 		return new_block
 
+	def reorganize(self, fork: int, branch: List[Blockchain.Block]):
+		"""
+		Also updates the mempool: transactions of the connected blocks (and their conflicts) are removed,
+		transactions of the disconnected blocks are put back if valid on the new chain and the remaining ones
+		are checked again against it.
+		"""
+		disconnected, connected = super().reorganize(fork, branch)
+		self.mining_engine.cancel()  # Our current block is now stale
+		for block, _ in connected:
+			self.mempool.remove_block(block)
+		restored = set()
+		for block, _ in reversed(disconnected):
+			for transaction in block.verified_transactions[1:]:  # Skip the coinbase
+				if self.add_transaction(transaction):  # Validated against the new chain
+					restored.add(transaction.hash)
+		for transaction in list(self.mempool):
+			if transaction.hash in restored:
+				continue
+			# Outpoints are positional, inputs spending a disconnected block now point into the new branch
+			if not transaction.check_validity(blockchain=self.blockchain, check_utxos=True, check_signature=False):
+				self.mempool.remove(transaction.hash)
+				log.debug(f'[MEMPOOL] Evicted {transaction.hash} (INVALID AFTER REORGANIZATION)')
+		return disconnected, connected
+
 	def add_transaction(self, transaction) -> bool:
 		if not isinstance(transaction, Transactions.Transaction):
 			raise ValueError("Transaction is not a valid Transaction object!")
 
-		t_hash = transaction.hash
-		if t_hash in self.verified_transactions.keys():
+		if transaction.hash in self.mempool:
 			return False
 
 		if not transaction.check_validity(blockchain=self.blockchain, check_utxos=True):
 			return False
 
-		self.verified_transactions[t_hash] = transaction
-		return True
+		return self.mempool.add(transaction)
 
 
 class KeyFactory:
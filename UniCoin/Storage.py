@@ -0,0 +1,333 @@
+import collections
+import hashlib
+import os
+import struct
+import threading
+
+from typing import Optional
+
+import UniCoin.Blockchain as Blockchain
+import UniCoin.helpers.encoding as encoding
+
+import logging
+log = logging.getLogger('werkzeug')
+
+FILE_BLOCKS = 'blocks.dat'
+FILE_INDEX = 'blocks.idx'
+FILE_UNDO = 'undo.dat'
+FILE_UNDO_INDEX = 'undo.idx'
+FILE_SNAPSHOT = 'utxos.dat'
+
+# Blocks connected between two UTXO snapshots.
+SNAPSHOT_INTERVAL = 10
+
+_RECORD = struct.Struct('<I')  # Length prefix of every block record
+_OFFSET = struct.Struct('<Q')  # Index entry, offset of a block record
+
+
+class BlockStore:
+	"""
+	Append-only block storage.
+	Blocks are stored as length-prefixed binary records in `blocks.dat`, `blocks.idx` holds the fixed size
+	offset of each record so any block is a single seek away. Behaves like the list of blocks of a BlockChain.
+	Other entities indexed by block (e.g. undo records) can be stored the same way in their own files.
+	"""
+
+	def __init__(self, path: str, cache_size: int = 1024, fsync: bool = True,
+				 entity=Blockchain.Block, data_file: str = FILE_BLOCKS, index_file: str = FILE_INDEX):
+		"""
+		:param path: Directory of the store.
+		:param cache_size: Number of decoded blocks kept in memory.
+		:param fsync: Whether appends are flushed to disk before returning.
+		:param entity: Class of the stored records, providing from_bytes/to_bytes.
+		:param data_file: Name of the records file.
+		:param index_file: Name of the offsets file.
+		"""
+		os.makedirs(path, exist_ok=True)
+		self._entity = entity
+		self._data = open(os.path.join(path, data_file), 'a+b')
+		self._index = open(os.path.join(path, index_file), 'a+b')
+		self._fsync = fsync
+		self._cache: collections.OrderedDict = collections.OrderedDict()
+		self._cache_size = cache_size
+		self._length = 0
+		self._lock = threading.RLock()  # Guards the file positions, shared by Flask and miner threads
+		self.recover()
+
+	def recover(self):
+		"""
+		Crash-consistency check.
+		Drops index entries pointing past the end of the data file or at undecodable records, then truncates
+		the data file after the last indexed record. Only the tail is inspected since writes only append.
+		:return: Number of index entries dropped.
+		"""
+		with self._lock:
+			index_size = os.fstat(self._index.fileno()).st_size
+			data_size = os.fstat(self._data.fileno()).st_size
+			length = index_size // _OFFSET.size
+			dropped = 0
+
+			end = 0
+			while length > 0:
+				offset = self._read_offset(length - 1)
+				try:
+					record = self._read_record(offset, data_size)
+					self._entity.from_bytes(record)
+					end = offset + _RECORD.size + len(record)
+					break
+				except (ValueError, EOFError):
+					length -= 1
+					dropped += 1
+
+			if index_size != length * _OFFSET.size:
+				self._truncate_file(self._index, length * _OFFSET.size)
+			if data_size != end:
+				self._truncate_file(self._data, end)
+			if dropped or data_size != end:
+				log.debug(f'[STORE] Recovered block store. Dropped {dropped} blocks and {data_size - end} trailing bytes.')
+
+			self._length = length
+			self._cache.clear()
+			return dropped
+
+	def _read_offset(self, indx: int) -> int:
+		self._index.seek(indx * _OFFSET.size)
+		return _OFFSET.unpack(self._index.read(_OFFSET.size))[0]
+
+	def _read_record(self, offset: int, data_size: int = None) -> bytes:
+		self._data.seek(offset)
+		header = self._data.read(_RECORD.size)
+		if len(header) != _RECORD.size:
+			raise EOFError('Truncated block record.')
+		length = _RECORD.unpack(header)[0]
+		if data_size is not None and offset + _RECORD.size + length > data_size:
+			raise EOFError('Truncated block record.')
+		return self._data.read(length)
+
+	def _truncate_file(self, file, size: int):
+		file.flush()
+		file.truncate(size)
+		self._sync(file)
+
+	def _sync(self, file):
+		file.flush()
+		if self._fsync:
+			os.fsync(file.fileno())
+
+	def _cache_block(self, indx: int, block: Blockchain.Block):
+		self._cache[indx] = block
+		self._cache.move_to_end(indx)
+		while len(self._cache) > self._cache_size:
+			self._cache.popitem(last=False)
+
+	def get(self, indx: int) -> Blockchain.Block:
+		with self._lock:
+			block = self._cache.get(indx)
+			if block is not None:
+				self._cache.move_to_end(indx)
+				return block
+
+			block = self._entity.from_bytes(self._read_record(self._read_offset(indx)))
+			self._cache_block(indx, block)
+			return block
+
+	def append(self, block: Blockchain.Block):
+		"""
+		Append a block. The record is written (and synced) before its index entry, a crash in between
+		leaves trailing bytes that `recover` removes.
+		"""
+		data = block.to_bytes()
+		with self._lock:
+			self._data.seek(0, os.SEEK_END)
+			offset = self._data.tell()
+			self._data.write(_RECORD.pack(len(data)) + data)
+			self._sync(self._data)
+
+			self._index.seek(0, os.SEEK_END)
+			self._index.write(_OFFSET.pack(offset))
+			self._sync(self._index)
+
+			self._cache_block(self._length, block)
+			self._length += 1
+
+	def extend(self, blocks):
+		for block in blocks:
+			self.append(block)
+
+	def truncate(self, length: int):
+		"""
+		Drop every block from `length` onwards.
+		"""
+		with self._lock:
+			if length >= self._length:
+				return
+
+			offset = self._read_offset(length)
+			self._truncate_file(self._index, length * _OFFSET.size)
+			self._truncate_file(self._data, offset)
+			for indx in range(length, self._length):
+				self._cache.pop(indx, None)
+			self._length = length
+
+	def pop(self) -> Blockchain.Block:
+		with self._lock:
+			if self._length == 0:
+				raise IndexError('pop from empty BlockStore')
+			block = self.get(self._length - 1)
+			self.truncate(self._length - 1)
+			return block
+
+	def close(self):
+		self._data.close()
+		self._index.close()
+
+	def __len__(self):
+		return self._length
+
+	def __getitem__(self, item):
+		if isinstance(item, slice):
+			return [self.get(indx) for indx in range(*item.indices(self._length))]
+
+		indx = item + self._length if item < 0 else item
+		if not 0 <= indx < self._length:
+			raise IndexError('BlockStore index out of range')
+		return self.get(indx)
+
+	def __iter__(self):
+		for indx in range(self._length):
+			yield self.get(indx)
+
+
+class ChainStore:
+	"""
+	Persistent BlockChain.
+	Blocks live in a BlockStore, the UTXO set is snapshotted every `SNAPSHOT_INTERVAL` blocks, so reopening
+	the chain costs loading the snapshot and replaying the blocks connected after it.
+	The undo record of each block is kept in a second store, next to the blocks, for reorganizations.
+	"""
+
+	def __init__(self, path: str, snapshot_interval: int = SNAPSHOT_INTERVAL, fsync: bool = True):
+		"""
+		:param path: Directory of the store.
+		:param snapshot_interval: Blocks connected between two UTXO snapshots.
+		:param fsync: Whether writes are flushed to disk before returning.
+		"""
+		self.path: str = path
+		self.snapshot_interval: int = snapshot_interval
+		self.blocks: BlockStore = BlockStore(path, fsync=fsync)
+		self.undo: BlockStore = BlockStore(
+			path, cache_size=64, fsync=fsync,
+			entity=Blockchain.BlockUndo, data_file=FILE_UNDO, index_file=FILE_UNDO_INDEX
+		)
+		self._fsync = fsync
+		self._snapshot_height: int = 0
+
+	@property
+	def _snapshot_file(self) -> str:
+		return os.path.join(self.path, FILE_SNAPSHOT)
+
+	def load(self) -> Blockchain.BlockChain:
+		"""
+		Reopen the stored chain.
+		The UTXO snapshot is verified (checksum, height and tip hash) against the block store, blocks after
+		it are replayed. A missing or inconsistent snapshot falls back to replaying the whole chain.
+		:return: The stored BlockChain, empty if nothing was stored.
+		"""
+		height, utxos = self._load_snapshot()
+		if utxos is None:
+			height, utxos = 0, Blockchain.UTXOSet()
+
+		# Undo records are appended after their block, a crash may leave them behind (or ahead after a pop)
+		self.undo.truncate(len(self.blocks))
+		if len(self.undo) < height:
+			for indx in range(len(self.undo), height):
+				self.undo.append(Blockchain.BlockUndo.from_block(self.blocks[indx], self.blocks))
+			log.debug(f'[STORE] Rebuilt undo records up to block \'{height}\'.')
+
+		for indx in range(height, len(self.blocks)):
+			undo = utxos.connect_block(self.blocks[indx])
+			if indx >= len(self.undo):
+				self.undo.append(undo)
+
+		if height != len(self.blocks):
+			log.debug(f'[STORE] Replayed {len(self.blocks) - height} blocks on top of the UTXO snapshot.')
+
+		blockchain = Blockchain.BlockChain(blocks=self.blocks, utxos=utxos, store=self)
+		self._snapshot_height = height
+		if height != len(self.blocks):
+			self.save_snapshot(blockchain)
+		return blockchain
+
+	def _load_snapshot(self):
+		"""
+		:return: (height, UTXOSet) of the snapshot, (0, None) if missing or inconsistent.
+		"""
+		try:
+			with open(self._snapshot_file, 'rb') as file:
+				data = file.read()
+		except FileNotFoundError:
+			return 0, None
+
+		payload, checksum = data[:-32], data[-32:]
+		if hashlib.sha256(payload).digest() != checksum:
+			log.debug('[STORE] UTXO snapshot is corrupted (CHECKSUM).')
+			return 0, None
+
+		try:
+			reader = encoding.Reader(payload, encoding.KIND_UTXO_SNAPSHOT)
+			height = reader.u32()
+			tip_hash = reader.string()
+			utxos = Blockchain.UTXOSet.read(reader)
+			reader.finish()
+		except ValueError as e:
+			log.debug(f'[STORE] UTXO snapshot is corrupted ({e}).')
+			return 0, None
+
+		if height > len(self.blocks) or (height > 0 and self.blocks[height - 1].calculate_hash() != tip_hash):
+			log.debug('[STORE] UTXO snapshot does not match the stored blocks.')
+			return 0, None
+		return height, utxos
+
+	def save_snapshot(self, blockchain: Blockchain.BlockChain):
+		"""
+		Atomically replace the UTXO snapshot with the current state of the chain.
+		"""
+		writer = encoding.Writer(encoding.KIND_UTXO_SNAPSHOT)
+		writer.u32(blockchain.size)
+		writer.string(blockchain.last_block.calculate_hash() if blockchain.size else None)
+		blockchain.UTXOs.write(writer)
+		payload = writer.getvalue()
+
+		tmp_file = f'{self._snapshot_file}.tmp'
+		with open(tmp_file, 'wb') as file:
+			file.write(payload + hashlib.sha256(payload).digest())
+			file.flush()
+			if self._fsync:
+				os.fsync(file.fileno())
+		os.replace(tmp_file, self._snapshot_file)
+		self._snapshot_height = blockchain.size
+
+	def block_connected(self, blockchain: Blockchain.BlockChain, undo: Blockchain.BlockUndo):
+		self.undo.truncate(blockchain.size - 1)
+		self.undo.append(undo)
+		if blockchain.size - self._snapshot_height >= self.snapshot_interval:
+			self.save_snapshot(blockchain)
+
+	def block_disconnected(self, blockchain: Blockchain.BlockChain):
+		self.undo.truncate(blockchain.size)
+		if self._snapshot_height > blockchain.size:
+			self.save_snapshot(blockchain)
+
+	def close(self):
+		self.blocks.close()
+		self.undo.close()
+
+
+def open_chain(path: Optional[str]) -> Blockchain.BlockChain:
+	"""
+	:param path: Directory of the store, None for an in-memory chain.
+	:return: The stored BlockChain.
+	"""
+	if path is None:
+		return Blockchain.BlockChain()
+	return ChainStore(path).load()
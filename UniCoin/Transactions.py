@@ -3,20 +3,82 @@ import json
 import collections
 import time
 import binascii
+import struct
+import os
+import threading
+import concurrent.futures
 
-from typing import Tuple
+from typing import Tuple, List
 from Crypto.Hash import SHA256
 from Crypto.PublicKey import RSA
+from Crypto.PublicKey.RSA import RsaKey
 from Crypto.Signature import pkcs1_15
+from Crypto.Signature.pkcs1_15 import PKCS115_SigScheme
 
 import UniCoin.Nodes as Nodes
 import UniCoin.Blockchain as Blockchain
 
+import UniCoin.helpers.encoding as encoding
+from UniCoin.helpers.hashing import HashCache
+from UniCoin.helpers.caches import LRUCache
+
 import logging
 log = logging.getLogger('werkzeug')
 
+# Batches smaller than this are verified in-process, the process pool round-trip is not worth it.
+PARALLEL_MIN_BATCH = 16
+
+# Number of parsed public keys kept, per process.
+KEY_CACHE_SIZE = 1024
+
+# Verifiers of recently seen senders, keyed by address (hex DER public key).
+key_cache = LRUCache(KEY_CACHE_SIZE)
+
+
+def _import_verifier(address: str) -> PKCS115_SigScheme:
+	return pkcs1_15.new(RSA.import_key(binascii.unhexlify(address)))
+
+
+def get_verifier(address: str) -> PKCS115_SigScheme:
+	"""
+	:param address: Address (hex DER public key) of the signer.
+	:return: Signature verifier of the address, parsed once and then served from `key_cache`.
+	"""
+	return key_cache.get_or_create(address, _import_verifier)
+
+
+def register_key(address: str, public_key: RsaKey):
+	"""
+	Seed `key_cache` with a key we already hold, e.g. our own, so that it never has to be parsed.
+	:param address: Address (hex DER public key) of the key.
+	:param public_key:
+	"""
+	key_cache.put(address, pkcs1_15.new(public_key))
+
+
+def _verify_signature(job) -> bool:
+	"""
+	Verify a signature job, as built by `Transaction.signature_job`.
+	Module level so that it can run in worker processes.
+	:param job: Tuple (signer address, signed message, signature).
+	:return: Whether the signature belongs to the signer or not
+	"""
+	address, message, signature = job
+	try:
+		verifier = get_verifier(address)
+		h = SHA256.new(message)
+		verifier.verify(h, binascii.unhexlify(signature))			# Verify that the hash and transaction match
+		return True
+	except (ValueError, TypeError, Exception) as e:
+		log.error(e)
+		return False
+
+
+class TransactionInput(HashCache, encoding.BinarySerializable):
+	_hashed_fields = ('block_index', 'transaction_index', 'output_index')
+	_kind = encoding.KIND_TRANSACTION_INPUT
+	_struct = struct.Struct('<III')
 
-class TransactionInput:
 	def __init__(self, block_index: int, transaction_index: int, output_index: int, balance: int = None):
 		self.block_index: int = block_index
 		self.transaction_index: int = transaction_index
@@ -34,15 +96,11 @@ class TransactionInput:
 
 	def find_transaction(self, blockchain):
 		try:
-			blocks = blockchain.blocks
-			log.error(f'{len(blocks)} || {self.block_index}')
-			block: Blockchain.Block = blocks[self.block_index]
-			log.error(f'{len(block.verified_transactions)} || {self.transaction_index}')
+			block: Blockchain.Block = blockchain.blocks[self.block_index]
 			transaction = block.verified_transactions[self.transaction_index]
-			log.error(f'{len(transaction.outputs)} || {self.output_index}')
 			return transaction.outputs[self.output_index]
 		except Exception as e:
-			log.error(e)
+			log.debug(f'[TRANSACTION INP - {self.hash}] Output not found ({e})')
 			return None
 
 	def check_validity(self, sender: str, blockchain, check_utxos=False) -> bool:
@@ -52,7 +110,14 @@ class TransactionInput:
 		:param sender:
 		:return:
 		"""
-		output = self.find_transaction(blockchain=blockchain)
+		output = blockchain.UTXOs.get(self)						# O(1) lookup for unspent outputs
+		if output is None:
+			# Check if transaction is spent
+			if check_utxos:
+				log.debug(f'[TRANSACTION INP - {self.hash}] Validation failed (NOT IN UTXO LIST)')
+				return False
+			output = self.find_transaction(blockchain=blockchain)
+
 		if output is None:
 			log.debug(f'[TRANSACTION INP - {self.hash}] Validation failed (NON-EXISTENT).')
 			return False
@@ -67,16 +132,11 @@ class TransactionInput:
 			log.debug(f'[TRANSACTION INP - {self.hash}] Validation failed (BAD-SENDER).')
 			return False
 
-		# Check if transaction is spent
-		if check_utxos and self not in blockchain.UTXOs:
-			log.debug(f'[TRANSACTION INP - {self.hash}] Validation failed (NOT IN UTXO LIST)')
-			return False
-
 		return True
 
 	@property
 	def hash(self) -> str:
-		return hashlib.md5(self.to_json()).hexdigest()
+		return self._cached('md5', lambda: hashlib.md5(self.to_json()).hexdigest())
 
 	def to_dict(self):
 		return collections.OrderedDict({
@@ -85,6 +145,8 @@ class TransactionInput:
 			'output_index': self.output_index})
 
 	def to_json(self, indent=None) -> bytes:
+		if indent is None:
+			return self._cached('json', lambda: json.dumps(self.to_dict(), sort_keys=True).encode('utf-8'))
 		return json.dumps(self.to_dict(), sort_keys=True, indent=indent).encode('utf-8')
 
 	def __repr__(self):
@@ -114,8 +176,22 @@ class TransactionInput:
 			output_index=output_index
 		)
 
+	def write(self, writer: encoding.Writer):
+		writer.pack(self._struct, self.block_index, self.transaction_index, self.output_index)
+
+	@classmethod
+	def read(cls, reader: encoding.Reader):
+		block_index, transaction_index, output_index = reader.unpack(cls._struct)
+		return cls(
+			block_index=block_index,
+			transaction_index=transaction_index,
+			output_index=output_index
+		)
+
+
+class TransactionOutput(encoding.BinarySerializable):
+	_kind = encoding.KIND_TRANSACTION_OUTPUT
 
-class TransactionOutput:
 	def __init__(self, recipient_address: str, value: int):
 		self.recipient_address: str = recipient_address
 		self.value: int = value
@@ -150,8 +226,22 @@ class TransactionOutput:
 			value=value
 		)
 
+	def write(self, writer: encoding.Writer):
+		writer.string(self.recipient_address)
+		writer.i64(self.value)
+
+	@classmethod
+	def read(cls, reader: encoding.Reader):
+		return cls(
+			recipient_address=reader.string(),
+			value=reader.i64()
+		)
+
+
+class Transaction(HashCache, encoding.BinarySerializable):
+	_hashed_fields = ('sender', 'inputs', 'outputs', 'timestamp', 'signature')
+	_kind = encoding.KIND_TRANSACTION
 
-class Transaction:
 	def __init__(self, sender: str = "", inputs: Tuple[TransactionInput] = (), outputs: Tuple[TransactionOutput] = (),
 				 timestamp: float = None, signature: str = None):
 		self.sender = sender  # Alternative -> Sender could be found dynamically by getting first transaction output?
@@ -182,37 +272,25 @@ class Transaction:
 
 		signer = sender.signer
 
-		self.signature = None
-		h = SHA256.new(self.to_json())
+		h = SHA256.new(self.signing_json())
 		self.signature = binascii.hexlify(signer.sign(h)).decode('ascii')
 
+	def signature_job(self, coinbase=False) -> tuple:
+		"""
+		:param coinbase: Coinbase transactions are signed by the recipient of their first output.
+		:return: Tuple (signer address, signed message, signature) to be verified.
+		"""
+		if coinbase:
+			address = self.outputs[0].recipient_address if self.outputs else None
+		else:
+			address = self.sender
+		return address, self.signing_json(), self.signature  # Hash of the transaction without its signature
+
 	def verify_signature(self, coinbase=False) -> bool:
 		"""
 		:return: Whether the signature belongs to the actual sender or not
 		"""
-		signature = self.signature
-		result = False
-		try:
-			self.signature = None									# Remove signature to verify hash
-
-			if coinbase:
-				der_key = binascii.unhexlify(self.outputs[0].recipient_address)
-			else:
-				der_key = binascii.unhexlify(self.sender)
-			sig = binascii.unhexlify(signature)
-
-			public_key = RSA.import_key(der_key)
-			h = SHA256.new(self.to_json())
-
-			signer = pkcs1_15.new(public_key)
-			signer.verify(h, sig)									# Verify that the hash and transaction match
-			result = True
-		except (ValueError, TypeError, Exception) as e:
-			result = False
-			log.error(e)
-		finally:
-			self.signature = signature								# Reset signature
-			return result
+		return _verify_signature(self.signature_job(coinbase))
 
 	def __calculate_input(self) -> int:
 		self.__balance_input = sum([inp.balance for inp in self.inputs])
@@ -222,8 +300,11 @@ class Transaction:
 		self.__transaction_fee = 0 if coinbase else self.__calculate_input() - self.balance_output
 		return self.__transaction_fee
 
-	def check_validity(self, blockchain, is_coinbase=False, check_utxos=False) -> bool:
-		if not self.verify_signature(is_coinbase):
+	def check_validity(self, blockchain, is_coinbase=False, check_utxos=False, check_signature=True) -> bool:
+		"""
+		:param check_signature: False if the signature was already verified, e.g. by a SignatureVerifier.
+		"""
+		if check_signature and not self.verify_signature(is_coinbase):
 			log.debug(f'[TRANSACTION - {self.hash}] Validation failed (SIGNATURE)')
 			return False
 
@@ -249,7 +330,7 @@ class Transaction:
 
 	@property
 	def hash(self) -> str:
-		return hashlib.md5(self.to_json()).hexdigest()
+		return self._cached('md5', lambda: hashlib.md5(self.to_json()).hexdigest())
 
 	def to_dict(self):
 		return collections.OrderedDict({
@@ -261,8 +342,20 @@ class Transaction:
 		})
 
 	def to_json(self, indent=None):
+		if indent is None:
+			return self._cached('json', lambda: json.dumps(self.to_dict(), sort_keys=True).encode('utf-8'))
 		return json.dumps(self.to_dict(), sort_keys=True, indent=indent).encode('utf-8')
 
+	def signing_json(self) -> bytes:
+		"""
+		:return: Canonical JSON of the transaction with its signature removed, as signed by the sender.
+		"""
+		def build():
+			data = self.to_dict()
+			data['signature'] = None
+			return json.dumps(data, sort_keys=True).encode('utf-8')
+		return self._cached('unsigned', build)
+
 	def __repr__(self):
 		return self.to_json()
 
@@ -286,3 +379,128 @@ class Transaction:
 			timestamp=timestamp,
 			signature=signature
 		)
+
+	def to_bytes(self) -> bytes:
+		return self._cached('binary', super().to_bytes)
+
+	def write(self, writer: encoding.Writer):
+		writer.string(self.sender)
+		writer.u32(len(self.inputs))
+		for inp in self.inputs:
+			inp.write(writer)
+		writer.u32(len(self.outputs))
+		for out in self.outputs:
+			out.write(writer)
+		writer.f64(self.timestamp)
+		writer.string(self.signature)
+
+	@classmethod
+	def read(cls, reader: encoding.Reader):
+		sender = reader.string()
+		inputs = tuple(TransactionInput.read(reader) for _ in range(reader.u32()))
+		outputs = tuple(TransactionOutput.read(reader) for _ in range(reader.u32()))
+		return cls(
+			sender=sender,
+			inputs=inputs,
+			outputs=outputs,
+			timestamp=reader.f64(),
+			signature=reader.string()
+		)
+
+
+def encode_transactions(transactions: List[Transaction]) -> bytes:
+	"""
+	:return: Binary encoding of a list of transactions.
+	"""
+	writer = encoding.Writer(encoding.KIND_TRANSACTIONS)
+	writer.u32(len(transactions))
+	for trans in transactions:
+		writer.raw(trans.to_bytes()[encoding.HEADER_SIZE:])  # Cached encoding without its message header
+	return writer.getvalue()
+
+
+def decode_transactions(data: bytes) -> List[Transaction]:
+	reader = encoding.Reader(data, encoding.KIND_TRANSACTIONS)
+	transactions = [Transaction.read(reader) for _ in range(reader.u32())]
+	reader.finish()
+	return transactions
+
+
+class SignatureVerifier:
+	"""
+	Batched signature verification.
+	Large batches (a block or a whole chain) are split across a process pool, small ones are verified in-process.
+	"""
+
+	def __init__(self, workers: int = None, min_batch: int = PARALLEL_MIN_BATCH):
+		"""
+		:param workers: Number of worker processes. Defaults to the number of CPUs.
+		:param min_batch: Smallest batch sent to the process pool.
+		"""
+		self.workers: int = workers or os.cpu_count() or 1
+		self.min_batch: int = min_batch
+		self._executor = None
+		self._lock = threading.Lock()
+
+	def _get_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+		with self._lock:
+			if self._executor is None:
+				self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+			return self._executor
+
+	def verify(self, jobs: List[tuple]) -> List[bool]:
+		"""
+		:param jobs: Signature jobs, as built by `Transaction.signature_job`.
+		:return: Whether each signature is valid or not.
+		"""
+		if self.workers <= 1 or len(jobs) < self.min_batch:
+			return [_verify_signature(job) for job in jobs]
+
+		chunksize = max(1, len(jobs) // (self.workers * 4))
+		try:
+			return list(self._get_executor().map(_verify_signature, jobs, chunksize=chunksize))
+		except concurrent.futures.BrokenExecutor:
+			log.error('Signature verification pool broke, verifying in-process.')
+			self.shutdown()
+			return [_verify_signature(job) for job in jobs]
+
+	def verify_transactions(self, transactions: List[Transaction]) -> List[bool]:
+		"""
+		:param transactions: Transactions that are not coinbase transactions.
+		:return: Whether each signature is valid or not.
+		"""
+		return self.verify([trans.signature_job() for trans in transactions])
+
+	def verify_block(self, block) -> List[bool]:
+		"""
+		:return: Whether the signature of each transaction of the block is valid or not.
+		"""
+		return self.verify_blocks([block])[0]
+
+	def verify_blocks(self, blocks) -> List[List[bool]]:
+		"""
+		Verify the signatures of many blocks as a single batch.
+		:return: Per block, whether the signature of each transaction is valid or not.
+		"""
+		jobs = []
+		for block in blocks:
+			for indx, trans in enumerate(block.verified_transactions):
+				jobs.append(trans.signature_job(coinbase=indx == 0))
+
+		results = self.verify(jobs)
+		per_block = []
+		offset = 0
+		for block in blocks:
+			count = len(block.verified_transactions)
+			per_block.append(results[offset:offset + count])
+			offset += count
+		return per_block
+
+	def shutdown(self):
+		with self._lock:
+			if self._executor is not None:
+				self._executor.shutdown(wait=False)
+				self._executor = None
+
+
+signature_verifier = SignatureVerifier()  # Shared by block and chain validation
@@ -0,0 +1,249 @@
+import bisect
+import threading
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import UniCoin.Transactions as Transactions
+
+import logging
+log = logging.getLogger('werkzeug')
+
+BNB_MAX_TRIES = 100000  # Branches explored by the branch-and-bound search before giving up
+
+# A wallet coin in the sorted index: (balance, block index, transaction index, output index)
+Coin = Tuple[int, int, int, int]
+
+
+def select_largest_first(coins: List[Coin], target: int) -> Optional[List[int]]:
+	"""
+	Spend the largest coins until the target is reached.
+	:param coins: Coins sorted by ascending balance.
+	:param target: Amount to reach.
+	:return: Positions of the selected coins in `coins`, None if they are not enough.
+	"""
+	selected = []
+	total = 0
+	for indx in range(len(coins) - 1, -1, -1):
+		if total >= target:
+			break
+		selected.append(indx)
+		total += coins[indx][0]
+	return selected if total >= target else None
+
+
+def select_min_inputs(coins: List[Coin], target: int) -> Optional[List[int]]:
+	"""
+	Spend as few coins as possible (the count largest-first needs), swapping the last one for the smallest coin
+	that still reaches the target, to leave less change.
+	:param coins: Coins sorted by ascending balance.
+	:param target: Amount to reach.
+	:return: Positions of the selected coins in `coins`, None if they are not enough.
+	"""
+	selected = select_largest_first(coins, target)
+	if not selected:
+		return selected
+	missing = target - sum(coins[indx][0] for indx in selected[:-1])
+	selected[-1] = bisect.bisect_left(coins, (missing,))  # Smallest coin of at least `missing`, never a selected one
+	return selected
+
+
+def select_branch_and_bound(coins: List[Coin], target: int, cost_of_change: int = 0,
+							max_tries: int = BNB_MAX_TRIES, available: int = None) -> Optional[List[int]]:
+	"""
+	Depth-first search, largest coins first, for a set of coins worth between `target` and
+	`target + cost_of_change`, so that no change output is needed. Keeps the set wasting the least.
+	:param coins: Coins sorted by ascending balance.
+	:param target: Amount to reach.
+	:param cost_of_change: Excess given up (to the miner) rather than creating a change output.
+	:param max_tries: Branches explored before giving up.
+	:param available: Total balance of `coins`, if already known.
+	:return: Positions of the selected coins in `coins`, None if no such set was found.
+	"""
+	count = len(coins)
+	upper = target + cost_of_change
+	if available is None:
+		available = sum(coin[0] for coin in coins)
+	if available < target:
+		return None
+
+	value = 0
+	depth = 0  # Next coin to decide, by descending balance
+	path: List[Tuple[int, int, bool]] = []  # Runs of decided coins: (first depth, coins, included)
+	best = None
+	best_waste = None
+	for _ in range(max_tries):
+		backtrack = False
+		if value + available < target or value > upper:
+			backtrack = True
+		elif value >= target:
+			waste = value - target
+			if best_waste is None or waste < best_waste:
+				best = [count - 1 - start for start, _, include in path if include]
+				best_waste = waste
+				if waste == 0:
+					break
+			backtrack = True
+
+		if backtrack:
+			while path and not path[-1][2]:  # Walk back past the omitted coins
+				start, decided, _ = path.pop()
+				available += coins[count - 1 - start][0] * decided
+			if not path:
+				break  # Every branch was explored
+			# Omit the last included coin instead, along with the coins of the same value after it:
+			# including any of them was already explored.
+			start, _, _ = path.pop()
+			coin_value = coins[count - 1 - start][0]
+			run = count - start - bisect.bisect_left(coins, (coin_value,))
+			value -= coin_value
+			available -= coin_value * (run - 1)
+			path.append((start, run, False))
+			depth = start + run
+		else:
+			coin_value = coins[count - 1 - depth][0]
+			path.append((depth, 1, True))
+			value += coin_value
+			available -= coin_value
+			depth += 1
+	return best
+
+
+STRATEGIES = {
+	'bnb': select_branch_and_bound,
+	'largest_first': select_largest_first,
+	'min_inputs': select_min_inputs,
+}
+DEFAULT_STRATEGY = 'bnb'
+FALLBACK_STRATEGY = 'min_inputs'  # When no exact match is found
+
+
+class UTXOTracker:
+	"""
+	Unspent outputs of a single address (our wallet), with a running balance.
+	Values are learned from the outputs of connected blocks, so each block only costs the outputs it creates
+	and the inputs it spends, whatever the size of the wallet.
+	Coins are also kept sorted by balance, so coin selection never sorts the wallet.
+	"""
+
+	def __init__(self, address: str, utxos: Iterable[Transactions.TransactionInput] = ()):
+		"""
+		:param address: Address whose outputs are tracked.
+		:param utxos: Its current unspent outputs, each with its balance set.
+		"""
+		self.address: str = address
+		self._utxos: Dict[Transactions.TransactionInput, int] = dict()  # Outpoint -> balance
+		self._balance: int = 0
+		self._sorted: List[Coin] = []  # By ascending balance
+		self._lock = threading.RLock()
+		self.reset(utxos)
+
+	@property
+	def balance(self) -> int:
+		return self._balance
+
+	def add(self, utxo: Transactions.TransactionInput) -> bool:
+		"""
+		:param utxo: Unspent output, with its balance set.
+		:return: Whether it was not tracked yet. Outputs without a (positive) balance are not tracked.
+		"""
+		if utxo.balance <= 0:
+			return False
+		with self._lock:
+			if utxo in self._utxos:
+				return False
+			self._utxos[utxo] = utxo.balance
+			self._balance += utxo.balance
+			bisect.insort(self._sorted, self.__coin(utxo, utxo.balance))
+			return True
+
+	def discard(self, utxo: Transactions.TransactionInput) -> bool:
+		"""
+		:return: Whether the output was tracked.
+		"""
+		with self._lock:
+			balance = self._utxos.pop(utxo, None)  # Outpoints compare by position, `utxo` may not carry a balance
+			if balance is None:
+				return False
+			self._balance -= balance
+			coin = self.__coin(utxo, balance)
+			del self._sorted[bisect.bisect_left(self._sorted, coin)]
+			return True
+
+	@staticmethod
+	def __coin(utxo: Transactions.TransactionInput, balance: int) -> Coin:
+		return balance, utxo.block_index, utxo.transaction_index, utxo.output_index
+
+	def reset(self, utxos: Iterable[Transactions.TransactionInput]):
+		with self._lock:
+			self._utxos = {utxo: utxo.balance for utxo in utxos if utxo.balance > 0}
+			self._balance = sum(self._utxos.values())
+			self._sorted = sorted(self.__coin(utxo, balance) for utxo, balance in self._utxos.items())
+
+	def select(self, target: int, strategy: str = DEFAULT_STRATEGY,
+			   cost_of_change: int = 0) -> Optional[List[Transactions.TransactionInput]]:
+		"""
+		Pick coins worth at least `target`.
+		:param strategy: Name of the strategy in `STRATEGIES`. Branch-and-bound falls back to `FALLBACK_STRATEGY`
+		when no set of coins matches the target closely enough.
+		:param cost_of_change: Excess the branch-and-bound search may give up rather than creating change.
+		:return: The selected coins, each with its balance set, None if the wallet cannot afford the target.
+		"""
+		if target <= 0:
+			raise ValueError('Target must be a positive amount!')
+		with self._lock:
+			if strategy == 'bnb':
+				selected = select_branch_and_bound(self._sorted, target, cost_of_change, available=self._balance)
+				if selected is None:
+					selected = STRATEGIES[FALLBACK_STRATEGY](self._sorted, target)
+			else:
+				selected = STRATEGIES[strategy](self._sorted, target)
+			if selected is None:
+				return None
+			return [
+				Transactions.TransactionInput(block_index, t_indx, o_indx, balance=balance)
+				for balance, block_index, t_indx, o_indx in (self._sorted[indx] for indx in selected)
+			]
+
+	def take(self, target: int, strategy: str = DEFAULT_STRATEGY,
+			 cost_of_change: int = 0) -> Optional[List[Transactions.TransactionInput]]:
+		"""
+		Atomically `select` coins and remove them from the wallet (spent by a transaction we are creating).
+		"""
+		with self._lock:
+			selected = self.select(target, strategy=strategy, cost_of_change=cost_of_change)
+			for utxo in selected or ():
+				self.discard(utxo)
+			return selected
+
+	def connect_block(self, block):
+		"""
+		Apply a block appended to our chain: drop the outputs it spends, add the ones paying us.
+		"""
+		with self._lock:
+			for transaction in block.verified_transactions:
+				for inp in transaction.inputs:
+					self.discard(inp)
+			for utxo in block.find_UTXOs(self.address):
+				self.add(utxo)
+
+	def disconnect_block(self, block, undo):
+		"""
+		Undo `connect_block` for a block leaving our chain.
+		:param undo: Undo record of the block (`Blockchain.BlockUndo`), giving back the outputs it spent.
+		"""
+		with self._lock:
+			for utxo in block.find_UTXOs(self.address):
+				self.discard(utxo)
+			for outpoint, output in undo.spent:
+				if output.recipient_address == self.address:
+					self.add(outpoint)
+
+	def __contains__(self, utxo: Transactions.TransactionInput):
+		return utxo in self._utxos
+
+	def __iter__(self):
+		with self._lock:
+			return iter(list(self._utxos))
+
+	def __len__(self):
+		return len(self._utxos)
@@ -0,0 +1,134 @@
+import collections
+import threading
+import time
+
+
+class LRUCache:
+	"""
+	Thread-safe mapping bounded to `max_size` entries, evicting the least recently used one.
+	Keeps hit/miss counters so that its effectiveness can be monitored.
+	"""
+
+	def __init__(self, max_size: int):
+		"""
+		:param max_size: Maximum number of entries kept.
+		"""
+		if max_size <= 0:
+			raise ValueError("Cache size must be a positive number!")
+		self.max_size: int = max_size
+		self._entries = collections.OrderedDict()
+		self._lock = threading.Lock()
+		self.hits: int = 0
+		self.misses: int = 0
+
+	def get(self, key, default=None):
+		with self._lock:
+			try:
+				value = self._entries[key]
+			except KeyError:
+				self.misses += 1
+				return default
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return value
+
+	def put(self, key, value):
+		with self._lock:
+			self._entries[key] = value
+			self._entries.move_to_end(key)
+			if len(self._entries) > self.max_size:
+				self._entries.popitem(last=False)
+
+	def get_or_create(self, key, factory):
+		"""
+		:param key: Key of the entry.
+		:param factory: Called with the key to create the entry on a miss. Exceptions are not cached.
+		:return: The cached or newly created entry.
+		"""
+		value = self.get(key, self)
+		if value is self:
+			value = factory(key)  # Outside of the lock, factories may be slow
+			self.put(key, value)
+		return value
+
+	def pop(self, key, default=None):
+		with self._lock:
+			return self._entries.pop(key, default)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self.hits = 0
+			self.misses = 0
+
+	@property
+	def hit_rate(self) -> float:
+		lookups = self.hits + self.misses
+		return self.hits / lookups if lookups else 0.0
+
+	def stats(self) -> dict:
+		return {
+			'size': len(self),
+			'max_size': self.max_size,
+			'hits': self.hits,
+			'misses': self.misses,
+			'hit_rate': self.hit_rate,
+		}
+
+	def __contains__(self, key):
+		with self._lock:
+			return key in self._entries
+
+	def __len__(self):
+		with self._lock:
+			return len(self._entries)
+
+
+class SeenCache(LRUCache):
+	"""
+	Bounded set of recently seen keys (e.g. hashes of processed messages).
+	Keys are forgotten once `max_size` newer keys were seen or, if set, after `ttl` seconds.
+	A hit is an `add` of a key that was already seen, membership tests are not counted.
+	"""
+
+	def __init__(self, max_size: int, ttl: float = None):
+		"""
+		:param max_size: Maximum number of keys remembered.
+		:param ttl: Seconds a key is remembered for, None to only evict by size.
+		"""
+		super().__init__(max_size)
+		self.ttl: float = ttl
+
+	def _expire(self, now: float):
+		if self.ttl is None:
+			return
+		entries = self._entries
+		while entries:
+			key, seen = next(iter(entries.items()))
+			if now - seen < self.ttl:
+				return
+			del entries[key]
+
+	def add(self, key) -> bool:
+		"""
+		Atomically check and mark a key as seen.
+		:return: True if the key was not seen before, False if it is a duplicate.
+		"""
+		now = time.monotonic()
+		with self._lock:
+			self._expire(now)
+			if key in self._entries:
+				self._entries[key] = now  # Seen again, keep it for longer
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return False
+			self.misses += 1
+			self._entries[key] = now
+			if len(self._entries) > self.max_size:
+				self._entries.popitem(last=False)
+			return True
+
+	def __contains__(self, key):
+		with self._lock:
+			seen = self._entries.get(key)
+		return seen is not None and (self.ttl is None or time.monotonic() - seen < self.ttl)
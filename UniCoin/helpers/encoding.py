@@ -0,0 +1,184 @@
+import binascii
+import struct
+
+from typing import Optional
+
+# Compact binary wire/storage format.
+# Every top level message starts with (VERSION, KIND), followed by the fixed size fields of the entity.
+# Strings and sequences are length-prefixed. Hex strings (DER keys, signatures, hashes) are stored as raw bytes.
+
+VERSION = 1
+MIME_TYPE = 'application/x-unicoin'
+
+KIND_TRANSACTION_INPUT = 1
+KIND_TRANSACTION_OUTPUT = 2
+KIND_TRANSACTION = 3
+KIND_BLOCK = 4
+KIND_BLOCKCHAIN = 5
+KIND_UTXO_SNAPSHOT = 6
+KIND_BLOCKS = 7
+KIND_TRANSACTIONS = 8
+KIND_BLOCK_UNDO = 9
+KIND_BLOCK_HEADER = 10
+KIND_HEADERS = 11
+
+_HEADER = struct.Struct('<BB')
+HEADER_SIZE = _HEADER.size
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+_I64 = struct.Struct('<q')
+_F64 = struct.Struct('<d')
+
+_STR_NONE = 0
+_STR_HEX = 1
+_STR_TEXT = 2
+
+_HEX_DIGITS = frozenset('0123456789abcdef')
+
+
+class DecodeError(ValueError):
+	pass
+
+
+class Writer:
+	def __init__(self, kind: int = None):
+		"""
+		:param kind: Kind of the top level message. Nested writers omit it.
+		"""
+		self._parts = []
+		if kind is not None:
+			self._parts.append(_HEADER.pack(VERSION, kind))
+
+	def pack(self, fmt: struct.Struct, *values):
+		self._parts.append(fmt.pack(*values))
+
+	def u16(self, value: int):
+		self._parts.append(_U16.pack(value))
+
+	def u32(self, value: int):
+		self._parts.append(_U32.pack(value))
+
+	def u64(self, value: int):
+		self._parts.append(_U64.pack(value))
+
+	def i64(self, value: int):
+		self._parts.append(_I64.pack(value))
+
+	def f64(self, value: float):
+		self._parts.append(_F64.pack(value))
+
+	def blob(self, value: bytes):
+		self._parts.append(_U32.pack(len(value)))
+		self._parts.append(value)
+
+	def string(self, value: Optional[str]):
+		"""
+		Lowercase hex strings are stored as their raw bytes, anything else as UTF-8.
+		"""
+		if value is None:
+			self._parts.append(bytes((_STR_NONE,)))
+		elif len(value) % 2 == 0 and _HEX_DIGITS.issuperset(value):
+			self._parts.append(bytes((_STR_HEX,)))
+			self.blob(binascii.unhexlify(value))
+		else:
+			self._parts.append(bytes((_STR_TEXT,)))
+			self.blob(value.encode('utf-8'))
+
+	def raw(self, value: bytes):
+		self._parts.append(value)
+
+	def getvalue(self) -> bytes:
+		return b''.join(self._parts)
+
+
+class Reader:
+	def __init__(self, data: bytes, kind: int = None):
+		"""
+		:param data: Encoded message.
+		:param kind: Expected kind of the top level message.
+		"""
+		self._data = memoryview(data)
+		self._offset = 0
+		if kind is not None:
+			version, actual = self.unpack(_HEADER)
+			if version != VERSION:
+				raise DecodeError(f'Unsupported encoding version {version}.')
+			if actual != kind:
+				raise DecodeError(f'Expected message kind {kind}, got {actual}.')
+
+	def unpack(self, fmt: struct.Struct) -> tuple:
+		try:
+			values = fmt.unpack_from(self._data, self._offset)
+		except struct.error as e:
+			raise DecodeError('Truncated message.') from e
+		self._offset += fmt.size
+		return values
+
+	def u16(self) -> int:
+		return self.unpack(_U16)[0]
+
+	def u32(self) -> int:
+		return self.unpack(_U32)[0]
+
+	def u64(self) -> int:
+		return self.unpack(_U64)[0]
+
+	def i64(self) -> int:
+		return self.unpack(_I64)[0]
+
+	def f64(self) -> float:
+		return self.unpack(_F64)[0]
+
+	def blob(self) -> bytes:
+		length = self.u32()
+		end = self._offset + length
+		if end > len(self._data):
+			raise DecodeError('Truncated message.')
+		value = self._data[self._offset:end].tobytes()
+		self._offset = end
+		return value
+
+	def string(self) -> Optional[str]:
+		tag = self._data[self._offset] if self._offset < len(self._data) else None
+		self._offset += 1
+		if tag == _STR_NONE:
+			return None
+		elif tag == _STR_HEX:
+			return binascii.hexlify(self.blob()).decode('ascii')
+		elif tag == _STR_TEXT:
+			return self.blob().decode('utf-8')
+		raise DecodeError(f'Unknown string tag {tag}.')
+
+	def finish(self):
+		"""
+		Ensure the whole message was consumed.
+		"""
+		if self._offset != len(self._data):
+			raise DecodeError('Trailing data after message.')
+
+
+class BinarySerializable:
+	"""
+	Mixin providing `to_bytes`/`from_bytes` for entities implementing `write` and `read`.
+	"""
+	_kind: int = None
+
+	def write(self, writer: Writer):
+		raise NotImplementedError
+
+	@classmethod
+	def read(cls, reader: Reader):
+		raise NotImplementedError
+
+	def to_bytes(self) -> bytes:
+		writer = Writer(self._kind)
+		self.write(writer)
+		return writer.getvalue()
+
+	@classmethod
+	def from_bytes(cls, data: bytes):
+		reader = Reader(data, cls._kind)
+		entity = cls.read(reader)
+		reader.finish()
+		return entity
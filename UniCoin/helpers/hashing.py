@@ -0,0 +1,105 @@
+import hashlib
+
+from typing import List, Tuple
+
+
+class HashCache:
+	"""
+	Mixin memoizing the canonical JSON bytes of an entity and the digests computed from them.
+	The cache is dropped whenever one of the `_hashed_fields` is assigned. Fields holding mutable
+	containers must be reassigned (or `invalidate_hash` called) after being changed in place.
+	"""
+	_hashed_fields = ()
+
+	def __setattr__(self, name, value):
+		if name in self._hashed_fields:
+			self.__dict__.pop('_hash_cache', None)
+		object.__setattr__(self, name, value)
+
+	def _cached(self, key: str, factory):
+		"""
+		:param key: Name of the cached value.
+		:param factory: Computes the value on a cache miss.
+		:return: The cached value.
+		"""
+		cache = self.__dict__.get('_hash_cache')
+		if cache is None:
+			cache = self.__dict__['_hash_cache'] = {}
+
+		try:
+			return cache[key]
+		except KeyError:
+			value = cache[key] = factory()
+			return value
+
+	def invalidate_hash(self):
+		self.__dict__.pop('_hash_cache', None)
+
+
+def _merkle_parent(left: bytes, right: bytes) -> bytes:
+	return hashlib.sha256(left + right).digest()
+
+
+def merkle_levels(leaves: List[bytes]) -> List[List[bytes]]:
+	"""
+	Build a Merkle tree bottom-up. A node without a sibling is carried up to the next level unchanged
+	(it is not paired with itself, so no two lists of leaves share a root).
+	:param leaves: Digests of the leaves.
+	:return: Every level of the tree, leaves first and root last.
+	"""
+	levels = [list(leaves) or [hashlib.sha256(b'').digest()]]
+	while len(levels[-1]) > 1:
+		level = levels[-1]
+		parents = [_merkle_parent(level[indx], level[indx + 1]) for indx in range(0, len(level) - 1, 2)]
+		if len(level) % 2 == 1:
+			parents.append(level[-1])
+		levels.append(parents)
+	return levels
+
+
+def merkle_root(leaves: List[bytes]) -> str:
+	"""
+	:param leaves: Digests of the leaves.
+	:return: Hex digest of the Merkle root.
+	"""
+	return merkle_levels(leaves)[-1][0].hex()
+
+
+def merkle_branch(leaves: List[bytes], index: int) -> List[Tuple[str, str]]:
+	"""
+	Inclusion proof of a leaf: the siblings on its path to the root.
+	:param leaves: Digests of the leaves.
+	:param index: Position of the leaf.
+	:return: List of (side, hex digest) pairs from the leaf up, side is 'L' if the sibling is on the left.
+	"""
+	if not 0 <= index < len(leaves):
+		raise IndexError(f'No leaf \'{index}\' in a tree of {len(leaves)} leaves.')
+	branch = []
+	for level in merkle_levels(leaves)[:-1]:
+		sibling = index ^ 1
+		if sibling < len(level):
+			branch.append(('L' if sibling < index else 'R', level[sibling].hex()))
+		index //= 2
+	return branch
+
+
+def verify_merkle_branch(leaf: bytes, branch, root: str) -> bool:
+	"""
+	:param leaf: Digest of the leaf.
+	:param branch: Inclusion proof of the leaf, see `merkle_branch`.
+	:param root: Hex digest of the expected Merkle root.
+	:return: Whether the leaf is part of the tree with that root.
+	"""
+	node = leaf
+	try:
+		for side, sibling in branch:
+			sibling = bytes.fromhex(sibling)
+			if side == 'L':
+				node = _merkle_parent(sibling, node)
+			elif side == 'R':
+				node = _merkle_parent(node, sibling)
+			else:
+				return False
+	except (TypeError, ValueError):
+		return False
+	return node.hex() == root
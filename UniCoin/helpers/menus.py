@@ -11,11 +11,12 @@ def menu_select_client_type(private_key, my_peer=None):
 	print('-'*23, ' [UNICOIN - Select Client Type] ', '-'*23)
 	print('1. Client')
 	print('2. Miner')
+	print('3. Lite Client (headers only)')
 	print('0. Exit')
 
 	while True:
 		inp = int(input('Selection: '))
-		if inp not in range(0, 3):
+		if inp not in range(0, 4):
 			print('Incorrect input. Try again.')
 			continue
 		break
@@ -24,6 +25,8 @@ def menu_select_client_type(private_key, my_peer=None):
 		exit(0)
 	elif inp == 1:
 		return Nodes.Client(private_key, my_peer=my_peer)
+	elif inp == 3:
+		return Nodes.LiteClient(private_key, my_peer=my_peer)
 	else:
 		return Nodes.Miner(private_key, my_peer=my_peer)
 
@@ -96,6 +99,8 @@ def menu_main(my_node: Nodes.Client):
 	if inp == 0:
 		exit(0)
 	elif inp == 1:
+		if isinstance(my_node, Nodes.LiteClient) and not my_node.sync():
+			print('Could not synchronize with any peer, showing the last known balance.')
 		t = PrettyTable(['Transaction', 'Balance'])
 		total = 0
 		for utxo in my_node.my_UTXOs:
@@ -138,7 +143,10 @@ def menu_main(my_node: Nodes.Client):
 			else:
 				print('Action cancelled!')
 	elif inp == 3:
-		print(my_node.blockchain)
+		if my_node.stores_blocks:
+			print(my_node.blockchain)
+		else:  # Lite clients only keep the headers
+			print('\n'.join(map(repr, my_node.headers.headers)))
 	elif inp == 4:
 		if log.level is not logging.DEBUG:
 			log.setLevel(logging.DEBUG)
@@ -1,4 +1,5 @@
 PATH_DATA = 'data'
 PATH_WALLETS = f'{PATH_DATA}/wallets'
+PATH_CHAINS = f'{PATH_DATA}/chains'
 
 FILE_NODELIST = f'{PATH_DATA}/node_list.json'
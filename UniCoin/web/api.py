@@ -1,9 +1,12 @@
+import functools
 import json
 import UniCoin.Nodes as Nodes
 import UniCoin.Transactions as Transactions
 import UniCoin.Blockchain as Blockchain
+import UniCoin.Wallet as Wallet
+import UniCoin.helpers.encoding as encoding
 
-from flask import request
+from flask import request, Response
 from UniCoin import app, my_node
 
 import logging
@@ -13,26 +16,83 @@ log = logging.getLogger('werkzeug')
 # TODO: Then proceed in Controller classes?
 
 
+def read_entity(cls):
+	"""
+	Parse the request body as either the binary or the JSON encoding of `cls`.
+	:param cls: Entity class providing from_bytes/from_json.
+	:return: The parsed entity, None if the body is malformed.
+	"""
+	try:
+		if request.mimetype == encoding.MIME_TYPE:
+			return cls.from_bytes(request.get_data())
+
+		json_data = request.get_json(silent=True)
+		if not json_data:
+			return None
+		# Older peers post the JSON document as a JSON string
+		return cls.from_json(json.loads(json_data) if isinstance(json_data, str) else json_data)
+	except Exception as e:
+		log.error(e)
+		return None
+
+
+def accepts_binary() -> bool:
+	"""
+	:return: Whether the client prefers the binary encoding over JSON.
+	"""
+	return request.accept_mimetypes.best_match(['application/json', encoding.MIME_TYPE]) == encoding.MIME_TYPE
+
+
+def iter_json_array(documents):
+	"""
+	Stream a JSON array of already serialized JSON documents.
+	:param documents: Iterable of JSON strings.
+	"""
+	yield '['
+	for indx, document in enumerate(documents):
+		yield f', {document}' if indx else document
+	yield ']'
+
+
+def requires_blocks(route):
+	"""
+	Answer 404 on nodes that do not store blocks (lite clients), instead of running the blockchain route.
+	"""
+	@functools.wraps(route)
+	def wrapper(*args, **kwargs):
+		if not my_node.stores_blocks:
+			return json.dumps({
+				'message': 'Blocks are not stored by this node.'
+			}), 404
+		return route(*args, **kwargs)
+	return wrapper
+
+
+def block_response(block: Blockchain.Block):
+	"""
+	:return: JSON (or binary if requested) representation of a block.
+	"""
+	if accepts_binary():
+		return Response(block.to_bytes(), mimetype=encoding.MIME_TYPE)
+	return Response(block.to_json(), mimetype='application/json')
+
+
 # --- BROADCAST ROUTES ---
 @app.route('/api/broadcasts/new_block', methods=['POST'])
 def broadcasts_new_block():
 	"""
 	:return:
 	"""
-	json_data = request.get_json()
-	if not json_data:
+	block = read_entity(Blockchain.Block)
+	if block is None:
 		return json.dumps({
-			'message': 'Incorrect JSON Data.'
+			'message': 'Incorrect Block Data.'
 		}), 400
-	data = json.loads(json_data)
-	block = Blockchain.Block.from_json(data)
 
-	if block.hash in my_node.processed_hashes:
+	if not my_node.processed_hashes.add(block.hash):
 		return json.dumps({
 			'message': 'Already processed',
 		})
-	else:
-		my_node.processed_hashes.append(block.hash)
 
 	log.debug(f'[BLOCK - {block.hash}] Received')
 	if isinstance(my_node, Nodes.Miner):
@@ -42,73 +102,44 @@ def broadcasts_new_block():
 				blockchain=my_node.blockchain
 		):
 			log.debug(f'[BLOCK - {block.hash}] Validated')
-			my_node.blockchain.blocks.append(block)
+			my_node.blockchain.append_block(block)  # Also updates the UTXO set
+			my_node.mining_engine.cancel()  # Our current block is now stale
 
-			# -- UPDATE UTXO SET --
-			my_node.blockchain.UTXOs.difference_update(block.extract_STXOs())
-			my_node.blockchain.UTXOs = set(my_node.blockchain.UTXOs.union(block.extract_UTXOs()))
-			# ---------------------
-
-			# -- UPDATE MY UTXO SET --
-			my_utxos = set(block.find_UTXOs(my_node.identity))
-			my_node.my_UTXOs = my_node.my_UTXOs.union(my_utxos)
-			my_node.my_UTXOs.intersection_update(my_node.blockchain.UTXOs)
-			for my_utxo in my_node.my_UTXOs:  # This will fail, but will cache the value
-				my_utxo.check_validity(sender=None, blockchain=my_node.blockchain)
-			# ---------------------
+			my_node.wallet.connect_block(block)  # Only the outputs it spends or creates
 
 			# -- REMOVE (NOW) INVALID TRANSACTIONS --
-			for trans in block.verified_transactions:
-				my_node.verified_transactions.pop(trans.hash, None)
+			my_node.mempool.remove_block(block)  # Mined ones and the ones spending the same outputs
 			# ---------------------------------------
 			my_node.network.broadcast_block(block)
+			if my_node.block_tree.block_connected(block):  # Orphans were waiting for it
+				my_node.connect_best_branch()
+		elif block.previous_block_hash == my_node.blockchain.last_block.calculate_hash():
+			log.debug(f'[BLOCK - {block.hash}] Rejected (INVALID)')
 		else:
-			if block.index > my_node.blockchain.last_block.index + 1:
-				log.debug(f'[BLOCK - {block.hash}] Rejected (AHEAD)')
-				chain = my_node.network.check_peer_chains(my_node.blockchain.size)
-				if chain:
-					log.debug('[BLOCKCHAIN] Fetched bigger valid chain.')
-					# -- UPDATE MY UTXO SET --
-					diff = Blockchain.BlockChain.find_block_diff(
-						old_blocks=my_node.blockchain.blocks,
-						new_blocks=chain.blocks
-					)
-
-					# 2 Different for loops just in case a UTXO has just changed it's block
-					# position.
-
-					# Remove OLD UTXOs
-					for indx in diff:
-						tmp_block: Blockchain.Block = my_node.blockchain.blocks[indx]
-						old_utxos = tmp_block.find_UTXOs(my_node.identity)
-						my_node.my_UTXOs.difference_update(old_utxos)
-
-						# -- COLLECT VALID TRANSACTIONS from our rejected block --
-						for t_indx in range(1, len(tmp_block.verified_transactions)):
-							trans = tmp_block.verified_transactions[t_indx]
-							my_node.verified_transactions[trans.hash] = trans
-
-					# Add new UTXOs
-					for indx in range(diff[0], len(chain.blocks)):
-						tmp_block: Blockchain.Block = chain.blocks[indx]
-						new_utxos = tmp_block.find_UTXOs(my_node.identity)
-						for n in new_utxos:
-							log.error(f'Added UTXO: {n.hash}')
-						my_node.my_UTXOs = my_node.my_UTXOs.union(new_utxos)
-
-						# -- REMOVE TRANSACTIONS that are already in the block --
-						for t_indx in range(1, len(tmp_block.verified_transactions)):
-							trans = tmp_block.verified_transactions[t_indx]
-							my_node.verified_transactions.pop(trans.hash, None)
-					# ---------------------
-
-					my_node.blockchain = chain
-
-					my_node.my_UTXOs.intersection_update(my_node.blockchain.UTXOs)
-					for my_utxo in my_node.my_UTXOs:  # This will fail, but will cache the value
-						my_utxo.check_validity(sender=None, blockchain=my_node.blockchain)
-			else:
-				log.debug(f'[BLOCK - {block.hash}] Rejected (INVALID)')
+			# -- SIDE BRANCH OR ORPHAN --
+			block_hash = block.calculate_hash()
+			my_node.block_tree.add(block)
+			if my_node.block_tree.is_orphan(block_hash):
+				log.debug(f'[BLOCK - {block.hash}] Orphan, fetching its missing parents')
+				if not my_node.fetch_missing_parents(block_hash):
+					log.debug(f'[BLOCK - {block.hash}] Rejected (AHEAD)')
+					branch = my_node.network.find_best_branch(my_node.blockchain)
+					if branch:
+						log.debug('[BLOCKCHAIN] Fetched bigger valid chain.')
+						try:
+							# Disconnects our blocks after the fork point and connects the new ones, updating
+							# the UTXO set, our UTXOs and the mempool as it goes.
+							my_node.reorganize(*branch)
+						except ValueError as e:
+							log.debug(f'[BLOCKCHAIN] Reorganization failed ({e})')
+			# Only validated once its branch has more work than our chain
+			if my_node.connect_best_branch():
+				my_node.network.broadcast_block(block)
+			# ---------------------------
+	elif isinstance(my_node, Nodes.LiteClient):
+		if my_node.receive_header(block.header()):  # Only its header is kept
+			log.debug(f'[BLOCK - {block.hash}] Header appended, ECHOING')
+			my_node.network.broadcast_block(block)
 	elif type(my_node) is Nodes.Client:
 		log.debug(f'[BLOCK - {block.hash}] ECHOING')
 		if block.check_validity(my_node.blockchain, lite=True):
@@ -119,25 +150,104 @@ def broadcasts_new_block():
 	})
 
 
-@app.route('/api/broadcasts/new_transaction', methods=['POST'])
-def broadcasts_new_transaction():
+@app.route('/api/broadcasts/new_header', methods=['POST'])
+def broadcasts_new_header():
 	"""
+	Header of a new block, announced to lite clients instead of the block.
 	:return:
 	"""
-	json_data = request.get_json()
-	if not json_data:
+	header = read_entity(Blockchain.BlockHeader)
+	if header is None:
+		return json.dumps({
+			'message': 'Incorrect Header Data.'
+		}), 400
+
+	if not isinstance(my_node, Nodes.LiteClient):
 		return json.dumps({
-			'message': 'Incorrect JSON Data.'
+			'message': 'Only lite clients follow headers.'
 		}), 400
-	data = json.loads(json_data)
-	transaction = Transactions.Transaction.from_json(data)
 
-	if transaction.hash in my_node.processed_hashes:
+	header_hash = header.calculate_hash()
+	if not my_node.processed_hashes.add(header_hash):
 		return json.dumps({
 			'message': 'Already processed',
 		})
-	else:
-		my_node.processed_hashes.append(transaction.hash)
+
+	if my_node.receive_header(header):
+		log.debug(f'[HEADER - {header_hash}] Appended')
+
+	return json.dumps({
+		'message': 'ok',
+	})
+
+
+@app.route('/api/broadcasts/new_transaction', methods=['POST'])
+def broadcasts_new_transaction():
+	"""
+	:return:
+	"""
+	transaction = read_entity(Transactions.Transaction)
+	if transaction is None:
+		return json.dumps({
+			'message': 'Incorrect Transaction Data.'
+		}), 400
+
+	return json.dumps({
+		'message': process_transaction(transaction),
+	})
+
+
+@app.route('/api/inventory/transactions', methods=['POST'])
+def receive_transaction_inventory():
+	"""
+	A peer announces the hashes of transactions it has.
+	:return: The hashes of the transactions we have not processed yet, to be sent through
+	/api/broadcasts/transactions.
+	"""
+	json_data = request.get_json(silent=True)
+	if not json_data or not isinstance(json_data.get('hashes'), list):
+		return json.dumps({
+			'message': 'Incorrect Inventory Data.'
+		}), 400
+
+	mempool = my_node.mempool if isinstance(my_node, Nodes.Miner) else ()
+	return json.dumps({
+		'missing': [
+			t_hash for t_hash in json_data['hashes']
+			if t_hash not in my_node.processed_hashes and t_hash not in mempool
+		],
+	})
+
+
+@app.route('/api/broadcasts/transactions', methods=['POST'])
+def broadcasts_new_transactions():
+	"""
+	Receive the bodies of transactions requested from an inventory announcement, in bulk.
+	:return:
+	"""
+	try:
+		if request.mimetype == encoding.MIME_TYPE:
+			transactions = Transactions.decode_transactions(request.get_data())
+		else:
+			transactions = list(map(Transactions.Transaction.from_json, request.get_json()['transactions']))
+	except Exception as e:
+		log.error(e)
+		return json.dumps({
+			'message': 'Incorrect Transaction Data.'
+		}), 400
+
+	return json.dumps({
+		'messages': [process_transaction(transaction) for transaction in transactions],
+	})
+
+
+def process_transaction(transaction: Transactions.Transaction) -> str:
+	"""
+	Validate (miners) and relay a transaction received from a peer.
+	:return: Message for the peer.
+	"""
+	if not my_node.processed_hashes.add(transaction.hash):
+		return 'Already processed'
 
 	if isinstance(my_node, Nodes.Miner):
 		success = my_node.add_transaction(transaction)
@@ -150,13 +260,12 @@ def broadcasts_new_transaction():
 		log.debug(f'[TRANSACTION - {transaction.hash}] ECHOING')
 		my_node.network.broadcast_transaction(transaction)
 
-	return json.dumps({
-		'message': 'ok',
-	})
+	return 'ok'
 
 
 # --- BLOCKCHAIN ROUTES ---
 @app.route('/api/blockchain/length', methods=['GET'])
+@requires_blocks
 def get_blockchain_length():
 	"""
 	:return: JSON representation of the node's blockchain length.
@@ -167,17 +276,148 @@ def get_blockchain_length():
 
 
 @app.route('/api/blockchain/chain', methods=['GET'])
+@requires_blocks
 def get_blockchain_chain():
 	"""
-	:return: JSON representation of the node's blockchain.
+	:return: JSON (or binary if requested) representation of the node's blockchain, streamed block by block.
+	"""
+	blockchain = my_node.blockchain
+	if accepts_binary():
+		return Response(blockchain.iter_bytes(), mimetype=encoding.MIME_TYPE)
+
+	size = blockchain.size
+	utxos = list(blockchain.UTXOs)
+
+	def generate():
+		yield f'{{"length": {size}, "chain": '
+		yield from iter_json_array(blockchain.blocks[indx].to_json().decode('utf-8') for indx in range(size))
+		yield ', "utxos": '
+		yield from iter_json_array(utxo.to_json().decode('utf-8') for utxo in utxos)
+		yield '}'
+
+	return Response(generate(), mimetype='application/json')
+
+
+def read_range(max_items: int):
+	"""
+	Read the `start`/`end` query arguments of a range route, clamped to the chain and to `max_items`.
+	:return: Tuple (start, end) of the block range [start, end).
+	"""
+	size = my_node.blockchain.size
+	start = min(max(request.args.get('start', 0, type=int), 0), size)
+	end = min(max(request.args.get('end', size, type=int), start), size, start + max_items)
+	return start, end
+
+
+@app.route('/api/blockchain/headers', methods=['GET'])
+@requires_blocks
+def get_blockchain_headers():
+	"""
+	:return: JSON (or binary if requested) representation of the headers of blocks [start, end) (paged).
+	"""
+	start, end = read_range(Nodes.HEADERS_PAGE)
+	blocks = my_node.blockchain.blocks
+	headers = [blocks[indx].header() for indx in range(start, end)]
+	if accepts_binary():
+		return Response(Blockchain.encode_headers(headers), mimetype=encoding.MIME_TYPE)
+	return json.dumps({
+		'start': start,
+		'end': end,
+		'headers': [header.to_dict() for header in headers]
+	})
+
+
+@app.route('/api/blockchain/blocks', methods=['GET'])
+@requires_blocks
+def get_blockchain_blocks():
+	"""
+	:return: JSON (or binary if requested) representation of blocks [start, end) (paged), streamed block by block.
+	"""
+	start, end = read_range(Nodes.BLOCKS_PAGE)
+	blocks = my_node.blockchain.blocks
+	if accepts_binary():
+		return Response(
+			Blockchain.iter_encode_blocks((blocks[indx] for indx in range(start, end)), end - start),
+			mimetype=encoding.MIME_TYPE
+		)
+
+	def generate():
+		yield f'{{"start": {start}, "end": {end}, "blocks": '
+		yield from iter_json_array(blocks[indx].to_json().decode('utf-8') for indx in range(start, end))
+		yield '}'
+
+	return Response(generate(), mimetype='application/json')
+
+
+@app.route('/api/blockchain/blocks/<int:index>', methods=['GET'])
+@requires_blocks
+def get_blockchain_block(index):
+	"""
+	:return: JSON (or binary if requested) representation of the block at `index`.
+	"""
+	blockchain = my_node.blockchain
+	if not 0 <= index < blockchain.size:
+		return json.dumps({
+			'message': 'Block not found.'
+		}), 404
+	return block_response(blockchain.blocks[index])
+
+
+@app.route('/api/blockchain/blocks/hash/<block_hash>', methods=['GET'])
+@requires_blocks
+def get_blockchain_block_by_hash(block_hash):
+	"""
+	:return: JSON (or binary if requested) representation of the block with SHA256 hash `block_hash`.
 	"""
+	block = my_node.blockchain.find_block(block_hash)
+	if block is None:
+		return json.dumps({
+			'message': 'Block not found.'
+		}), 404
+	return block_response(block)
+
+
+@app.route('/api/blockchain/blocks/<int:index>/proof/<int:transaction_index>', methods=['GET'])
+@requires_blocks
+def get_merkle_proof(index, transaction_index):
+	"""
+	:return: JSON representation of a transaction of the block at `index` and of the Merkle proof of its inclusion,
+	checked by lite clients against the block's header.
+	"""
+	blockchain = my_node.blockchain
+	if not 0 <= index < blockchain.size or \
+			not 0 <= transaction_index < len(blockchain.blocks[index].verified_transactions):
+		return json.dumps({
+			'message': 'Transaction not found.'
+		}), 404
+	block = blockchain.blocks[index]
 	return json.dumps({
-		'length': my_node.blockchain.size,
-		'chain': list(map(lambda o: o.to_dict(), my_node.blockchain.blocks)),
-		'utxos': list(map(lambda o: o.to_dict(), my_node.blockchain.UTXOs)),
+		'block_index': index,
+		'transaction_index': transaction_index,
+		'transaction': block.verified_transactions[transaction_index].to_dict(),
+		'merkle_root': block.merkle_root,
+		'proof': block.merkle_proof(transaction_index)
 	})
 
 
+@app.route('/api/blockchain/utxos/<address>', methods=['GET'])
+@requires_blocks
+def get_address_utxos(address):
+	"""
+	:return: JSON representation of the unspent outputs of `address`, streamed output by output.
+	"""
+	utxos = my_node.blockchain.UTXOs.find(address)
+
+	def generate():
+		yield f'{{"length": {len(utxos)}, "total": {sum(utxo.balance for utxo in utxos)}, "utxos": '
+		yield from iter_json_array(
+			json.dumps(dict(utxo.to_dict(), value=utxo.balance), sort_keys=True) for utxo in utxos
+		)
+		yield '}'
+
+	return Response(generate(), mimetype='application/json')
+
+
 @app.route('/api/transactions/pending', methods=['GET'])
 def get_pending_transactions():
 	"""
@@ -189,8 +429,47 @@ def get_pending_transactions():
 		}), 404
 
 	return json.dumps({
-		'length': len(my_node.verified_transactions),
-		'transactions': list(map(lambda o: o.to_dict(), my_node.verified_transactions))
+		'length': len(my_node.mempool),
+		'transactions': list(map(lambda o: o.to_dict(), my_node.mempool)),
+		'stats': my_node.mempool.stats()
+	})
+
+
+@app.route('/api/transactions/batch', methods=['POST'])
+def send_batch_payment():
+	"""
+	Send many payments at once, packed into few transactions (see `Client.send_batch`).
+	Expects a JSON object with a list of `payments` ({"recipient": address, "amount": int}) and optionally
+	the `fee` per transaction and the coin selection `strategy`.
+	:return: JSON representation of the status of each payment.
+	"""
+	if not isinstance(my_node, Nodes.Client):
+		return json.dumps({
+			'message': 'Node must be a client or miner to send payments.'
+		}), 404
+
+	json_data = request.get_json(silent=True)
+	if not isinstance(json_data, dict) or not isinstance(json_data.get('payments'), list):
+		return json.dumps({
+			'message': 'Expected a json object with a list of payments.'
+		}), 400
+	fee = json_data.get('fee', 0)
+	strategy = json_data.get('strategy', Wallet.DEFAULT_STRATEGY)
+	if type(fee) is not int or fee < 0 or strategy not in Wallet.STRATEGIES:
+		return json.dumps({
+			'message': 'Incorrect fee or coin selection strategy.'
+		}), 400
+
+	payments = [
+		(payment.get('recipient'), payment.get('amount')) if isinstance(payment, dict) else None
+		for payment in json_data['payments']
+	]
+	statuses = my_node.send_batch(payments, fee=fee, strategy=strategy)
+	return json.dumps({
+		'length': len(statuses),
+		'sent': sum(status['status'] == 'sent' for status in statuses),
+		'transactions': len({status['transaction'] for status in statuses if status['status'] == 'sent'}),
+		'payments': statuses
 	})
 
 
@@ -206,7 +485,7 @@ def my_utxo():
 	# TODO: Create transaction!
 	return json.dumps({
 		'length': len(my_node.my_UTXOs),
-		'total': sum([t.value for t in my_node.my_UTXOs]),
+		'total': my_node.balance,
 		'UTXOs':  list(map(lambda o: o.to_dict(), my_node.my_UTXOs)),
 	})
 
@@ -235,6 +514,17 @@ def get_node_information():
 	})
 
 
+@app.route('/api/nodes/broadcasts', methods=['GET'])
+def get_broadcast_stats():
+	"""
+	:return: JSON representation of the node's broadcast queues (depth, throughput and latency)
+	and of its cache of processed messages.
+	"""
+	stats = my_node.network.broadcast_stats()
+	stats['processed'] = my_node.processed_hashes.stats()
+	return json.dumps(stats)
+
+
 @app.route('/api/nodes/register', methods=['POST'])
 def receive_registration_request():
 	"""
@@ -258,14 +548,17 @@ def receive_registration_request():
 			if my_node.network.register_peer(peer):
 				registered.append(address)
 				# TODO: This should be extracted to somewhere else, otherwise the node could be attacked.
-				if my_node.network.check_chain_length(peer) > my_node.blockchain.size:
-					log.debug(f'[PEER] \'{peer}\' has longer blockchain length.')
-					chain = my_node.network.steal_blockchain(peer)
-					if chain.check_validity():
-						my_node.blockchain = chain
+				if isinstance(my_node, Nodes.LiteClient):  # Headers only
+					if my_node.network.sync_headers(peer, my_node.headers):
+						my_node.sync_payments(peer)
+						log.debug(f'[PEER] Now using the headers of peer \'{peer}\'')
+				elif my_node.network.fetch_node_type(peer) == Nodes.LiteClient.__name__.upper():
+					my_node.network.register_lite_peer(peer)  # Has no blocks to sync with, gets headers only
+				else:
+					branch = my_node.network.sync_branch(peer, my_node.blockchain)
+					if branch is not None:
+						my_node.reorganize(*branch)
 						log.debug(f'[PEER] Now using the blockchain of peer \'{peer}\'')
-					else:
-						log.debug(f'[PEER] Failed to validate blockchain of peer \'{peer}\'.')
 			else:
 				not_registered.append(address)
 		except Exception as e:
@@ -0,0 +1,78 @@
+"""
+Coin selection benchmark.
+Compares the old selection of `Client.send_coins` (sort the whole wallet, spend the smallest coins first, no change)
+against the strategies of `Wallet.UTXOTracker.select` on large wallets: selection time, inputs spent and size
+of the resulting transaction.
+
+Usage: python -m benchmarks.coin_selection [payments] [wallet sizes...]
+"""
+import binascii
+import operator
+import os
+import random
+import sys
+import time
+
+import UniCoin.Transactions as Transactions
+import UniCoin.Wallet as Wallet
+
+ADDRESS = '30' * 81  # Length of an hex encoded 1024 bits DER public key
+SIGNATURE = binascii.hexlify(os.urandom(128)).decode('ascii')
+
+
+def make_wallet(size: int, rng: random.Random):
+	return [
+		Transactions.TransactionInput(indx // 100, indx % 100, 0, balance=rng.randint(1, 1000))
+		for indx in range(size)
+	]
+
+
+def select_smallest_first(utxos, target: int):
+	"""
+	The selection `Client.send_coins` used to make.
+	"""
+	selected = []
+	allocated = 0
+	for utxo in sorted(utxos, key=operator.attrgetter('balance')):
+		if allocated >= target:
+			break
+		selected.append(utxo)
+		allocated += utxo.balance
+	return selected if allocated >= target else None
+
+
+def transaction_size(inputs, target: int, change: bool) -> int:
+	outputs = [Transactions.TransactionOutput(ADDRESS, target)]
+	excess = sum(utxo.balance for utxo in inputs) - target
+	if change and excess > 0:
+		outputs.append(Transactions.TransactionOutput(ADDRESS, excess))
+	transaction = Transactions.Transaction(ADDRESS, tuple(inputs), tuple(outputs), signature=SIGNATURE)
+	return len(transaction.to_bytes())
+
+
+def run(name: str, select, targets, change: bool):
+	started = time.perf_counter()
+	selections = [select(target) for target in targets]
+	elapsed = time.perf_counter() - started
+	inputs = sum(len(selected) for selected in selections)
+	size = sum(transaction_size(selected, target, change) for selected, target in zip(selections, targets))
+	print(f'  {name:<15}: {elapsed / len(targets) * 1000:8.3f}ms/selection, '
+		  f'{inputs / len(targets):7.1f} inputs, {size / len(targets):9,.0f} bytes/transaction')
+
+
+def main():
+	payments = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+	sizes = [int(size) for size in sys.argv[2:]] or [10 ** 4, 10 ** 5]
+	for size in sizes:
+		rng = random.Random(size)
+		utxos = make_wallet(size, rng)
+		targets = [rng.randint(1, 20000) for _ in range(payments)]
+		tracker = Wallet.UTXOTracker(ADDRESS, utxos)
+		print(f'{size:,} coins, {payments} payments')
+		run('smallest first', lambda target: select_smallest_first(utxos, target), targets, change=False)
+		for strategy in Wallet.STRATEGIES:
+			run(strategy, lambda target: tracker.select(target, strategy=strategy), targets, change=True)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,82 @@
+"""
+Encoding benchmark.
+Compares size and encode/decode throughput of the binary encoding against the JSON path used by the API
+(`to_json().decode()` posted as a JSON string, then `json.loads` + `from_json` on the receiving side).
+
+Usage: python -m benchmarks.encoding [transactions] [rounds]
+"""
+import binascii
+import json
+import os
+import sys
+import time
+
+from Crypto.PublicKey import RSA
+
+import UniCoin.Blockchain as Blockchain
+import UniCoin.Transactions as Transactions
+
+
+def make_block(transactions: int) -> Blockchain.Block:
+	keys = [binascii.hexlify(RSA.generate(1024).publickey().exportKey(format='DER')).decode('ascii') for _ in range(4)]
+	verified_transactions = []
+	for t_indx in range(transactions):
+		verified_transactions.append(Transactions.Transaction(
+			sender=keys[t_indx % len(keys)],
+			inputs=tuple(Transactions.TransactionInput(t_indx, i, 0) for i in range(2)),
+			outputs=tuple(Transactions.TransactionOutput(keys[(t_indx + o) % len(keys)], 10 + o) for o in range(2)),
+			signature=binascii.hexlify(os.urandom(128)).decode('ascii')
+		))
+	return Blockchain.Block(index=1, proof=12345, verified_transactions=verified_transactions,
+							previous_block_hash=binascii.hexlify(os.urandom(32)).decode('ascii'))
+
+
+def json_encode(block):
+	return json.dumps(block.to_json().decode('utf-8')).encode('utf-8')
+
+
+def json_decode(data):
+	return Blockchain.Block.from_json(json.loads(json.loads(data)))
+
+
+def timed(function, argument, rounds):
+	started = time.perf_counter()
+	for _ in range(rounds):
+		function(argument)
+	return rounds / (time.perf_counter() - started)
+
+
+def main():
+	transactions = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+	rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+	block = make_block(transactions)
+
+	# Bypass the per-instance caches of the block and of its transactions, measure the actual serialization
+	def invalidate(b):
+		b.invalidate_hash()
+		for trans in b.verified_transactions:
+			trans.invalidate_hash()
+
+	def binary_encode(b):
+		invalidate(b)
+		return b.to_bytes()
+
+	def json_encode_uncached(b):
+		invalidate(b)
+		return json_encode(b)
+
+	json_data = json_encode(block)
+	binary_data = block.to_bytes()
+	assert Blockchain.Block.from_bytes(binary_data).hash == block.hash == json_decode(json_data).hash
+
+	print(f'Block with {transactions} transactions')
+	print(f'size   json: {len(json_data):>9,} B   binary: {len(binary_data):>9,} B '
+		  f'({len(binary_data) / len(json_data):.0%})')
+	print(f'encode json: {timed(json_encode_uncached, block, rounds):>9,.0f}/s binary: '
+		  f'{timed(binary_encode, block, rounds):>9,.0f}/s')
+	print(f'decode json: {timed(json_decode, json_data, rounds):>9,.0f}/s binary: '
+		  f'{timed(Blockchain.Block.from_bytes, binary_data, rounds):>9,.0f}/s')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,110 @@
+"""
+Gossip throughput benchmark.
+Starts a few nodes on localhost ports and broadcasts transactions to all of them, first with a new connection
+(and a new thread pool) per message, then through the keep-alive asyncio transport of `Nodes.PeerNetwork`.
+
+Usage: python -m benchmarks.gossip [nodes] [transactions] [first port]
+"""
+import concurrent.futures
+import logging
+import subprocess
+import sys
+import time
+
+import requests
+
+import UniCoin.Nodes as Nodes
+import UniCoin.Transactions as Transactions
+import UniCoin.helpers.encoding as encoding
+
+
+def serve(port: int):
+	"""
+	Run a node without a peer address (and so without a stored chain or any peers of its own).
+	"""
+	import UniCoin
+	UniCoin.my_node = Nodes.Miner(Nodes.KeyFactory.create_key())
+	import UniCoin.web
+	logging.getLogger('werkzeug').setLevel(logging.CRITICAL)  # Rejected transactions are expected
+	UniCoin.app.run(port=port, threaded=True)
+
+
+def start_nodes(count: int, first_port: int):
+	processes = [
+		subprocess.Popen([sys.executable, '-m', 'benchmarks.gossip', 'serve', str(port)])
+		for port in range(first_port, first_port + count)
+	]
+	peers = [Nodes.Peer('127.0.0.1', port) for port in range(first_port, first_port + count)]
+	for peer in peers:
+		for _ in range(100):
+			try:
+				requests.get(f'http://{peer}/api/blockchain/length', timeout=1)
+				break
+			except requests.ConnectionError:
+				time.sleep(0.1)
+	return processes, peers
+
+
+def make_transactions(count: int):
+	return [
+		Transactions.Transaction(sender='00', outputs=(Transactions.TransactionOutput('00', t_indx),))
+		for t_indx in range(count)
+	]
+
+
+def broadcast_unpooled(peers, data: bytes) -> int:
+	"""
+	Broadcast the way gossip used to be sent: a thread pool per message and a connection per peer.
+	"""
+	def post(peer):
+		response = requests.post(
+			f'http://{peer}/api/broadcasts/new_transaction',
+			data=data,
+			headers={'Content-Type': encoding.MIME_TYPE}
+		)
+		return response.status_code == 200
+
+	with concurrent.futures.ThreadPoolExecutor() as executor:
+		return sum(executor.map(post, peers))
+
+
+def main():
+	if len(sys.argv) > 2 and sys.argv[1] == 'serve':
+		serve(int(sys.argv[2]))
+		return
+
+	nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+	count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+	first_port = int(sys.argv[3]) if len(sys.argv) > 3 else 5400
+	processes, peers = start_nodes(nodes, first_port)
+	try:
+		transactions = make_transactions(2 * count)
+
+		started = time.perf_counter()
+		sent = sum(broadcast_unpooled(peers, trans.to_bytes()) for trans in transactions[:count])
+		unpooled_elapsed = time.perf_counter() - started
+		assert sent == count * nodes
+
+		network = Nodes.PeerNetwork()
+		network.peers.clear()  # Only the benchmark's nodes, not the ones of data/node_list.json
+		network.peers.update(peers)
+		started = time.perf_counter()
+		for trans in transactions[count:]:
+			network.broadcast_transaction(trans)
+		network.transactions_queue.join()
+		pooled_elapsed = time.perf_counter() - started
+		stats = network.broadcast_stats()['transactions']
+		network.shutdown()
+		assert stats['sent'] == count and stats['failed'] == 0
+
+		print(f'{nodes} nodes, {count} transactions each')
+		print(f'connection per message: {count / unpooled_elapsed:,.0f} broadcasts/s')
+		print(f'asyncio transport     : {count / pooled_elapsed:,.0f} broadcasts/s '
+			  f'({unpooled_elapsed / pooled_elapsed:.1f}x, average latency {stats["average_latency"] * 1000:.1f}ms)')
+	finally:
+		for process in processes:
+			process.terminate()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,60 @@
+"""
+Proof-of-Work checking benchmark.
+Checks that `Blockchain.ProofVerifier` agrees with `Blockchain.verify_proof` and compares guesses per second.
+
+Usage: python -m benchmarks.proof_check [guesses]
+"""
+import sys
+import time
+
+import UniCoin.Blockchain as Blockchain
+
+
+def make_header(index: int) -> Blockchain.BlockHeader:
+	return Blockchain.BlockHeader(index, Blockchain.GENESIS_PREVIOUS_HASH, '00' * 32, 1000.0 + index)
+
+
+def check_equivalence(guesses=20000):
+	for difficulty in range(1, 6):
+		for header in map(make_header, (0, 7, 42, 123456789)):
+			prefix = header.prefix()
+			verifier = Blockchain.ProofVerifier(prefix, difficulty)
+			expected = [Blockchain.verify_proof(prefix, proof, difficulty) for proof in range(guesses)]
+			assert verifier.verify_many(range(guesses)) == expected, (prefix, difficulty)
+
+			first = expected.index(True) if True in expected else None
+			assert verifier.search(0, guesses) == first, (prefix, difficulty)
+
+			if first is not None:  # The header carrying the proof hashes to a valid block hash
+				header.proof = first
+				assert header.check_proof(difficulty), (prefix, difficulty)
+
+
+def bench_verify_proof(prefix, guesses, difficulty):
+	started = time.perf_counter()
+	for proof in range(guesses):
+		Blockchain.verify_proof(prefix, proof, difficulty)
+	return guesses / (time.perf_counter() - started)
+
+
+def bench_verifier(prefix, guesses, difficulty):
+	started = time.perf_counter()
+	# A 64 digit target is never met in practice, so `search` checks the whole range
+	Blockchain.ProofVerifier(prefix, difficulty).search(0, guesses)
+	return guesses / (time.perf_counter() - started)
+
+
+def main():
+	guesses = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+	check_equivalence()
+	print('ProofVerifier agrees with verify_proof.')
+
+	prefix = make_header(42).prefix()
+	before = bench_verify_proof(prefix, guesses, 64)
+	after = bench_verifier(prefix, guesses, 64)
+	print(f'verify_proof           : {before:,.0f} guesses/s')
+	print(f'ProofVerifier.search   : {after:,.0f} guesses/s ({after / before:.1f}x)')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,52 @@
+"""
+Proof-of-Work benchmark.
+Compares the sequential `Blockchain.proof_of_work` loop against the multi-process `Mining.ProofOfWorkEngine`.
+
+Usage: python -m benchmarks.proof_of_work [difficulty] [rounds]
+"""
+import os
+import sys
+import time
+
+import UniCoin.Blockchain as Blockchain
+import UniCoin.Mining as Mining
+
+
+def bench_sequential(prefixes, difficulty):
+	hashes = 0
+	started = time.perf_counter()
+	for prefix in prefixes:
+		hashes += Blockchain.proof_of_work(prefix, difficulty) + 1
+	return hashes, time.perf_counter() - started
+
+
+def bench_engine(engine, prefixes, difficulty):
+	started = time.perf_counter()
+	for prefix in prefixes:
+		proof = engine.search(prefix, difficulty)
+		assert Blockchain.verify_proof(prefix, proof, difficulty)
+	return engine.total_hashes, time.perf_counter() - started
+
+
+def main():
+	difficulty = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+	rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+	prefixes = [
+		Blockchain.BlockHeader(index, Blockchain.GENESIS_PREVIOUS_HASH, '00' * 32, 1000.0 + index).prefix()
+		for index in range(1, rounds + 1)
+	]
+
+	hashes, elapsed = bench_sequential(prefixes, difficulty)
+	print(f'sequential       : {rounds} proofs in {elapsed:.2f}s ({hashes / elapsed:,.0f} H/s)')
+
+	engine = Mining.ProofOfWorkEngine()
+	engine.search(prefixes[0], 1)  # Warm up the worker processes
+	engine.total_hashes, engine.total_elapsed = 0, 0.0
+	hashes, elapsed = bench_engine(engine, prefixes, difficulty)
+	print(f'engine ({engine.workers} workers): {rounds} proofs in {elapsed:.2f}s ({hashes / elapsed:,.0f} H/s)')
+	engine.shutdown()
+
+
+if __name__ == '__main__':
+	print(f'CPUs: {os.cpu_count()}')
+	main()
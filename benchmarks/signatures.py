@@ -0,0 +1,57 @@
+"""
+Signature verification benchmark.
+Compares verifying transactions one after another against the process pool of `Transactions.SignatureVerifier`.
+
+Usage: python -m benchmarks.signatures [transactions] [workers]
+"""
+import binascii
+import os
+import sys
+import time
+
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import pkcs1_15
+
+import UniCoin.Transactions as Transactions
+
+
+def make_transactions(count: int):
+	keys = [RSA.generate(1024) for _ in range(8)]
+	transactions = []
+	for t_indx in range(count):
+		key = keys[t_indx % len(keys)]
+		trans = Transactions.Transaction(
+			sender=binascii.hexlify(key.publickey().exportKey(format='DER')).decode('ascii'),
+			inputs=(Transactions.TransactionInput(t_indx, 1, 0),),
+			outputs=(Transactions.TransactionOutput('00', 10),),
+		)
+		trans.signature = binascii.hexlify(pkcs1_15.new(key).sign(SHA256.new(trans.signing_json()))).decode('ascii')
+		transactions.append(trans)
+	return transactions
+
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+	workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+	transactions = make_transactions(count)
+
+	started = time.perf_counter()
+	sequential = [trans.verify_signature() for trans in transactions]
+	sequential_elapsed = time.perf_counter() - started
+
+	verifier = Transactions.SignatureVerifier(workers=workers)
+	verifier.verify_transactions(transactions[:verifier.min_batch])  # Warm up the pool
+	started = time.perf_counter()
+	batched = verifier.verify_transactions(transactions)
+	batched_elapsed = time.perf_counter() - started
+	verifier.shutdown()
+
+	assert sequential == batched and all(batched)
+	print(f'sequential           : {count / sequential_elapsed:,.0f} signatures/s')
+	print(f'verifier ({workers} workers): {count / batched_elapsed:,.0f} signatures/s '
+		  f'({sequential_elapsed / batched_elapsed:.1f}x)')
+
+
+if __name__ == '__main__':
+	main()